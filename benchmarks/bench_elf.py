@@ -0,0 +1,57 @@
+"""
+Compare the program header based dynamic segment reader against pyelftools.
+
+Usage: python benchmarks/bench_elf.py [ELF files...]
+
+Defaults to (up to 200) shared libraries found in /usr/lib.
+"""
+
+from collections.abc import Callable
+from typing import IO
+import argparse
+import glob
+import time
+import io
+
+from autorider.elf import DynamicInfo, read_dynamic, read_dynamic_elftools
+
+
+def bench(
+    read: Callable[[IO[bytes]], DynamicInfo], blobs: list[bytes], rounds: int
+) -> float:
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for blob in blobs:
+            _ = read(io.BytesIO(blob))
+    return time.perf_counter() - start
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    _ = parser.add_argument("paths", nargs="*")
+    _ = parser.add_argument("--rounds", type=int, default=5)
+    args = parser.parse_args()
+
+    paths: list[str] = args.paths or sorted(glob.glob("/usr/lib/*/lib*.so.*"))[:200]
+
+    blobs: list[bytes] = []
+    for path in paths:
+        try:
+            with open(path, "rb") as fp:
+                blob = fp.read()
+        except OSError:
+            continue
+        if blob[:4] == b"\x7fELF":
+            blobs.append(blob)
+
+    rounds: int = args.rounds
+    total = len(blobs) * rounds
+    print(f"parsing {len(blobs)} ELF files x {rounds} rounds")
+
+    for label, read in (("read_dynamic", read_dynamic), ("pyelftools", read_dynamic_elftools)):
+        elapsed = bench(read, blobs, rounds)
+        print(f"{label:>14}: {elapsed:8.3f}s ({total / elapsed:10.1f} files/s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,191 @@
+"""
+Hermetic benchmark of the scan pipeline using synthetic inputs & fake nix tools.
+
+Usage: python -m benchmarks.bench_pipeline [--packages N] [--update-baseline]
+
+Reports per-stage timings & throughput, comparing against the stored baseline.
+Exits non-zero if a stage regressed beyond the tolerance. Baselines are machine
+specific, regenerate with --update-baseline when changing benchmark hardware.
+"""
+
+from collections.abc import Callable
+from pathlib import Path
+from typing import IO
+import tempfile
+import argparse
+import time
+import json
+import glob
+import sys
+import os
+
+from benchmarks.synthetic import make_fake_tools, make_workspace
+
+from autorider.config import AutoriderConfig
+from autorider.download import Fetcher
+from autorider.process import lookup_sonames, process_pkgs
+from autorider.readers import TarReader, ZipReader
+from autorider.runner import configure_runner
+from autorider.scanners import ELF_MEMO, ElfMemo, ScanContext, ScanDepends, WheelScanner
+from autorider.uv import Uv2nix
+
+
+BASELINE = Path(__file__).parent.joinpath("baseline.json")
+
+
+def _discard(name: str, fp: IO[bytes]) -> None:  # pyright: ignore[reportUnusedParameter]
+    _ = fp.read()
+
+
+def timed(fn: Callable[[], int], repeat: int) -> tuple[float, int]:
+    """Best wall clock time of fn over repeat runs, with the number of items it processed"""
+    best = float("inf")
+    items = 0
+    for _ in range(repeat):
+        start = time.perf_counter()
+        items = fn()
+        best = min(best, time.perf_counter() - start)
+    return best, items
+
+
+def run_benchmarks(root: Path, args: argparse.Namespace) -> dict[str, dict[str, float]]:
+    repeat: int = args.repeat
+    wheels = sorted(Path(p) for p in glob.glob(str(root.joinpath("artifacts", "*.whl"))))
+    sdists = sorted(Path(p) for p in glob.glob(str(root.joinpath("artifacts", "*.tar.gz"))))
+
+    def zip_reader() -> int:
+        for wheel in wheels:
+            ZipReader(wheel, lambda name: name.endswith(".so"), _discard).run()
+        return len(wheels)
+
+    def tar_reader() -> int:
+        for sdist in sdists:
+            TarReader(sdist, lambda name: name.endswith(".toml"), _discard).run()
+        return len(sdists)
+
+    sonames: set[str] = set()
+
+    def wheel_scanner() -> int:
+        # A fresh memo each round so libraries are parsed rather than memoised across runs
+        memo = ElfMemo()
+        for wheel in wheels:
+            scanner = WheelScanner(wheel, ScanDepends.WHEEL, memo=memo)
+            scanner.run()
+            sonames.update(scanner.result().native_depends)
+        return len(wheels)
+
+    config = AutoriderConfig.model_validate(
+        {
+            "outputs": {
+                "build-systems": True,
+                "wheel-depends-so": True,
+                "sdist-depends-so": True,
+                "build-requires": True,
+            },
+            "jobs": args.jobs,
+        }
+    )
+
+    def pipeline() -> int:
+        # A fresh fetcher & ELF memo each round so fetches & parsing aren't memoised across runs
+        ELF_MEMO.clear()
+        context = ScanContext(fetcher=Fetcher())
+        return len(process_pkgs(config, Uv2nix(root).generate(), context))
+
+    def resolve() -> int:
+        return len(lookup_sonames(sonames, []))
+
+    results: dict[str, dict[str, float]] = {}
+    for stage, fn in (
+        ("ZipReader", zip_reader),
+        ("TarReader", tar_reader),
+        ("WheelScanner", wheel_scanner),
+        ("process_pkgs", pipeline),
+        ("lookup_sonames", resolve),
+    ):
+        seconds, items = timed(fn, repeat)
+        results[stage] = {"seconds": round(seconds, 4), "items": items}
+
+    return results
+
+
+def report(
+    results: dict[str, dict[str, float]],
+    baseline: dict[str, dict[str, float]],
+    tolerance: float,
+) -> bool:
+    """Print results, returning whether any stage regressed"""
+    regressed = False
+    print(f"{'stage':>16} {'seconds':>9} {'items/s':>10} {'baseline':>9} {'ratio':>6}")
+    for stage, result in results.items():
+        seconds = result["seconds"]
+        line = f"{stage:>16} {seconds:9.3f} {result['items'] / seconds:10.1f}"
+
+        base = baseline.get(stage)
+        if base:
+            ratio = seconds / base["seconds"]
+            line += f" {base['seconds']:9.3f} {ratio:6.2f}"
+            if ratio > tolerance:
+                line += "  REGRESSION"
+                regressed = True
+        print(line)
+    return regressed
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    _ = parser.add_argument("--packages", type=int, default=100)
+    _ = parser.add_argument("--so-count", type=int, default=4, help=".so members per wheel")
+    _ = parser.add_argument("--so-size", type=int, default=64 * 1024, help="Bytes per .so member")
+    _ = parser.add_argument("--sdist-size", type=int, default=256 * 1024, help="Payload bytes per sdist")
+    _ = parser.add_argument("--latency", type=float, default=0.05, help="Seconds per fake nix tool call")
+    _ = parser.add_argument("--jobs", type=int, default=4)
+    _ = parser.add_argument("--repeat", type=int, default=3)
+    _ = parser.add_argument("--tolerance", type=float, default=1.5, help="Regression ratio threshold")
+    _ = parser.add_argument("--baseline", type=Path, default=BASELINE)
+    _ = parser.add_argument("--update-baseline", action="store_true")
+    args = parser.parse_args()
+
+    params = {
+        "packages": args.packages,
+        "so-count": args.so_count,
+        "so-size": args.so_size,
+        "sdist-size": args.sdist_size,
+        "latency": args.latency,
+        "jobs": args.jobs,
+    }
+
+    with tempfile.TemporaryDirectory(prefix="autorider-bench-") as tmp:
+        root = Path(tmp)
+        _ = make_workspace(root, args.packages, args.so_count, args.so_size, args.sdist_size)
+        make_fake_tools(root.joinpath("bin"), root.joinpath("artifacts"), args.latency)
+
+        # Keep real nix tools & any nix-index database out of the measurement
+        os.environ["PATH"] = f"{root.joinpath('bin')}:{os.environ['PATH']}"
+        os.environ["NIX_INDEX_DATABASE"] = str(root.joinpath("nix-index"))
+        _ = configure_runner()
+
+        results = run_benchmarks(root, args)
+
+    baseline_path: Path = args.baseline
+    baseline: dict[str, dict[str, float]] = {}
+    if baseline_path.exists():
+        stored = json.loads(baseline_path.read_text())  # pyright: ignore[reportAny]
+        if stored["params"] == params:
+            baseline = stored["stages"]  # pyright: ignore[reportAny]
+        else:
+            print("baseline was recorded with different parameters, not comparing")
+
+    regressed = report(results, baseline, args.tolerance)
+
+    if args.update_baseline:
+        _ = baseline_path.write_text(
+            json.dumps({"params": params, "stages": results}, indent=2) + "\n"
+        )
+        print(f"Wrote {baseline_path}")
+    elif regressed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
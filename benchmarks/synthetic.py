@@ -0,0 +1,233 @@
+"""
+Synthetic inputs for hermetic benchmarks: lock files, artifacts & fake nix tools.
+"""
+
+from collections.abc import Sequence
+from pathlib import Path
+import hashlib
+import tarfile
+import textwrap
+import zipfile
+import random
+import struct
+import sys
+import io
+
+from autorider import elf
+
+
+# Base URL of synthetic artifacts, never actually fetched
+BASE_URL = "https://bench.invalid/files"
+
+
+FAKE_NIX_INSTANTIATE = """
+#!{python}
+# Resolve fetchurl specs to pre-generated artifacts
+import posixpath
+import json
+import time
+import sys
+
+time.sleep({latency!r})
+
+specs = json.loads(sys.argv[sys.argv.index("args") + 1])
+print(json.dumps([
+    posixpath.join({artifacts!r}, posixpath.basename(spec["args"]["url"]))
+    for spec in specs
+]))
+"""
+
+FAKE_NIX_LOCATE = """
+#!{python}
+import time
+import sys
+
+time.sleep({latency!r})
+print("bench." + sys.argv[-1].split(".so")[0].removeprefix("lib"))
+"""
+
+
+def build_elf(
+    needed: Sequence[str] = ("libfoo.so.1", "libbar.so.2"),
+    soname: str = "libself.so.3",
+    runpath: str | None = None,
+    elf_class: int = elf.ELFCLASS64,
+    endian: str = "<",
+    padding: int = 0,
+) -> bytes:
+    """Build a minimal shared object with a dynamic segment"""
+    strings = [soname, *needed] + ([runpath] if runpath is not None else [])
+    strtab = b"\x00" + b"".join(s.encode() + b"\x00" for s in strings)
+
+    offsets: list[int] = []
+    offset = 1
+    for s in strings:
+        offsets.append(offset)
+        offset += len(s) + 1
+
+    if elf_class == elf.ELFCLASS64:
+        ehdr_size, phdr_fmt, dyn_fmt = 64, "IIQQQQQQ", "qQ"
+    else:
+        ehdr_size, phdr_fmt, dyn_fmt = 52, "IIIIIIII", "iI"
+    phdr_size = struct.calcsize(endian + phdr_fmt)
+    vaddr = 0x400000
+    phoff = ehdr_size
+    strtab_offset = phoff + phdr_size * 2
+    dyn_offset = strtab_offset + len(strtab)
+
+    dyn_entries = [(elf.DT_SONAME, offsets[0])]
+    dyn_entries.extend((elf.DT_NEEDED, offset) for offset in offsets[1 : len(needed) + 1])
+    if runpath is not None:
+        dyn_entries.append((elf.DT_RUNPATH, offsets[-1]))
+    dyn_entries.extend(
+        [
+            (elf.DT_STRTAB, vaddr + strtab_offset),
+            (elf.DT_STRSZ, len(strtab)),
+            (elf.DT_NULL, 0),
+        ]
+    )
+    dyn_size = struct.calcsize(endian + dyn_fmt) * len(dyn_entries)
+    file_size = dyn_offset + dyn_size + padding
+
+    ident = elf.ELF_MAGIC + bytes(
+        [elf_class, elf.ELFDATA2LSB if endian == "<" else elf.ELFDATA2MSB, 1]
+    ) + b"\x00" * 9
+    if elf_class == elf.ELFCLASS64:
+        ehdr = ident + struct.pack(
+            endian + "HHIQQQIHHHHHH", 3, 62, 1, 0, phoff, 0, 0, ehdr_size, phdr_size, 2, 0, 0, 0
+        )
+        phdrs = struct.pack(
+            endian + phdr_fmt, elf.PT_LOAD, 5, 0, vaddr, vaddr, file_size, file_size, 0x1000
+        )
+        phdrs += struct.pack(
+            endian + phdr_fmt,
+            elf.PT_DYNAMIC,
+            6,
+            dyn_offset,
+            vaddr + dyn_offset,
+            vaddr + dyn_offset,
+            dyn_size,
+            dyn_size,
+            8,
+        )
+    else:
+        ehdr = ident + struct.pack(
+            endian + "HHIIIIIHHHHHH", 3, 3, 1, 0, phoff, 0, 0, ehdr_size, phdr_size, 2, 0, 0, 0
+        )
+        phdrs = struct.pack(
+            endian + phdr_fmt, elf.PT_LOAD, 0, vaddr, vaddr, file_size, file_size, 5, 0x1000
+        )
+        phdrs += struct.pack(
+            endian + phdr_fmt,
+            elf.PT_DYNAMIC,
+            dyn_offset,
+            vaddr + dyn_offset,
+            vaddr + dyn_offset,
+            dyn_size,
+            dyn_size,
+            6,
+            4,
+        )
+    dyn = b"".join(struct.pack(endian + dyn_fmt, tag, val) for tag, val in dyn_entries)
+
+    # Padding stands in for code & is placed after the dynamic segment like .text would
+    return ehdr + phdrs + strtab + dyn + b"\x00" * padding
+
+
+def make_wheel(path: Path, name: str, so_count: int, so_size: int, rng: random.Random) -> None:
+    with zipfile.ZipFile(path, "w", compression=zipfile.ZIP_DEFLATED) as zf:
+        zf.writestr(f"{name}/__init__.py", b"")
+        for i in range(so_count):
+            # Libraries link against each other & a few shared system libraries
+            needed = [f"lib{name}_{j}.so" for j in range(i)][-2:]
+            needed += [f"libext{rng.randrange(50)}.so.1", "libc.so.6"]
+            zf.writestr(
+                f"{name}/_native{i}.cpython-312-x86_64-linux-gnu.so",
+                build_elf(needed, f"lib{name}_{i}.so", padding=so_size),
+            )
+        zf.writestr(f"{name}-1.0.0.dist-info/METADATA", f"Name: {name}\nVersion: 1.0.0\n")
+
+
+def make_sdist(path: Path, name: str, size: int, rng: random.Random) -> None:
+    prefix = f"{name}-1.0.0"
+    members: dict[str, bytes] = {
+        "pyproject.toml": textwrap.dedent("""
+            [build-system]
+            requires = ["setuptools>=61", "cython"]
+            build-backend = "setuptools.build_meta"
+        """).encode(),
+        "CMakeLists.txt": b"project(bench)\n",
+        f"src/{name}/__init__.py": b"",
+        # Incompressible source payload sized to control decompression cost
+        f"src/{name}/data.bin": rng.randbytes(size),
+    }
+
+    with tarfile.open(path, "w:gz") as tf:
+        for member, data in members.items():
+            info = tarfile.TarInfo(f"{prefix}/{member}")
+            info.size = len(data)
+            tf.addfile(info, io.BytesIO(data))
+
+
+def _file_entry(path: Path) -> str:
+    sha256 = hashlib.sha256(path.read_bytes()).hexdigest()
+    return (
+        f'url = "{BASE_URL}/{path.name}", '
+        f'hash = "sha256:{sha256}", size = {path.stat().st_size}'
+    )
+
+
+def make_workspace(
+    root: Path,
+    packages: int,
+    so_count: int,
+    so_size: int,
+    sdist_size: int,
+    seed: int = 0,
+) -> Path:
+    """Generate a uv.lock with packages backed by artifacts in root/artifacts"""
+    rng = random.Random(seed)
+    artifacts = root.joinpath("artifacts")
+    artifacts.mkdir(parents=True, exist_ok=True)
+
+    lines = ["version = 1", 'requires-python = ">=3.12"', ""]
+    for i in range(packages):
+        name = f"pkg{i}"
+        wheel = artifacts.joinpath(f"{name}-1.0.0-cp312-cp312-manylinux_2_17_x86_64.whl")
+        sdist = artifacts.joinpath(f"{name}-1.0.0.tar.gz")
+        make_wheel(wheel, name, so_count, so_size, rng)
+        make_sdist(sdist, name, sdist_size, rng)
+
+        lines.extend(
+            [
+                "[[package]]",
+                f'name = "{name}"',
+                'version = "1.0.0"',
+                'source = { registry = "https://bench.invalid/simple" }',
+                f"sdist = {{ {_file_entry(sdist)} }}",
+                "wheels = [",
+                f"    {{ {_file_entry(wheel)} }},",
+                "]",
+                "",
+            ]
+        )
+
+    lock = root.joinpath("uv.lock")
+    _ = lock.write_text("\n".join(lines))
+    return lock
+
+
+def make_fake_tools(bin_dir: Path, artifacts: Path, latency: float) -> None:
+    """Write fake nix-instantiate & nix-locate executables with a fixed per-call latency"""
+    bin_dir.mkdir(parents=True, exist_ok=True)
+    for tool, template in (
+        ("nix-instantiate", FAKE_NIX_INSTANTIATE),
+        ("nix-locate", FAKE_NIX_LOCATE),
+    ):
+        script = bin_dir.joinpath(tool)
+        _ = script.write_text(
+            textwrap.dedent(template)
+            .format(python=sys.executable, latency=latency, artifacts=str(artifacts))
+            .lstrip()
+        )
+        script.chmod(0o755)
@@ -0,0 +1,212 @@
+from __future__ import annotations
+from collections import OrderedDict
+from collections.abc import Iterable
+from typing import override
+from pathlib import Path
+import threading
+import logging
+import sqlite3
+import time
+import os
+
+
+logger = logging.getLogger(__name__)
+
+
+# Default upper bound for the on-disk cache size in bytes
+DEFAULT_MAX_SIZE = 256 * 1024 * 1024
+
+# Access times are written in batches, after this many hits or seconds
+ATIME_FLUSH_HITS = 256
+ATIME_FLUSH_INTERVAL = 5.0
+
+
+def default_cache_dir() -> Path:
+    xdg_cache_home = os.environ.get("XDG_CACHE_HOME")
+    if xdg_cache_home:
+        return Path(xdg_cache_home).joinpath("autorider")
+    return Path.home().joinpath(".cache", "autorider")
+
+
+class Cache:
+    """
+    Persistent key/value store with size-bounded LRU eviction
+
+    Long running processes can keep recently used entries in memory as well,
+    bounded by memory_size bytes.
+    Access times of hits are collected in memory and written in one transaction,
+    rather than committing on every lookup.
+    """
+
+    path: Path
+    max_size: int
+    memory_size: int
+
+    _conn: sqlite3.Connection
+    _memory: OrderedDict[str, bytes]
+    _memory_used: int
+    # Access times of hits not yet written
+    _atimes: dict[str, float]
+    _atimes_flushed: float
+    _lock: threading.Lock
+
+    def __init__(self, path: Path, max_size: int = DEFAULT_MAX_SIZE, memory_size: int = 0) -> None:
+        self.path = path
+        self.max_size = max_size
+        self.memory_size = memory_size
+        self._memory = OrderedDict()
+        self._memory_used = 0
+        self._atimes = {}
+        self._atimes_flushed = time.monotonic()
+        self._lock = threading.Lock()
+        self._conn = self._connect()
+
+    def _connect(self) -> sqlite3.Connection:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=60, check_same_thread=False)
+        _ = conn.execute("PRAGMA journal_mode=WAL")
+        _ = conn.execute("""
+            CREATE TABLE IF NOT EXISTS entries (
+                key TEXT PRIMARY KEY, value BLOB NOT NULL, size INTEGER NOT NULL, atime REAL NOT NULL
+            )
+        """)
+        _ = conn.execute("CREATE INDEX IF NOT EXISTS entries_atime ON entries (atime)")
+        conn.commit()
+        return conn
+
+    @override
+    def __getstate__(self) -> dict[str, object]:
+        # Connections can't be shared with worker processes, reconnect instead
+        return {"path": self.path, "max_size": self.max_size}
+
+    def __setstate__(self, state: dict[str, object]) -> None:
+        self.path = state["path"]  # pyright: ignore[reportAttributeAccessIssue]
+        self.max_size = state["max_size"]  # pyright: ignore[reportAttributeAccessIssue]
+        self.memory_size = 0
+        self._memory = OrderedDict()
+        self._memory_used = 0
+        self._atimes = {}
+        self._atimes_flushed = time.monotonic()
+        self._lock = threading.Lock()
+        self._conn = self._connect()
+
+    @classmethod
+    def from_dir(cls, cache_dir: Path, max_size: int = DEFAULT_MAX_SIZE, memory_size: int = 0) -> Cache:
+        return cls(cache_dir.joinpath("cache.sqlite"), max_size, memory_size)
+
+    def _remember(self, key: str, value: bytes) -> None:
+        # Called with lock held
+        if len(value) >= self.memory_size:
+            return
+        old = self._memory.pop(key, None)
+        if old is not None:
+            self._memory_used -= len(old)
+        self._memory[key] = value
+        self._memory_used += len(value)
+        while self._memory_used > self.memory_size:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_used -= len(evicted)
+
+    def _touch(self, key: str) -> None:
+        # Called with lock held
+        self._atimes[key] = time.time()
+        if (
+            len(self._atimes) >= ATIME_FLUSH_HITS
+            or time.monotonic() - self._atimes_flushed >= ATIME_FLUSH_INTERVAL
+        ):
+            self._write_atimes()
+            self._conn.commit()
+
+    def _write_atimes(self) -> None:
+        # Called with lock held, committed by the caller
+        if self._atimes:
+            _ = self._conn.executemany(
+                "UPDATE entries SET atime = ? WHERE key = ?",
+                ((atime, key) for key, atime in self._atimes.items()),
+            )
+            self._atimes = {}
+        self._atimes_flushed = time.monotonic()
+
+    def flush(self) -> None:
+        """Write access times of recent hits"""
+        with self._lock:
+            self._write_atimes()
+            self._conn.commit()
+
+    def get(self, key: str) -> bytes | None:
+        with self._lock:
+            value = self._memory.get(key)
+            if value is not None:
+                self._memory.move_to_end(key)
+                self._touch(key)
+                return value
+
+            row = self._conn.execute(  # pyright: ignore[reportAny]
+                "SELECT value FROM entries WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            data: bytes = row[0]  # pyright: ignore[reportAny]
+            self._touch(key)
+            self._remember(key, data)
+            return data
+
+    def put(self, key: str, value: bytes) -> None:
+        self.put_many([(key, value)])
+
+    def put_many(self, items: Iterable[tuple[str, bytes]]) -> None:
+        """Store several entries in a single transaction"""
+        items = list(items)
+        now = time.time()
+        with self._lock:
+            self._write_atimes()
+            _ = self._conn.executemany(
+                "INSERT OR REPLACE INTO entries (key, value, size, atime) VALUES (?, ?, ?, ?)",
+                ((key, value, len(key) + len(value), now) for key, value in items),
+            )
+            self._conn.commit()
+            for key, value in items:
+                self._remember(key, value)
+
+    def size(self) -> int:
+        with self._lock:
+            row = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()  # pyright: ignore[reportAny]
+            size: int = row[0]  # pyright: ignore[reportAny]
+            return size
+
+    def gc(self, max_size: int | None = None) -> int:
+        """Evict least recently used entries until the cache fits within max_size"""
+        if max_size is None:
+            max_size = self.max_size
+
+        evicted = 0
+        with self._lock:
+            self._write_atimes()
+            self._conn.commit()
+            row = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()  # pyright: ignore[reportAny]
+            total: int = row[0]  # pyright: ignore[reportAny]
+            if total <= max_size:
+                return 0
+
+            keys: list[str] = []
+            for key, size in self._conn.execute(  # pyright: ignore[reportAny]
+                "SELECT key, size FROM entries ORDER BY atime ASC"
+            ):
+                if total <= max_size:
+                    break
+                keys.append(key)  # pyright: ignore[reportAny]
+                total -= size  # pyright: ignore[reportAny]
+
+            _ = self._conn.executemany(
+                "DELETE FROM entries WHERE key = ?", ((key,) for key in keys)
+            )
+            self._conn.commit()
+            evicted = len(keys)
+
+        logger.info("evicted %d cache entries", evicted)
+        return evicted
+
+    def close(self) -> None:
+        _ = self.gc()
+        with self._lock:
+            self._conn.close()
@@ -1,23 +1,27 @@
-from collections.abc import Generator
+from contextlib import ExitStack
 from pathlib import Path
 from typing import cast
 import argparse
 import logging
 import json
+import sys
 import os
 
-from autorider.config import PyprojectConfig
-from autorider.output import Output
-from autorider.scanners import ScanResult
-from autorider.manager import PackageManager
-from autorider.uv import Uv2nix
-from autorider.process import process_pkgs, lookup_sonames
+from autorider.cache import Cache, DEFAULT_MAX_SIZE, default_cache_dir
+from autorider.daemon import Daemon, default_socket_path, run_remote, serve
+from autorider.output import JsonlWriter, Output, load_output
+from autorider import stats, trace
 
 
-SCAN_RESULTS = Generator[ScanResult, None, None]
+logger = logging.getLogger(__name__)
 
 
-logger = logging.getLogger(__name__)
+def _positive_int(value: str) -> int:
+    # Matches the config validation, which command line overrides bypass
+    n = int(value)
+    if n < 1:
+        raise argparse.ArgumentTypeError(f"must be at least 1, got {n}")
+    return n
 
 
 def _make_argparse():
@@ -25,10 +29,58 @@ def _make_argparse():
     _ = parser.add_argument(
         "--output", "-o", help="Overlay output directory", default="autorider.json"
     )
-    _ = parser.add_argument("--root", default=os.getcwd(), help="Path to project root")
+    _ = parser.add_argument(
+        "--root",
+        action="append",
+        help="Path to project root (defaults to the working directory), repeat to process several at once",
+    )
     _ = parser.add_argument(
         "--config", help="Path to TOML config (defaults to $root/pyproject.toml)"
     )
+    _ = parser.add_argument(
+        "--cache-dir",
+        help="Scan result cache directory (defaults to $XDG_CACHE_HOME/autorider)",
+    )
+    _ = parser.add_argument(
+        "--no-cache", action="store_true", help="Disable the scan result cache"
+    )
+    _ = parser.add_argument(
+        "--jobs", "-j", type=_positive_int, help="Number of scanning workers"
+    )
+    _ = parser.add_argument(
+        "--process-pool",
+        action="store_true",
+        default=None,
+        help="Scan in worker processes rather than threads",
+    )
+    _ = parser.add_argument(
+        "--incremental",
+        action="store_true",
+        default=None,
+        help="Only rescan packages changed since the previous output was written",
+    )
+    _ = parser.add_argument(
+        "--format",
+        choices=("json", "jsonl"),
+        default="json",
+        help="Output format, jsonl streams one record per package as it completes",
+    )
+    _ = parser.add_argument(
+        "--trace", help="Write a Chrome trace of the run to file, viewable in Perfetto"
+    )
+    _ = parser.add_argument(
+        "--stats", action="store_true", help="Print run statistics to stderr"
+    )
+    _ = parser.add_argument("--stats-json", help="Write run statistics as JSON to file")
+    _ = parser.add_argument(
+        "--socket",
+        help="Daemon socket path (defaults to $XDG_RUNTIME_DIR/autorider.sock)",
+    )
+    _ = parser.add_argument(
+        "--no-daemon",
+        action="store_true",
+        help="Run in this process even if a daemon is listening",
+    )
     _ = parser.add_argument("-v", "--verbose", action="count", default=0)
 
     subp = parser.add_subparsers(
@@ -37,69 +89,278 @@ def _make_argparse():
 
     _ = subp.add_parser("uv2nix")
 
+    convert_parser = subp.add_parser(
+        "convert", help="Convert JSON Lines output into the regular output format"
+    )
+    _ = convert_parser.add_argument("input", help="JSON Lines output to convert")
+
+    _ = subp.add_parser(
+        "serve", help="Run a daemon keeping caches warm, used by later invocations"
+    )
+
+    cache_parser = subp.add_parser("cache", help="Manage the scan result cache")
+    cache_subp = cache_parser.add_subparsers(dest="cache_command", required=True)
+    gc_parser = cache_subp.add_parser("gc", help="Evict least recently used entries")
+    _ = gc_parser.add_argument(
+        "--max-size",
+        type=int,
+        default=DEFAULT_MAX_SIZE,
+        help="Maximum cache size in bytes",
+    )
+
     return parser
 
 
-def main() -> None:
-    args = _make_argparse().parse_args()
+def _cache_main(cache_dir: Path, command: str, max_size: int) -> None:
+    cache = Cache.from_dir(cache_dir, max_size)
+    match command:
+        case "gc":
+            evicted = cache.gc()
+            print(f"Evicted {evicted} entries, cache size is now {cache.size()} bytes")
+        case _:
+            raise ValueError(f"Unsupported cache command '{command}'")
+    cache.close()
+
+
+def _write_output(output_path: Path, output: Output) -> None:
+    with open(output_path, "w") as fp:
+        json.dump(output, fp, indent=2)
+        _ = fp.write("\n")
+
+
+def _forward(socket_path: Path, argv: list[str]) -> bool:
+    """Run on a listening daemon, returning whether one handled the run"""
+    response = run_remote(socket_path, argv, os.getcwd())
+    if response is None:
+        return False
+
+    _ = sys.stdout.write(response["stdout"])
+    _ = sys.stderr.write(response["stderr"])
+    if response["exit"]:
+        sys.exit(response["exit"])
+    return True
+
+
+def main(argv: list[str] | None = None, daemon: Daemon | None = None) -> None:
+    if argv is None:
+        argv = sys.argv[1:]
+    parser = _make_argparse()
+    args = parser.parse_args(argv)
     subcommand = cast(str, args.subcommand)
-    root = Path(cast(str, args.root))
 
-    logging.basicConfig(level=max(logging.WARN - (cast(int, args.verbose) * 10), 0))
+    log_level = max(logging.WARN - (cast(int, args.verbose) * 10), 0)
+    if daemon:
+        # Log handlers are set up by the daemon per request
+        logging.getLogger().setLevel(log_level)
+    else:
+        logging.basicConfig(level=log_level)
+
+    socket_arg = cast(str | None, args.socket)
+    socket_path = Path(socket_arg) if socket_arg else default_socket_path()
+    if subcommand == "serve":
+        serve(socket_path, lambda argv, daemon: main(argv, daemon))
+        return
+    if subcommand == "uv2nix" and not daemon and not cast(bool, args.no_daemon):
+        if _forward(socket_path, argv):
+            return
+
+    cache_dir_arg = cast(str | None, args.cache_dir)
+    cache_dir = Path(cache_dir_arg) if cache_dir_arg else default_cache_dir()
+    if subcommand == "cache":
+        _cache_main(cache_dir, cast(str, args.cache_command), cast(int, args.max_size))
+        return
+
+    roots = [Path(root) for root in cast(list[str], args.root or [os.getcwd()])]
+    output_paths = [_output_path(args, root) for root in roots]
+    if len(set(output_paths)) != len(output_paths):
+        parser.error("multiple roots require a relative --output path")
 
+    if subcommand == "convert":
+        output_path = output_paths[0]
+        _write_output(output_path, load_output(Path(cast(str, args.input))))
+        print(f"Wrote {output_path}")
+        return
+
+    _scan_main(args, subcommand, list(zip(roots, output_paths)), cache_dir, daemon)
+
+
+def _output_path(args: argparse.Namespace, root: Path) -> Path:
     output_path = Path(cast(str, args.output))
     if not output_path.is_absolute():
         output_path = root.joinpath(output_path)
     logger.info("using output path '%s'", output_path)
+    return output_path
 
-    config_path = Path(
-        args.config if args.config else os.path.join(root, "pyproject.toml")
-    )
 
-    logger.info("loading config from path '%s'", config_path)
-    pyproject = PyprojectConfig.from_path(config_path)
-    config = pyproject.tool.autorider
+def _scan_main(
+    args: argparse.Namespace,
+    subcommand: str,
+    workspaces: list[tuple[Path, Path]],
+    cache_dir: Path,
+    daemon: Daemon | None = None,
+) -> None:
+    """
+    Scan workspaces given as (root, output path)
 
-    logger.info("initializing package manager %s", subcommand)
-    manager: PackageManager
-    match subcommand:
-        case "uv2nix":
-            manager = Uv2nix(Path(root))
-        case _:
-            raise ValueError(f"Unsupported subcommand '{subcommand}'")
-
-    logger.info("generating package scanners")
-    scanners = manager.generate()
-
-    logger.info("processing packages")
-    results = process_pkgs(config, scanners)
-
-    # Aggregate all dependency sonames for nixpkgs lookup
-    sonames: set[str] = set()
-    for pkg_outputs in results.values():
-        if isinstance(pkg_outputs, list):
-            for pkg_output in pkg_outputs:
-                for soname in pkg_output.get("wheel-depends-so", []):
-                    sonames.add(soname)
-                for soname in pkg_output.get("sdist-depends-so", []):
-                    sonames.add(soname)
-        else:
-            for soname in pkg_outputs.get("wheel-depends-so", []):
-                sonames.add(soname)
-            for soname in pkg_outputs.get("sdist-depends-so", []):
-                sonames.add(soname)
-
-    # Lookup soname providers using nix-locate
-    logger.info("looking up soname providers")
-    so_providers = lookup_sonames(sonames, config.nix_locate_ignore)
-
-    output: Output = { }
-    if results:
-        output["packages"] = results
-    if so_providers:
-        output["so-providers"] = so_providers
-    with open(output_path, "w") as fp:
-        json.dump(output, fp, indent=2)
-        _ = fp.write("\n")
+    Workspaces are processed in turn, sharing artifact scans & soname lookups.
+    """
+    # Imported here so --help, cache & convert don't pay for the scanning machinery
+    from autorider.config import AutoriderConfig, PyprojectConfig
+    from autorider.download import Fetcher
+    from autorider.incremental import Manifest, invalidate_manifest
+    from autorider.manager import PackageManager
+    from autorider.output import PackageOutput, collapse_outputs
+    from autorider.process import output_sonames, process_pkgs
+    from autorider.resolve import SonameResolver
+    from autorider.runner import configure_runner
+    from autorider.scanners import ScanContext, ScanMemo
+    from autorider.uv import Uv2nix
+
+    def load_config(root: Path) -> AutoriderConfig:
+        config_path = Path(
+            args.config if args.config else os.path.join(root, "pyproject.toml")
+        )
+
+        logger.info("loading config from path '%s'", config_path)
+        pyproject = PyprojectConfig.from_path(config_path)
+        config = pyproject.tool.autorider
+
+        # Command line overrides
+        jobs = cast(int | None, args.jobs)
+        if jobs is not None:
+            config = config.model_copy(update={"jobs": jobs})
+        process_pool = cast(bool | None, args.process_pool)
+        if process_pool is not None:
+            config = config.model_copy(update={"process_pool": process_pool})
+        incremental = cast(bool | None, args.incremental)
+        if incremental is not None:
+            config = config.model_copy(update={"incremental": incremental})
+        return config
+
+    configs = [load_config(root) for root, _ in workspaces]
+    # Run wide settings are taken from the first workspace
+    config = configs[0]
+
+    cache: Cache | None = None
+    if not cast(bool, args.no_cache):
+        logger.info("using cache directory '%s'", cache_dir)
+        cache = daemon.cache(cache_dir) if daemon else Cache.from_dir(cache_dir)
+
+    trace_path = cast(str | None, args.trace)
+    tracer = trace.enable() if trace_path else None
+
+    # Shared by all workspaces, so each artifact is only fetched & scanned once
+    fetcher = Fetcher(store_dir=Path(config.store_dir) if config.store_dir else None)
+    memo = ScanMemo()
+
+    # Thread pools are kept running between daemon requests
+    executor = daemon.executor(config.jobs) if daemon and not config.process_pool else None
+
+    # Written once all workspaces are processed & sonames resolved
+    written: list[tuple[Path, Manifest, SonameResolver, set[str], JsonlWriter | Output]] = []
+
+    # External tools run with per-tool concurrency limits,
+    # closing the runner kills anything still outstanding on failure or Ctrl-C.
+    runner = configure_runner(config.concurrency.limits(), config.concurrency.timeout)
+    try:
+        with ExitStack() as files:
+            # Soname providers are looked up as packages finish scanning,
+            # in one pass for all workspaces sharing an ignore list.
+            resolvers: dict[tuple[str, ...], SonameResolver] = {}
+
+            for (root, output_path), config in zip(workspaces, configs):
+                ignore = tuple(config.nix_locate_ignore)
+                if ignore not in resolvers:
+                    resolvers[ignore] = SonameResolver(list(ignore), cache=cache, runner=runner)
+                resolver = resolvers[ignore]
+
+                logger.info("initializing package manager %s", subcommand)
+                manager: PackageManager
+                match subcommand:
+                    case "uv2nix":
+                        manager = Uv2nix(root, cache)
+                    case _:
+                        raise ValueError(f"Unsupported subcommand '{subcommand}'")
+
+                logger.info("generating package scanners")
+                scanners = manager.generate()
+
+                logger.info("processing packages of '%s'", root)
+                context = ScanContext(
+                    cache=cache,
+                    fetcher=fetcher,
+                    range_requests=config.range_requests,
+                    rules=config.rule_index(),
+                    memo=memo,
+                )
+
+                # Previous outputs must be loaded before a streamed output overwrites them
+                manifest = Manifest.load(output_path) if config.incremental else Manifest()
+                invalidate_manifest(output_path)
+
+                sonames: set[str] = set()
+                collected: list[tuple[str, PackageOutput]] = []
+                writer: JsonlWriter | None = None
+                if args.format == "jsonl":
+                    writer = JsonlWriter(files.enter_context(open(output_path, "w")))
+
+                def on_output(name: str, output: PackageOutput) -> None:
+                    sonames.update(output_sonames(output))
+                    if writer:
+                        writer.write_package(name, output)
+                    else:
+                        collected.append((name, output))
+
+                _ = process_pkgs(config, scanners, context, resolver, manifest, on_output, executor)
+
+                if writer:
+                    written.append((output_path, manifest, resolver, sonames, writer))
+                else:
+                    output: Output = { }
+                    results = collapse_outputs(collected)
+                    if results:
+                        output["packages"] = results
+                    written.append((output_path, manifest, resolver, sonames, output))
+
+            logger.info("waiting for soname provider lookups")
+            for resolver in resolvers.values():
+                _ = resolver.result()
+
+            for output_path, manifest, resolver, sonames, target in written:
+                so_providers = {
+                    soname: provider
+                    for soname, provider in resolver.providers.items()
+                    if soname in sonames
+                }
+                if isinstance(target, JsonlWriter):
+                    target.write_so_providers(so_providers)
+                else:
+                    if so_providers:
+                        target["so-providers"] = so_providers
+                    _write_output(output_path, target)
+    finally:
+        runner.close()
+
+        # Also written for failed runs, which are the ones most worth inspecting
+        if tracer and trace_path:
+            tracer.dump(Path(trace_path))
+            print(f"Wrote trace {trace_path}")
+
+    for output_path, manifest, *_ in written:
+        manifest.dump(output_path)
+
+    # The daemon owns its caches
+    if cache and not daemon:
+        cache.close()
+
+    for output_path, *_ in written:
+        print(f"Wrote {output_path}")
 
-    print(f"Wrote {output_path}")
+    run_stats = stats.get_stats()
+    if cast(bool, args.stats):
+        print(run_stats.format(), file=sys.stderr)
+    stats_json = cast(str | None, args.stats_json)
+    if stats_json:
+        with open(stats_json, "w") as fp:
+            json.dump(run_stats.to_json(), fp, indent=2)
+            _ = fp.write("\n")
@@ -2,6 +2,8 @@ from __future__ import annotations
 from pathlib import Path
 from pydantic import BaseModel, Field
 
+from autorider.rules import DEFAULT_INDEX, DEFAULT_RULES, Rule, RuleIndex
+
 import tomllib
 
 
@@ -19,6 +21,27 @@ class PackageOutputConfig(BaseModel):
     build_requires: bool | None = Field(alias="build-requires", default=None)
 
 
+class SdistRuleConfig(BaseModel):
+    # Exact basename, or a suffix glob such as "*.cu"
+    match: str
+    requires: list[str]
+    max_depth: int | None = Field(alias="max-depth", default=None, ge=0)
+
+    def rule(self) -> Rule:
+        return Rule(self.match, tuple(self.requires), self.max_depth)
+
+
+class ConcurrencyConfig(BaseModel):
+    # Concurrent invocations of each external tool
+    nix_instantiate: int = Field(alias="nix-instantiate", default=4, ge=1)
+    nix_locate: int = Field(alias="nix-locate", default=8, ge=1)
+    # Seconds before an external tool invocation is killed
+    timeout: float | None = Field(default=None)
+
+    def limits(self) -> dict[str, int]:
+        return {"nix-instantiate": self.nix_instantiate, "nix-locate": self.nix_locate}
+
+
 class AutoriderConfig(BaseModel):
     include: list[str] = Field(default_factory=lambda: ["*"])
     exclude: list[str] = Field(default_factory=list)
@@ -27,6 +50,23 @@ class AutoriderConfig(BaseModel):
     nix_locate_ignore: list[str] = Field(
         alias="nix-locate-ignore", default_factory=lambda: []
     )
+    range_requests: bool = Field(alias="range-requests", default=False)
+    # Nix store checked for already fetched artifacts (defaults to $NIX_STORE_DIR or /nix/store)
+    store_dir: str | None = Field(alias="store-dir", default=None)
+    # Number of scanning workers (defaults to executor default)
+    jobs: int | None = Field(default=None, ge=1)
+    # Scan in worker processes rather than threads, for CPU-bound ELF parsing
+    process_pool: bool = Field(alias="process-pool", default=False)
+    concurrency: ConcurrencyConfig = Field(default_factory=ConcurrencyConfig)
+    # Reuse previous outputs of packages unchanged since the last run
+    incremental: bool = Field(default=False)
+    # Additional build requirement rules, extending the defaults
+    sdist_rules: list[SdistRuleConfig] = Field(alias="sdist-rules", default_factory=list)
+
+    def rule_index(self) -> RuleIndex:
+        if not self.sdist_rules:
+            return DEFAULT_INDEX
+        return RuleIndex.compile([*DEFAULT_RULES, *(rule.rule() for rule in self.sdist_rules)])
 
 
 class ToolConfig(BaseModel):
@@ -0,0 +1,247 @@
+"""
+Long running server keeping caches & worker pools warm between runs.
+
+Clients send a single JSON line with their arguments, working directory &
+environment and receive a single JSON line with the exit status & captured output.
+Requests are handled one at a time, as runs share process wide state.
+"""
+
+from __future__ import annotations
+from collections.abc import Callable, Generator
+from concurrent import futures
+from contextlib import contextmanager, redirect_stderr, redirect_stdout
+from pathlib import Path
+from typing import NotRequired, TypedDict, override
+import socketserver
+import traceback
+import threading
+import logging
+import socket
+import json
+import time
+import io
+import os
+
+from autorider.cache import Cache
+from autorider import stats, trace
+
+
+logger = logging.getLogger(__name__)
+
+
+# Bytes of recently used cache entries kept in memory
+MEMORY_SIZE = 256 * 1024 * 1024
+
+# Minimum seconds between evicting cache entries
+GC_INTERVAL = 600.0
+
+# Client environment applied to each run, unset variables are sent as None
+FORWARDED_ENV = ("NIX_INDEX_DATABASE", "NIX_STORE_DIR", "PATH", "XDG_CACHE_HOME")
+
+
+class Request(TypedDict):
+    argv: list[str]
+    cwd: str
+    env: NotRequired[dict[str, str | None]]
+
+
+class Response(TypedDict):
+    exit: int
+    stdout: str
+    stderr: str
+
+
+# Runs a CLI invocation with warm state
+MAIN_T = Callable[[list[str], "Daemon"], None]
+
+
+def client_env() -> dict[str, str | None]:
+    return {name: os.environ.get(name) for name in FORWARDED_ENV}
+
+
+@contextmanager
+def _environ(env: dict[str, str | None]) -> Generator[None]:
+    """Apply forwarded variables for the duration of a run, restoring the daemon's own after"""
+    env = {name: value for name, value in env.items() if name in FORWARDED_ENV}
+    saved = {name: os.environ.get(name) for name in env}
+
+    def apply(values: dict[str, str | None]) -> None:
+        for name, value in values.items():
+            if value is None:
+                _ = os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+
+    apply(env)
+    try:
+        yield
+    finally:
+        apply(saved)
+
+
+def default_socket_path() -> Path:
+    runtime_dir = os.environ.get("XDG_RUNTIME_DIR")
+    if runtime_dir:
+        return Path(runtime_dir).joinpath("autorider.sock")
+    return Path.home().joinpath(".cache", "autorider", "autorider.sock")
+
+
+class Daemon:
+    """
+    State kept warm between runs
+    """
+
+    main: MAIN_T
+
+    _caches: dict[Path, Cache]
+    _executors: dict[int | None, futures.ThreadPoolExecutor]
+    _last_gc: float
+    _lock: threading.Lock
+
+    def __init__(self, main: MAIN_T) -> None:
+        self.main = main
+        self._caches = {}
+        self._executors = {}
+        self._last_gc = time.monotonic()
+        self._lock = threading.Lock()
+
+    def cache(self, cache_dir: Path) -> Cache:
+        try:
+            return self._caches[cache_dir]
+        except KeyError:
+            cache = self._caches[cache_dir] = Cache.from_dir(cache_dir, memory_size=MEMORY_SIZE)
+            return cache
+
+    def executor(self, jobs: int | None) -> futures.Executor:
+        try:
+            return self._executors[jobs]
+        except KeyError:
+            executor = self._executors[jobs] = futures.ThreadPoolExecutor(max_workers=jobs)
+            return executor
+
+    def handle(self, request: Request) -> Response:
+        stdout = io.StringIO()
+        stderr = io.StringIO()
+        status = 0
+
+        with self._lock:
+            cwd = os.getcwd()
+            handler = logging.StreamHandler(stderr)
+            root_logger = logging.getLogger()
+            root_logger.addHandler(handler)
+            _ = stats.get_stats().drain()
+            try:
+                os.chdir(request["cwd"])
+                with _environ(request.get("env", {})), redirect_stdout(stdout), redirect_stderr(stderr):
+                    self.main(request["argv"], self)
+            except SystemExit as exc:
+                status = exc.code if isinstance(exc.code, int) else 1
+            except Exception:
+                _ = stderr.write(traceback.format_exc())
+                status = 1
+            finally:
+                os.chdir(cwd)
+                root_logger.removeHandler(handler)
+                trace.disable()
+                # Runs don't close caches, so persist access times & evict periodically
+                gc = time.monotonic() - self._last_gc >= GC_INTERVAL
+                if gc:
+                    self._last_gc = time.monotonic()
+                for cache in self._caches.values():
+                    if gc:
+                        _ = cache.gc()
+                    else:
+                        cache.flush()
+
+        return {"exit": status, "stdout": stdout.getvalue(), "stderr": stderr.getvalue()}
+
+    def close(self) -> None:
+        for executor in self._executors.values():
+            executor.shutdown()
+        for cache in self._caches.values():
+            cache.close()
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    server: _Server  # pyright: ignore[reportIncompatibleVariableOverride]
+
+    @override
+    def handle(self) -> None:
+        line = self.rfile.readline()
+        # Liveness probes connect without sending anything
+        if not line:
+            return
+        request: Request = json.loads(line)  # pyright: ignore[reportAny]
+        logger.info("handling request %s", request["argv"])
+        response = self.server.daemon.handle(request)
+        _ = self.wfile.write(json.dumps(response).encode() + b"\n")
+
+
+class _Server(socketserver.UnixStreamServer):
+    daemon: Daemon
+
+    def __init__(self, path: Path, daemon: Daemon) -> None:
+        self.daemon = daemon
+        super().__init__(str(path), _Handler)
+
+
+def serve(path: Path, main: MAIN_T) -> None:
+    """Serve requests on a Unix socket until interrupted"""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    if path.exists():
+        if listening(path):
+            raise RuntimeError(f"daemon already listening on '{path}'")
+        # Left behind by a daemon which didn't shut down cleanly
+        path.unlink()
+
+    daemon = Daemon(main)
+    umask = os.umask(0o077)
+    try:
+        server = _Server(path, daemon)
+    finally:
+        _ = os.umask(umask)
+
+    print(f"Listening on {path}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        path.unlink(missing_ok=True)
+        daemon.close()
+
+
+def listening(path: Path) -> bool:
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        try:
+            sock.connect(str(path))
+        except OSError:
+            return False
+    return True
+
+
+def run_remote(
+    path: Path, argv: list[str], cwd: str, env: dict[str, str | None] | None = None
+) -> Response | None:
+    """
+    Run a CLI invocation on a daemon, or None if no daemon can be reached
+
+    The run sees env, defaulting to this process' values of the forwarded variables.
+    """
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        try:
+            sock.connect(str(path))
+        except OSError:
+            # Including sockets owned by another user
+            return None
+
+        req: Request = {"argv": argv, "cwd": cwd, "env": client_env() if env is None else env}
+        sock.sendall(json.dumps(req).encode() + b"\n")
+        with sock.makefile("rb") as fp:
+            line = fp.readline()
+
+    if not line:
+        return None
+    response: Response = json.loads(line)  # pyright: ignore[reportAny]
+    return response
@@ -1,15 +1,102 @@
 from urllib.parse import urlparse, parse_qs, urlunparse
+from collections import OrderedDict
+from collections.abc import Iterable
+from concurrent import futures
+from typing import override
 import subprocess
+import threading
+import posixpath
+import hashlib
+import logging
 import pathlib
+import stat
 import json
+import io
+import os
+import re
 
+from autorider.runner import get_runner
+from autorider import stats, trace
 
-class HTTPDownload:
+
+logger = logging.getLogger(__name__)
+
+
+# Realise multiple fetchers in a single evaluator invocation
+FETCH_MANY_EXPR = """
+{ args }:
+map (
+  arg: if arg.type == "git" then builtins.fetchGit arg.args else builtins.fetchurl arg.args
+) (builtins.fromJSON args)
+"""
+
+
+# Alphabet of Nix's base32 encoding, omitting e, o, u & t
+NIX_BASE32_CHARS = "0123456789abcdfghijklmnpqrsvwxyz"
+
+# Characters allowed in store path names
+_STORE_NAME_RE = re.compile(r"[a-zA-Z0-9+\-_?=][a-zA-Z0-9+\-._?=]*")
+
+
+def default_store_dir() -> pathlib.Path:
+    return pathlib.Path(os.environ.get("NIX_STORE_DIR", "/nix/store"))
+
+
+def nix_base32(data: bytes) -> str:
+    """Encode bytes the way Nix prints hashes in store paths"""
+    length = (len(data) * 8 - 1) // 5 + 1
+    chars: list[str] = []
+    for n in range(length - 1, -1, -1):
+        b = n * 5
+        i, j = divmod(b, 8)
+        c = data[i] >> j
+        if i + 1 < len(data):
+            c |= data[i + 1] << (8 - j)
+        chars.append(NIX_BASE32_CHARS[c & 0x1F])
+    return "".join(chars)
+
+
+def fixed_output_path(store_dir: pathlib.Path, name: str, sha256: str) -> pathlib.Path:
+    """Store path of a flat file with a sha256 hex digest, as added by builtins.fetchurl"""
+    inner = hashlib.sha256(f"fixed:out:sha256:{sha256}:".encode()).hexdigest()
+    digest = hashlib.sha256(f"output:out:sha256:{inner}:{store_dir}:{name}".encode()).digest()
+    # Truncated by XOR folding into 160 bits
+    compressed = bytearray(20)
+    for i, byte in enumerate(digest):
+        compressed[i % 20] ^= byte
+    return store_dir.joinpath(f"{nix_base32(bytes(compressed))}-{name}")
+
+
+class Download:
+    @property
+    def key(self) -> str:
+        """Identity of download used to deduplicate fetches"""
+        raise NotImplementedError()
+
+    def fetch_spec(self) -> dict[str, object]:
+        """Arguments for batched fetching through FETCH_MANY_EXPR"""
+        raise NotImplementedError()
+
+    def finalize(self, path: pathlib.Path) -> pathlib.Path:
+        """Post-process a fetched store path"""
+        return path
+
+    def get(self) -> pathlib.Path:
+        with trace.span(f"{type(self).__name__}.get", "fetch", download=self.key):
+            path = fetch_many([self])[0]
+        stats.incr("artifacts-fetched")
+        return path
+
+
+class HTTPDownload(Download):
     url: str
     sha256: None | str
+    size: None | int
 
-    def __init__(self, url: str, hash: None | str = None):
+    def __init__(self, url: str, hash: None | str = None, size: None | int = None):
         self.url = url
+        self.size = size
+        self.sha256 = None
         if hash:
             if not hash.startswith("sha256:"):
                 raise ValueError("Only sha256 supported for http downloads")
@@ -20,41 +107,46 @@ class HTTPDownload:
 
             self.sha256 = sha256
 
-    def get(self):
-        args = [
-            "nix-instantiate",
-            "--eval",
-            "--json",
-            "--expr",
-            "{ url, sha256 ? null }@args: builtins.fetchurl args",
-            "--argstr",
-            "url",
-            self.url,
-        ]
-        if self.sha256:
-            args.extend(
-                [
-                    "--argstr",
-                    "sha256",
-                    self.sha256,
-                ]
-            )
-
-        p = subprocess.run(args, stdout=subprocess.PIPE, check=True)
-        result = json.loads(p.stdout)  # pyright: ignore[reportAny]
-        if not isinstance(result, str):
-            raise ValueError("result json not string")
+    @property
+    @override
+    def key(self) -> str:
+        return f"{self.url}#sha256={self.sha256}" if self.sha256 else self.url
+
+    @property
+    def name(self) -> str:
+        return posixpath.basename(urlparse(self.url).path)
 
-        return pathlib.Path(result)
+    def store_path(self, store_dir: pathlib.Path) -> pathlib.Path | None:
+        """Store path builtins.fetchurl realises this download to, if known without evaluating"""
+        if not self.sha256 or not re.fullmatch(r"[0-9a-f]{64}", self.sha256):
+            return None
+        # Named by baseNameOf, query string included
+        name = posixpath.basename(self.url.rstrip("/"))
+        if len(name) > 211 or not _STORE_NAME_RE.fullmatch(name):
+            return None
+        return fixed_output_path(store_dir, name, self.sha256)
 
+    @override
+    def fetch_spec(self) -> dict[str, object]:
+        args: dict[str, str] = {"url": self.url}
+        if self.sha256:
+            args["sha256"] = self.sha256
+        return {"type": "url", "args": args}
 
-class GitDownload:
+
+class GitDownload(Download):
     url: str
 
     def __init__(self, url: str):
         self.url = url
 
-    def get(self):
+    @property
+    @override
+    def key(self) -> str:
+        return self.url
+
+    @override
+    def fetch_spec(self) -> dict[str, object]:
         # Split base url from fetchGit params
         url_parsed = urlparse(self.url)
         query = parse_qs(url_parsed.query)
@@ -73,24 +165,359 @@ class GitDownload:
                 raise ValueError("Number of refs too long")
             fetchgit_args["ref"] = f"refs/tags/{refs[0]}"
 
-        args = [
-            "nix-instantiate",
-            "--eval",
-            "--json",
-            "--expr",
-            "{ args }: builtins.fetchGit (builtins.fromJSON args)",
-            "--argstr",
-            "args",
-            json.dumps(fetchgit_args)
-        ]
-
-        p = subprocess.run(args, stdout=subprocess.PIPE, check=True)
-        result = json.loads(p.stdout)  # pyright: ignore[reportAny]
-        if not isinstance(result, str):
-            raise ValueError("result json not string")
+        return {"type": "git", "args": fetchgit_args}
 
-        path = pathlib.Path(result)
+    @override
+    def finalize(self, path: pathlib.Path) -> pathlib.Path:
+        query = parse_qs(urlparse(self.url).query)
         for subdirectory in query.get("subdirectory", []):
             path = path.joinpath(subdirectory)
+        return path
+
+
+class HTTPRangeError(Exception):
+    pass
+
+
+class HTTPRangeFile(io.RawIOBase):
+    """
+    Seekable read-only file backed by HTTP range requests
+
+    Reads are rounded up to blocks which are kept in a small LRU cache.
+    """
+
+    url: str
+    size: int
+    block_size: int
+    max_blocks: int
+    bytes_fetched: int
+
+    _pos: int
+    _blocks: OrderedDict[int, bytes]
+
+    def __init__(
+        self,
+        url: str,
+        size: int,
+        block_size: int = 1024 * 1024,
+        max_blocks: int = 32,
+    ) -> None:
+        super().__init__()
+        self.url = url
+        self.size = size
+        self.block_size = block_size
+        self.max_blocks = max_blocks
+        self.bytes_fetched = 0
+        self._pos = 0
+        self._blocks = OrderedDict()
+
+    @override
+    def readable(self) -> bool:
+        return True
+
+    @override
+    def seekable(self) -> bool:
+        return True
+
+    @override
+    def tell(self) -> int:
+        return self._pos
+
+    @override
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_SET:
+            self._pos = offset
+        elif whence == io.SEEK_CUR:
+            self._pos += offset
+        elif whence == io.SEEK_END:
+            self._pos = self.size + offset
+        else:
+            raise ValueError(f"invalid whence {whence}")
+        if self._pos < 0:
+            raise ValueError("negative seek position")
+        return self._pos
+
+    def _fetch(self, start: int, end: int) -> bytes:
+        """Fetch inclusive byte range, verifying the remote size"""
+        # Pulls in http.client, email & ssl, only needed for range requests
+        import urllib.request
+        import http.client
+
+        req = urllib.request.Request(self.url, headers={"Range": f"bytes={start}-{end}"})
+        try:
+            with urllib.request.urlopen(req) as resp:  # pyright: ignore[reportAny]
+                if resp.status != 206:  # pyright: ignore[reportAny]
+                    raise HTTPRangeError(f"server does not support range requests (HTTP {resp.status})")  # pyright: ignore[reportAny]
+
+                content_range: str = resp.headers.get("Content-Range", "")  # pyright: ignore[reportAny]
+                m = re.fullmatch(r"bytes (\d+)-(\d+)/(\d+)", content_range)
+                if not m or int(m.group(1)) != start:
+                    raise HTTPRangeError(f"unexpected Content-Range '{content_range}'")
+                if int(m.group(3)) != self.size:
+                    raise HTTPRangeError(
+                        f"size mismatch for '{self.url}': expected {self.size}, got {m.group(3)}"
+                    )
+
+                data: bytes = resp.read()  # pyright: ignore[reportAny]
+        except (OSError, http.client.HTTPException) as exc:
+            # HTTP errors & dropped connections, zipfile would mistake an OSError for a corrupt archive
+            raise HTTPRangeError(f"range request to '{self.url}' failed: {exc}") from exc
 
+        if len(data) != end - start + 1:
+            raise HTTPRangeError("short range response")
+        self.bytes_fetched += len(data)
+        return data
+
+    def _get_blocks(self, first: int, last: int) -> None:
+        """Ensure blocks first..last are cached, coalescing missing blocks into one request"""
+        missing = [i for i in range(first, last + 1) if i not in self._blocks]
+        if missing:
+            start = missing[0] * self.block_size
+            end = min((missing[-1] + 1) * self.block_size, self.size) - 1
+            data = self._fetch(start, end)
+            for i in range(missing[0], missing[-1] + 1):
+                offset = i * self.block_size - start
+                self._blocks[i] = data[offset : offset + self.block_size]
+
+        for i in range(first, last + 1):
+            self._blocks.move_to_end(i)
+        while len(self._blocks) > max(self.max_blocks, last - first + 1):
+            _ = self._blocks.popitem(last=False)
+
+    @override
+    def readinto(self, buffer: bytearray | memoryview) -> int:  # pyright: ignore[reportIncompatibleMethodOverride]
+        n = min(len(buffer), self.size - self._pos)
+        if n <= 0:
+            return 0
+
+        first = self._pos // self.block_size
+        last = (self._pos + n - 1) // self.block_size
+        self._get_blocks(first, last)
+
+        view = memoryview(buffer)
+        written = 0
+        while written < n:
+            i, offset = divmod(self._pos + written, self.block_size)
+            chunk = self._blocks[i][offset : offset + n - written]
+            view[written : written + len(chunk)] = chunk
+            written += len(chunk)
+
+        self._pos += n
+        return n
+
+
+def fetch_many_args(downloads: list[Download]) -> list[str]:
+    return [
+        "nix-instantiate",
+        "--eval",
+        "--strict",
+        "--json",
+        "--expr",
+        FETCH_MANY_EXPR,
+        "--argstr",
+        "args",
+        json.dumps([dl.fetch_spec() for dl in downloads]),
+    ]
+
+
+def parse_fetch_many(downloads: list[Download], stdout: bytes) -> list[pathlib.Path]:
+    result = json.loads(stdout)  # pyright: ignore[reportAny]
+    if not isinstance(result, list) or len(result) != len(downloads):  # pyright: ignore[reportUnknownArgumentType]
+        raise ValueError("result json not a list matching downloads")
+
+    paths: list[pathlib.Path] = []
+    for dl, store_path in zip(downloads, result):  # pyright: ignore[reportUnknownVariableType,reportUnknownArgumentType]
+        if not isinstance(store_path, str):
+            raise ValueError("result json not string")
+        paths.append(dl.finalize(pathlib.Path(store_path)))
+
+    return paths
+
+
+def fetch_many(downloads: list[Download]) -> list[pathlib.Path]:
+    """Realise downloads using a single nix-instantiate invocation"""
+    return parse_fetch_many(downloads, get_runner().run(fetch_many_args(downloads)))
+
+
+# Store paths checked per nix-store invocation, bounding the command line length
+VALIDITY_BATCH_SIZE = 1024
+
+
+def valid_store_paths(paths: list[pathlib.Path]) -> set[pathlib.Path]:
+    """Paths registered as valid in the store, none if validity can't be checked"""
+    runner = get_runner()
+    invalid: set[pathlib.Path] = set()
+    for i in range(0, len(paths), VALIDITY_BATCH_SIZE):
+        batch = [str(path) for path in paths[i : i + VALIDITY_BATCH_SIZE]]
+        try:
+            stdout = runner.run(["nix-store", "--check-validity", "--print-invalid", *batch])
+        except (subprocess.CalledProcessError, subprocess.TimeoutExpired, OSError) as exc:
+            logger.warning("could not check store path validity: %s", exc)
+            return set()
+        invalid.update(pathlib.Path(line) for line in stdout.decode().splitlines() if line)
+    return set(paths) - invalid
+
+
+class Fetcher:
+    """
+    Realise downloads, batching many fetches into few evaluator invocations
+
+    Each download is fetched at most once, concurrent requests for a download
+    already being fetched wait for that fetch instead.
+    Downloads whose fixed-output path is already valid in the store are used
+    without invoking the evaluator, validity of all such paths is checked at once.
+    """
+
+    batch_size: int
+    store_dir: pathlib.Path
+    paths: dict[str, pathlib.Path]
+
+    _pending: set[futures.Future[bytes]]
+    # Fetches in flight by download key, resolving to None if they failed
+    _inflight: dict[str, futures.Future[pathlib.Path | None]]
+    _lock: threading.Lock
+
+    def __init__(self, batch_size: int = 64, store_dir: pathlib.Path | None = None) -> None:
+        self.batch_size = batch_size
+        self.store_dir = store_dir or default_store_dir()
+        self.paths = {}
+        self._pending = set()
+        self._inflight = {}
+        self._lock = threading.Lock()
+
+    @override
+    def __getstate__(self) -> dict[str, object]:
+        return {"batch_size": self.batch_size, "store_dir": self.store_dir, "paths": self.paths}
+
+    def __setstate__(self, state: dict[str, object]) -> None:
+        self.batch_size = state["batch_size"]  # pyright: ignore[reportAttributeAccessIssue]
+        self.store_dir = state["store_dir"]  # pyright: ignore[reportAttributeAccessIssue]
+        self.paths = state["paths"]  # pyright: ignore[reportAttributeAccessIssue]
+        self._pending = set()
+        self._inflight = {}
+        self._lock = threading.Lock()
+
+    def _in_store(self, downloads: Iterable[Download]) -> dict[str, pathlib.Path]:
+        """Paths of downloads already present in the store, by download key"""
+        candidates: dict[str, tuple[Download, pathlib.Path]] = {}
+        for dl in downloads:
+            if not isinstance(dl, HTTPDownload):
+                continue
+            path = dl.store_path(self.store_dir)
+            if path is None:
+                continue
+            try:
+                st = path.stat()
+            except OSError:
+                continue
+            if stat.S_ISREG(st.st_mode) and (dl.size is None or st.st_size == dl.size):
+                candidates[dl.key] = (dl, path)
+
+        if not candidates:
+            return {}
+
+        # Partially written or corrupt files may exist without being registered as valid
+        with trace.span("Fetcher.check_validity", "fetch", paths=len(candidates)):
+            valid = valid_store_paths([path for _, path in candidates.values()])
+        paths = {key: dl.finalize(path) for key, (dl, path) in candidates.items() if path in valid}
+        stats.incr("artifacts-in-store", len(paths))
+        return paths
+
+    def _finish(self, key: str, path: pathlib.Path | None) -> None:
+        with self._lock:
+            if path:
+                self.paths[key] = path
+            inflight = self._inflight.pop(key)
+        inflight.set_result(path)
+
+    def prefetch(self, downloads: Iterable[Download]) -> None:
+        pending: dict[str, Download] = {}
+        with self._lock:
+            for dl in downloads:
+                if dl.key not in self.paths and dl.key not in self._inflight:
+                    pending[dl.key] = dl
+                    self._inflight[dl.key] = futures.Future()
+
+        if not pending:
+            return
+
+        try:
+            in_store = self._in_store(pending.values())
+            for key, path in in_store.items():
+                self._finish(key, path)
+
+            batches: list[list[Download]] = []
+            todo = [dl for key, dl in pending.items() if key not in in_store]
+            for i in range(0, len(todo), self.batch_size):
+                batches.append(todo[i : i + self.batch_size])
+
+            if todo:
+                logger.info("prefetching %d artifacts in %d batches", len(todo), len(batches))
+                with trace.span("Fetcher.prefetch", "fetch", downloads=len(todo), batches=len(batches)):
+                    self._prefetch_batches(batches)
+        finally:
+            # Anything not fetched is left for individual fetches
+            for key in pending:
+                with self._lock:
+                    done = key in self.paths
+                if not done:
+                    self._finish(key, None)
+
+    def _prefetch_batches(self, batches: list[list[Download]]) -> None:
+        # Concurrency is bounded by the runner's nix-instantiate limit
+        runner = get_runner()
+        batch_futures = [runner.submit(fetch_many_args(batch)) for batch in batches]
+        with self._lock:
+            self._pending.update(batch_futures)
+
+        try:
+            for batch, future in zip(batches, batch_futures):
+                try:
+                    paths = parse_fetch_many(batch, future.result())
+                except (subprocess.CalledProcessError, subprocess.TimeoutExpired, ValueError) as exc:
+                    # Leave failed batches for individual fetches to report on
+                    logger.warning("batch prefetch failed: %s", exc)
+                    continue
+
+                for dl, path in zip(batch, paths):
+                    self._finish(dl.key, path)
+                stats.incr("artifacts-fetched", len(batch))
+        except BaseException:
+            for future in batch_futures:
+                _ = future.cancel()
+            raise
+        finally:
+            with self._lock:
+                self._pending.difference_update(batch_futures)
+
+    def cancel(self) -> None:
+        """Cancel outstanding prefetches"""
+        with self._lock:
+            pending = list(self._pending)
+        for future in pending:
+            _ = future.cancel()
+
+    def get(self, download: Download) -> pathlib.Path:
+        key = download.key
+        while True:
+            with self._lock:
+                try:
+                    return self.paths[key]
+                except KeyError:
+                    pass
+
+                inflight = self._inflight.get(key)
+                if inflight is None:
+                    self._inflight[key] = futures.Future()
+                    break
+
+            # Fetched by someone else, retrying ourselves if they failed
+            _ = inflight.result()
+
+        try:
+            path = self._in_store([download]).get(key) or download.get()
+        except BaseException:
+            self._finish(key, None)
+            raise
+        self._finish(key, path)
         return path
@@ -0,0 +1,176 @@
+from __future__ import annotations
+from collections.abc import Iterator
+from dataclasses import dataclass, field
+from typing import IO
+import struct
+
+
+ELF_MAGIC = b"\x7fELF"
+
+ELFCLASS32 = 1
+ELFCLASS64 = 2
+ELFDATA2LSB = 1
+ELFDATA2MSB = 2
+
+PT_LOAD = 1
+PT_DYNAMIC = 2
+
+# Extended program header numbering, count is stored in section 0
+PN_XNUM = 0xFFFF
+
+DT_NULL = 0
+DT_NEEDED = 1
+DT_STRTAB = 5
+DT_STRSZ = 10
+DT_SONAME = 14
+DT_RUNPATH = 29
+
+
+class ELFError(Exception):
+    pass
+
+
+@dataclass
+class DynamicInfo:
+    needed: list[str] = field(default_factory=list)
+    soname: str | None = None
+    runpath: list[str] = field(default_factory=list)
+
+
+def _read_at(fp: IO[bytes], offset: int, size: int) -> bytes:
+    _ = fp.seek(offset)
+    data = fp.read(size)
+    if len(data) != size:
+        raise ELFError("unexpected end of file")
+    return data
+
+
+def _read_str(strtab: bytes, offset: int) -> str:
+    end = strtab.find(b"\x00", offset)
+    if offset >= len(strtab) or end == -1:
+        raise ELFError("string table offset out of range")
+    return strtab[offset:end].decode("utf-8", errors="surrogateescape")
+
+
+def read_dynamic(fp: IO[bytes]) -> DynamicInfo:
+    """
+    Read the dynamic segment using program headers only.
+
+    Avoids walking section headers, which are stored at the end of the file
+    and therefore require reading (or decompressing) it in full.
+    """
+    ident = _read_at(fp, 0, 16)
+    if ident[:4] != ELF_MAGIC:
+        raise ELFError("not an ELF file")
+
+    elf_class = ident[4]
+    data = ident[5]
+    if data == ELFDATA2LSB:
+        endian = "<"
+    elif data == ELFDATA2MSB:
+        endian = ">"
+    else:
+        raise ELFError(f"unsupported ELF data encoding {data}")
+
+    if elf_class == ELFCLASS64:
+        ehdr = struct.Struct(endian + "16xHHIQQQIHHH")
+        phdr = struct.Struct(endian + "IIQQQQQQ")
+        dyn = struct.Struct(endian + "qQ")
+    elif elf_class == ELFCLASS32:
+        ehdr = struct.Struct(endian + "16xHHIIIIIHHH")
+        phdr = struct.Struct(endian + "IIIIIIII")
+        dyn = struct.Struct(endian + "iI")
+    else:
+        raise ELFError(f"unsupported ELF class {elf_class}")
+
+    header: tuple[int, ...] = ehdr.unpack(_read_at(fp, 0, ehdr.size))
+    (_, _, _, _, e_phoff, _, _, _, e_phentsize, e_phnum) = header
+    if e_phnum == PN_XNUM:
+        raise ELFError("extended program header numbering not supported")
+    if e_phnum and e_phentsize < phdr.size:
+        raise ELFError("invalid program header size")
+
+    # Collect (vaddr, offset, filesz) for address translation
+    loads: list[tuple[int, int, int]] = []
+    dynamic: tuple[int, int] | None = None
+
+    phdrs = _read_at(fp, e_phoff, e_phnum * e_phentsize)
+    for i in range(e_phnum):
+        fields: tuple[int, ...] = phdr.unpack_from(phdrs, i * e_phentsize)
+        if elf_class == ELFCLASS64:
+            p_type, _, p_offset, p_vaddr, _, p_filesz, _, _ = fields
+        else:
+            p_type, p_offset, p_vaddr, _, p_filesz, _, _, _ = fields
+
+        if p_type == PT_LOAD:
+            loads.append((p_vaddr, p_offset, p_filesz))
+        elif p_type == PT_DYNAMIC:
+            dynamic = (p_offset, p_filesz)
+
+    info = DynamicInfo()
+    if dynamic is None:  # Statically linked
+        return info
+
+    entries: list[tuple[int, int]] = []
+    strtab_addr: int | None = None
+    strsz: int | None = None
+    dyn_offset, dyn_size = dynamic
+    dyn_entries: Iterator[tuple[int, int]] = dyn.iter_unpack(
+        _read_at(fp, dyn_offset, dyn_size - dyn_size % dyn.size)
+    )
+    for d_tag, d_val in dyn_entries:
+        if d_tag == DT_NULL:
+            break
+        elif d_tag == DT_STRTAB:
+            strtab_addr = d_val
+        elif d_tag == DT_STRSZ:
+            strsz = d_val
+        elif d_tag in (DT_NEEDED, DT_SONAME, DT_RUNPATH):
+            entries.append((d_tag, d_val))
+
+    if not entries:
+        return info
+    if strtab_addr is None or strsz is None:
+        raise ELFError("dynamic segment without string table")
+
+    for vaddr, offset, filesz in loads:
+        if vaddr <= strtab_addr < vaddr + filesz:
+            strtab_offset = strtab_addr - vaddr + offset
+            break
+    else:
+        raise ELFError("string table not in a loadable segment")
+
+    strtab = _read_at(fp, strtab_offset, strsz)
+    for d_tag, d_val in entries:
+        value = _read_str(strtab, d_val)
+        if d_tag == DT_NEEDED:
+            info.needed.append(value)
+        elif d_tag == DT_SONAME:
+            info.soname = value
+        else:
+            info.runpath.extend(value.split(":"))
+
+    return info
+
+
+def read_dynamic_elftools(fp: IO[bytes]) -> DynamicInfo:
+    """Read the dynamic section using pyelftools, slow but handles odd files"""
+    from elftools.elf.elffile import ELFFile
+    from elftools.elf.dynamic import DynamicSection
+
+    info = DynamicInfo()
+
+    elf = ELFFile(fp)
+    for section in elf.iter_sections():
+        if not isinstance(section, DynamicSection):
+            continue
+        for tag in section.iter_tags():
+            d_tag: str = tag.entry.d_tag  # pyright: ignore[reportAny]
+            if d_tag == "DT_NEEDED":
+                info.needed.append(tag.needed)  # pyright: ignore[reportUnknownMemberType,reportAttributeAccessIssue,reportUnknownArgumentType]
+            elif d_tag == "DT_SONAME":
+                info.soname = tag.soname  # pyright: ignore[reportUnknownMemberType,reportAttributeAccessIssue]
+            elif d_tag == "DT_RUNPATH":
+                info.runpath.extend(tag.runpath.split(":"))  # pyright: ignore[reportUnknownMemberType,reportAttributeAccessIssue,reportUnknownArgumentType]
+
+    return info
@@ -0,0 +1,123 @@
+from __future__ import annotations
+from pathlib import Path
+from typing import cast
+import threading
+import logging
+import json
+
+from autorider.output import PackageOutput, load_output
+
+
+logger = logging.getLogger(__name__)
+
+
+# Bump when post-processing changes to invalidate all carried over outputs
+MANIFEST_VERSION = 2
+
+
+def manifest_path(output_path: Path) -> Path:
+    """Sidecar manifest stored next to the output file"""
+    return output_path.with_suffix(".manifest.json")
+
+
+def invalidate_manifest(output_path: Path) -> None:
+    """Remove the manifest before the output is overwritten, so a crash can't leave it stale"""
+    manifest_path(output_path).unlink(missing_ok=True)
+
+
+def manifest_key(name: str, version: str | None) -> str:
+    return f"{name}=={version}" if version else name
+
+
+class Manifest:
+    """
+    Package fingerprints of a previous run, used to carry over unchanged outputs
+
+    Outputs themselves are read back from the previous output file, the manifest
+    only records which inputs produced them.
+    """
+
+    previous: dict[str, str]
+    fingerprints: dict[str, str]
+    # Keys of packages with empty outputs, which the output file omits
+    previous_empty: set[str]
+    empty: set[str]
+
+    _outputs: dict[str, PackageOutput | list[PackageOutput]]
+    _lock: threading.Lock
+
+    def __init__(
+        self,
+        previous: dict[str, str] | None = None,
+        outputs: dict[str, PackageOutput | list[PackageOutput]] | None = None,
+        previous_empty: set[str] | None = None,
+    ) -> None:
+        self.previous = previous or {}
+        self.fingerprints = {}
+        self.previous_empty = previous_empty or set()
+        self.empty = set()
+        self._outputs = outputs or {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def load(cls, output_path: Path) -> Manifest:
+        """Load manifest & previous outputs, starting from scratch if either is unusable"""
+        try:
+            with open(manifest_path(output_path)) as fp:
+                manifest = json.load(fp)  # pyright: ignore[reportAny]
+            output = load_output(output_path)
+        except (OSError, ValueError) as exc:
+            logger.info("not using previous outputs: %s", exc)
+            return cls()
+
+        if not isinstance(manifest, dict) or manifest.get("version") != MANIFEST_VERSION:  # pyright: ignore[reportUnknownMemberType]
+            logger.info("not using previous outputs: manifest version mismatch")
+            return cls()
+
+        fingerprints = cast(dict[str, str], manifest.get("packages", {}))  # pyright: ignore[reportUnknownMemberType]
+        empty = cast(list[str], manifest.get("empty", []))  # pyright: ignore[reportUnknownMemberType]
+        return cls(fingerprints, output.get("packages", {}), set(empty))
+
+    def carry_over(self, name: str, version: str | None, fingerprint: str) -> PackageOutput | None:
+        """Previous output of an unchanged package"""
+        key = manifest_key(name, version)
+        if self.previous.get(key) != fingerprint:
+            return None
+
+        outputs: PackageOutput | list[PackageOutput] | None = self._outputs.get(name)
+        if outputs is None:
+            # Empty outputs are omitted from the output file, anything else missing was lost
+            if key not in self.previous_empty:
+                return None
+            outputs = {}
+        if isinstance(outputs, list):
+            for output in outputs:
+                if output.get("version") == version:
+                    return output.copy()
+            return None
+
+        # Single outputs are collapsed without their version
+        output = outputs.copy()
+        if version:
+            output["version"] = version
+        return output
+
+    def record(self, name: str, version: str | None, fingerprint: str, output: PackageOutput) -> None:
+        key = manifest_key(name, version)
+        with self._lock:
+            self.fingerprints[key] = fingerprint
+            if not output.keys() - {"version"}:
+                self.empty.add(key)
+
+    def dump(self, output_path: Path) -> None:
+        with open(manifest_path(output_path), "w") as fp:
+            json.dump(
+                {
+                    "version": MANIFEST_VERSION,
+                    "packages": dict(sorted(self.fingerprints.items())),
+                    "empty": sorted(self.empty),
+                },
+                fp,
+                indent=2,
+            )
+            _ = fp.write("\n")
@@ -1,5 +1,9 @@
-import subprocess
+from pathlib import Path
 import logging
+import os
+
+from autorider.runner import get_runner
+from autorider import stats, trace
 
 
 logger = logging.getLogger(__name__)
@@ -13,31 +17,42 @@ SO_PROVIDERS: dict[str, str] = {
 }
 
 
-def nix_locate_file(name: str, ignore: list[str] | None = None) -> str | None:
-    logger.debug("running nix-locate for file '%s'", name)
+def nix_index_database() -> Path:
+    """Location of the nix-index files database as used by nix-locate"""
+    database_dir = os.environ.get("NIX_INDEX_DATABASE")
+    if database_dir:
+        return Path(database_dir).joinpath("files")
 
+    xdg_cache_home = os.environ.get("XDG_CACHE_HOME")
+    cache_home = Path(xdg_cache_home) if xdg_cache_home else Path.home().joinpath(".cache")
+    return cache_home.joinpath("nix-index", "files")
+
+
+def nix_index_stamp() -> str | None:
+    """Identity of the current nix-index database, changing whenever it is regenerated"""
     try:
-        return SO_PROVIDERS[name]
-    except KeyError:
-        pass
+        st = nix_index_database().stat()
+    except FileNotFoundError:
+        return None
+    return f"{st.st_mtime_ns}-{st.st_size}-{st.st_ino}"
 
-    """Use nix-locate to find filename from db"""
-    proc = subprocess.run(
-        [
-            "nix-locate",
-            "--no-group",
-            "--minimal",
-            "-t",
-            "r",
-            "-t",
-            "x",
-            name,
-        ],
-        check=True,
-        stdout=subprocess.PIPE,
-    )
-
-    for line in proc.stdout.decode().split("\n"):
+
+def nix_locate_args(name: str) -> list[str]:
+    return [
+        "nix-locate",
+        "--no-group",
+        "--minimal",
+        "-t",
+        "r",
+        "-t",
+        "x",
+        name,
+    ]
+
+
+def parse_nix_locate(stdout: bytes, ignore: list[str] | None = None) -> str | None:
+    """Pick the first provider from nix-locate output not matching an ignored prefix"""
+    for line in stdout.decode().split("\n"):
         if not line:
             continue
 
@@ -47,6 +62,23 @@ def nix_locate_file(name: str, ignore: list[str] | None = None) -> str | None:
         return line
 
 
+def nix_locate_file(name: str, ignore: list[str] | None = None) -> str | None:
+    """Use nix-locate to find filename from db"""
+    logger.debug("running nix-locate for file '%s'", name)
+
+    try:
+        provider = SO_PROVIDERS[name]
+    except KeyError:
+        pass
+    else:
+        stats.incr("so-providers-hits")
+        return provider
+
+    stats.incr("nix-locate-calls")
+    with trace.span("nix_locate_file", "lookup", soname=name):
+        return parse_nix_locate(get_runner().run(nix_locate_args(name)), ignore)
+
+
 def select_wheel(names: list[str]) -> None | str:
     for name in reversed(sorted(names)):
         if "manylinux" in name:
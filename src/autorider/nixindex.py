@@ -0,0 +1,161 @@
+"""
+Reader for the nix-index files database
+
+Resolves many file names in a single streaming pass rather than one
+nix-locate process (and one full database scan) per name.
+
+The database starts with the magic b"NIXI" and a little endian u64 format
+version followed by a zstd compressed stream of frcode encoded entries.
+Each entry is encoded as:
+
+  <metadata> \\x00 <shared prefix differential> <path suffix> \\n
+
+Where the differential is an i8 (or 0x80 followed by a big endian i16) of the
+shared prefix length relative to the previous entry.
+File entry metadata is suffixed by the file type ("r", "x", "d" or "s").
+Files are followed by a package entry with metadata "p" and a JSON store path.
+"""
+
+from collections.abc import Iterable, Iterator
+from pathlib import Path
+from typing import IO
+import logging
+import struct
+import json
+import re
+
+
+logger = logging.getLogger(__name__)
+
+
+FILE_MAGIC = b"NIXI"
+FORMAT_VERSION = 1
+
+# Read decompressed data in chunks of this size
+CHUNK_SIZE = 4 * 1024 * 1024
+
+# File types matched, equivalent to nix-locate -t r -t x
+FILE_TYPES = (ord("r"), ord("x"))
+
+
+class DatabaseError(Exception):
+    pass
+
+
+def available() -> bool:
+    try:
+        import zstandard  # pyright: ignore[reportUnusedImport]  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def format_attr(origin: dict[str, object]) -> str:
+    """Attribute of a store path origin as printed by nix-locate --minimal"""
+    attr = f"{origin['attr']}.{origin['output']}"
+    # Packages only reachable as dependencies of a top-level attribute are parenthesised
+    if not origin.get("toplevel", True):
+        return f"({attr})"
+    return attr
+
+
+def iter_entries(fp: IO[bytes]) -> Iterator[tuple[bytes, bytes]]:
+    """Decode a decompressed frcode stream into (metadata, path) pairs"""
+    buf = b""
+    pos = 0
+    prev = b""
+    shared_len = 0
+
+    while True:
+        sep = buf.find(b"\x00", pos)
+        start = nl = -1
+        if sep != -1 and sep + 1 < len(buf):
+            start = sep + (4 if buf[sep + 1] == 0x80 else 2)
+            if start <= len(buf):
+                nl = buf.find(b"\n", start)
+
+        # Entry is incomplete, refill buffer
+        if nl == -1:
+            chunk = fp.read(CHUNK_SIZE)
+            if not chunk:
+                if pos != len(buf):
+                    raise DatabaseError("truncated database entry")
+                return
+            buf = buf[pos:] + chunk
+            pos = 0
+            continue
+
+        if start == sep + 4:
+            (diff,) = struct.unpack_from(">h", buf, sep + 2)
+        else:
+            (diff,) = struct.unpack_from("b", buf, sep + 1)
+
+        shared_len += diff
+        if shared_len < 0 or shared_len > len(prev):
+            raise DatabaseError("invalid shared prefix length")
+
+        meta = buf[pos:sep]
+        path = prev[:shared_len] + buf[start:nl]
+        prev = path
+        pos = nl + 1
+
+        yield meta, path
+
+
+def locate_files(
+    database: Path,
+    names: Iterable[str],
+    ignore: list[str] | None = None,
+) -> dict[str, str]:
+    """
+    Resolve file names to their first providing attribute.
+
+    Matches names anywhere in regular & executable file paths, returning the
+    same attr.output mapping as nix-locate --no-group --minimal -t r -t x.
+    """
+    import zstandard
+
+    pending: dict[bytes, str] = {name.encode(): name for name in names}
+    ret: dict[str, str] = {}
+    if not pending:
+        return ret
+
+    pattern = re.compile(b"|".join(re.escape(name) for name in pending))
+
+    with open(database, "rb") as fp:
+        magic = fp.read(len(FILE_MAGIC))
+        if magic != FILE_MAGIC:
+            raise DatabaseError(f"'{database}' is not a nix-index database")
+        (version,) = struct.unpack("<Q", fp.read(8))
+        if version != FORMAT_VERSION:
+            raise DatabaseError(f"unsupported nix-index format version {version}")
+
+        reader = zstandard.ZstdDecompressor().stream_reader(fp)
+
+        # Names matched by files of the package currently being read
+        matched: set[bytes] = set()
+        try:
+            for meta, path in iter_entries(reader):
+                if meta == b"p":
+                    if matched:
+                        store_path = json.loads(path)  # pyright: ignore[reportAny]
+                        attr = format_attr(store_path["origin"])  # pyright: ignore[reportAny]
+                        if not (ignore and any(attr.startswith(prefix) for prefix in ignore)):
+                            for name in matched:
+                                ret[pending.pop(name)] = attr
+                            if not pending:
+                                break
+                            pattern = re.compile(b"|".join(re.escape(name) for name in pending))
+                        matched = set()
+                    continue
+
+                if not meta or meta[-1] not in FILE_TYPES:
+                    continue
+
+                # Regex is a fast prefilter, names may overlap within a path
+                if pattern.search(path):
+                    matched.update(name for name in pending if name in path)
+        except zstandard.ZstdError as exc:
+            raise DatabaseError(f"corrupt nix-index database '{database}': {exc}") from exc
+
+    return ret
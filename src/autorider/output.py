@@ -1,4 +1,9 @@
-from typing import TypedDict, NotRequired
+from collections.abc import Iterable
+from typing import IO, Literal, TypedDict, NotRequired, cast
+from pathlib import Path
+import threading
+import json
+import re
 
 
 PackageOutput = TypedDict(
@@ -25,3 +30,155 @@ Output = TypedDict(
         "so-providers": NotRequired[dict[str, str]],
     }
 )
+
+# Records of the streaming JSON Lines output format
+PackageRecord = TypedDict(
+    "PackageRecord",
+    {
+        "type": Literal["package"],
+        "name": str,
+        "output": PackageOutput,
+    },
+)
+
+SoProvidersRecord = TypedDict(
+    "SoProvidersRecord",
+    {
+        "type": Literal["so-providers"],
+        "so-providers": dict[str, str],
+    },
+)
+
+
+def _version_key(version: str) -> list[tuple[int, int | str]]:
+    # Numeric components compare as numbers, so 1.10 sorts after 1.9
+    return [
+        (0, int(part)) if part.isdigit() else (1, part)
+        for part in re.split(r"(\d+)", version)
+        if part
+    ]
+
+
+def _output_order(item: tuple[str, PackageOutput]) -> tuple[str, list[tuple[int, int | str]]]:
+    name, output = item
+    return name, _version_key(output.get("version", ""))
+
+
+def collapse_outputs(
+    outputs: Iterable[tuple[str, PackageOutput]],
+) -> dict[str, PackageOutput | list[PackageOutput]]:
+    """
+    Group package outputs by name, collapsing packages with a single output
+
+    Outputs arrive in completion order, packages are sorted by name & version.
+    """
+    ret: dict[str, PackageOutput | list[PackageOutput]] = {}
+    for name, output in sorted(outputs, key=_output_order):
+        ret.setdefault(name, []).append(output)  # pyright: ignore[reportAttributeAccessIssue]
+
+    # Collapse structure on non-abmigious packages
+    for name, pkg_outputs in ret.items():
+        if isinstance(pkg_outputs, list) and len(pkg_outputs) == 1:
+            output = pkg_outputs[0]
+            try:
+                del output["version"]
+            except KeyError:
+                pass
+            ret[name] = output
+
+    return {k: v for k, v in ret.items() if v}
+
+
+class JsonlWriter:
+    """
+    Write outputs as JSON Lines, flushing each record as soon as it's written
+
+    Packages are written in completion order, loading the output sorts them.
+    """
+
+    fp: IO[str]
+
+    _lock: threading.Lock
+
+    def __init__(self, fp: IO[str]) -> None:
+        self.fp = fp
+        self._lock = threading.Lock()
+
+    def _write(self, record: PackageRecord | SoProvidersRecord) -> None:
+        line = json.dumps(record) + "\n"
+        with self._lock:
+            _ = self.fp.write(line)
+            self.fp.flush()
+
+    def write_package(self, name: str, output: PackageOutput) -> None:
+        # Packages without enabled outputs are omitted, like in the JSON format
+        if not output:
+            return
+        self._write({"type": "package", "name": name, "output": output})
+
+    def write_so_providers(self, so_providers: dict[str, str]) -> None:
+        self._write({"type": "so-providers", "so-providers": so_providers})
+
+
+def load_jsonl(lines: Iterable[str]) -> Output:
+    """Convert JSON Lines records into the regular output structure"""
+    outputs: list[tuple[str, PackageOutput]] = []
+    so_providers: dict[str, str] = {}
+
+    for lineno, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+        record = cast(dict[str, object], json.loads(line))
+        match record.get("type"):
+            case "package":
+                package = cast(PackageRecord, cast(object, record))
+                outputs.append((package["name"], package["output"]))
+            case "so-providers":
+                providers = cast(SoProvidersRecord, cast(object, record))
+                so_providers.update(providers["so-providers"])
+            case record_type:
+                raise ValueError(f"unknown record type '{record_type}' on line {lineno}")
+
+    output: Output = {}
+    packages = collapse_outputs(outputs)
+    if packages:
+        output["packages"] = packages
+    if so_providers:
+        output["so-providers"] = so_providers
+    return output
+
+
+def _check_output(obj: dict[str, object]) -> Output:
+    packages = obj.get("packages", {})
+    if not isinstance(packages, dict) or not all(
+        isinstance(outputs, dict)
+        or (isinstance(outputs, list) and all(isinstance(output, dict) for output in outputs))  # pyright: ignore[reportUnknownVariableType]
+        for outputs in packages.values()  # pyright: ignore[reportUnknownVariableType]
+    ):
+        raise ValueError("'packages' is not a mapping of package outputs")
+
+    so_providers = obj.get("so-providers", {})
+    if not isinstance(so_providers, dict) or not all(
+        isinstance(provider, str)
+        for provider in so_providers.values()  # pyright: ignore[reportUnknownVariableType]
+    ):
+        raise ValueError("'so-providers' is not a mapping of sonames to attributes")
+
+    return cast(Output, cast(object, obj))
+
+
+def load_output(path: Path) -> Output:
+    """Load output written in either the JSON or JSON Lines format"""
+    with open(path) as fp:
+        text = fp.read()
+
+    try:
+        obj = json.loads(text)  # pyright: ignore[reportAny]
+    except json.JSONDecodeError:
+        pass
+    else:
+        # A single line of JSON Lines is also a valid JSON document
+        if isinstance(obj, dict) and "type" not in obj:
+            return _check_output(cast(dict[str, object], obj))
+
+    return load_jsonl(text.splitlines())
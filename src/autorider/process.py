@@ -1,26 +1,42 @@
 from typing import override, ClassVar
-from collections.abc import Iterable
+from collections.abc import Callable, Iterable
+from dataclasses import dataclass, field
 from concurrent import futures
+from contextlib import nullcontext
 from fnmatch import fnmatch
-from enum import Enum
+from pathlib import Path
+import threading
+import hashlib
 import logging
+import queue
+import json
+import time
 import re
 
-from autorider.lib import nix_locate_file
 from autorider.manylinux import MANYLINUX_LIBS
-from autorider.scanners import PackageScanner, ScanResult
-from autorider.manager import GENERATOR_T
-from autorider.config import AutoriderConfig
-from autorider.output import PackageOutput
+from autorider.scanners import PackageScanner, ScanContext, ScanDepends, ScanResult
+from autorider.config import AutoriderConfig, ConcurrencyConfig
+from autorider.download import Download
+from autorider.cache import Cache
+from autorider.output import PackageOutput, collapse_outputs
+from autorider.resolve import SonameResolver
+from autorider.incremental import Manifest
+from autorider.runner import configure_runner
+from autorider.trace import TraceEvent
+from autorider.stats import StatsSnapshot
+from autorider import stats, trace
 
 
 logger = logging.getLogger(__name__)
 
 
-class ScanDepends(Enum):
-    NONE = 0
-    SDIST = 1
-    WHEEL = 2
+# Packages buffered between the fetch & scan pipeline stages
+QUEUE_SIZE = 64
+
+# Threads realising downloads ahead of scanning
+FETCH_WORKERS = 4
+
+OUTPUT_CB_T = Callable[[str, PackageOutput], None]
 
 
 class PostProcessor:
@@ -106,7 +122,7 @@ class BuildSystemPostProcessor(PostProcessor):
     Output python build systems based on sdist scan
     """
 
-    SCAN_DEPENDS: ClassVar[ScanDepends] = ScanDepends.SDIST
+    SCAN_DEPENDS: ClassVar[ScanDepends] = ScanDepends.SDIST_BUILD_SYSTEMS
 
     @override
     def run(self, output: PackageOutput) -> None:
@@ -125,7 +141,7 @@ class BuildRequiresPostProcessor(PostProcessor):
     Output nativeBuildInputs tooling based on source tree files
     """
 
-    SCAN_DEPENDS: ClassVar[ScanDepends] = ScanDepends.SDIST
+    SCAN_DEPENDS: ClassVar[ScanDepends] = ScanDepends.SDIST_BUILD_REQUIRES
 
     @override
     def run(self, output: PackageOutput) -> None:
@@ -139,26 +155,22 @@ class BuildRequiresPostProcessor(PostProcessor):
         output["build-requires"] = list(build_requires)
 
 
+def output_sonames(output: PackageOutput) -> set[str]:
+    """Dependency sonames of a package output needing a provider lookup"""
+    return set(output.get("wheel-depends-so", [])) | set(output.get("sdist-depends-so", []))
+
+
 def lookup_sonames(
     sonames: Iterable[str],
     ignore: list[str],
+    cache: Cache | None = None,
 ) -> dict[str, str]:
-    ret: dict[str, str] = {}
-    with futures.ThreadPoolExecutor() as executor:
-        lookup_futures = [
-            executor.submit(nix_locate_file, soname, ignore=ignore)
-            for soname in sonames
-        ]
-        for soname, future in zip(sonames, lookup_futures):
-            result = future.result()
-            if result:
-                ret[soname] = result
-    return ret
-
+    resolver = SonameResolver(ignore, cache)
+    resolver.submit(sonames)
+    return resolver.result()
 
-def process_pkg(config: AutoriderConfig, pkg_scanner: PackageScanner):
-    name = pkg_scanner.name
 
+def get_postprocessors(config: AutoriderConfig, name: str) -> list[type[PostProcessor]]:
     output_config = config.outputs
     pkg_config = config.packages.get(name)
     if pkg_config:
@@ -166,8 +178,8 @@ def process_pkg(config: AutoriderConfig, pkg_scanner: PackageScanner):
             update=pkg_config.model_dump(exclude_none=True)
         )
 
-    # Figure out dependencies for the scan
-    scan_depends: set[ScanDepends] = set()
+    logger.debug("using output config for package '%s': '%s'", name, output_config)
+
     postprocessors: list[type[PostProcessor]] = []
     if output_config.build_systems:
         postprocessors.append(BuildSystemPostProcessor)
@@ -177,60 +189,435 @@ def process_pkg(config: AutoriderConfig, pkg_scanner: PackageScanner):
         postprocessors.append(SdistDependsPostProcessor)
     if output_config.build_requires:
         postprocessors.append(BuildRequiresPostProcessor)
+
+    return postprocessors
+
+
+def get_scan_depends(postprocessors: list[type[PostProcessor]]) -> ScanDepends:
+    scan_depends = ScanDepends.NONE
     for postprocessor in postprocessors:
-        scan_depends.add(postprocessor.SCAN_DEPENDS)
+        scan_depends |= postprocessor.SCAN_DEPENDS
+    return scan_depends
+
+
+def pkg_fingerprint(
+    pkg_scanner: PackageScanner,
+    postprocessors: list[type[PostProcessor]],
+    depends: ScanDepends,
+    context: ScanContext | None = None,
+) -> str | None:
+    """Identity of the inputs to a package's output, if all of its artifacts are content addressed"""
+    if not postprocessors:
+        return None
+
+    artifact_keys: list[str] = []
+    for artifact in pkg_scanner.artifacts(depends):
+        key = artifact.cache_key(depends, context)
+        if key is None:
+            return None
+        artifact_keys.append(key)
+
+    data = json.dumps(
+        [
+            pkg_scanner.name,
+            pkg_scanner.version,
+            [postprocessor.__name__ for postprocessor in postprocessors],
+            sorted(artifact_keys),
+        ]
+    )
+    return hashlib.sha256(data.encode()).hexdigest()
+
+
+def process_pkg(
+    config: AutoriderConfig,
+    pkg_scanner: PackageScanner,
+    context: ScanContext | None = None,
+):
+    name = pkg_scanner.name
 
-    logger.debug("processing package '%s' with config '%s'", name, output_config)
+    # Figure out dependencies for the scan
+    postprocessors = get_postprocessors(config, name)
+    scan_depends = get_scan_depends(postprocessors)
 
     output: PackageOutput = {}
     if not postprocessors:
-        return pkg_scanner, output
+        return name, output
 
     if pkg_scanner.version:
         output["version"] = pkg_scanner.version
 
     logger.info("scanning package '%s'", name)
-    scan_result = pkg_scanner.scan()
-    for postprocessor_cls in postprocessors:
-        logger.debug(
-            "processing output for '%s' with postprocessor '%s'",
-            name,
-            postprocessor_cls,
+    start = time.perf_counter()
+    with trace.span("package", "package", package=name, version=pkg_scanner.version):
+        scan_result = pkg_scanner.scan(scan_depends, context)
+        for postprocessor_cls in postprocessors:
+            logger.debug(
+                "processing output for '%s' with postprocessor '%s'",
+                name,
+                postprocessor_cls,
+            )
+            with trace.span(postprocessor_cls.__name__, "postprocess", package=name):
+                postprocessor_cls(scan_result).run(output)
+
+    stats.incr("packages-scanned")
+    stats.get_stats().record_package(name, pkg_scanner.version, time.perf_counter() - start)
+
+    return name, output
+
+
+# Scan context of process pool workers, set once by the pool initializer
+_worker_context: ScanContext | None = None
+
+
+def _init_worker(
+    context: ScanContext | None,
+    concurrency: ConcurrencyConfig,
+    tracing: bool,
+) -> None:
+    global _worker_context
+    _worker_context = context
+    _ = configure_runner(concurrency.limits(), concurrency.timeout)
+    if tracing:
+        _ = trace.enable()
+
+
+@dataclass
+class _WorkerResult:
+    name: str
+    output: PackageOutput
+    # Spans & stats recorded in the worker, shipped back to the parent with the result
+    events: list[TraceEvent]
+    stats: StatsSnapshot
+
+
+def _process_pkg_worker(
+    config: AutoriderConfig,
+    pkg_scanner: PackageScanner,
+    paths: dict[str, Path],
+) -> _WorkerResult:
+    # Downloads are realised by the parent after the worker context was created
+    if _worker_context and _worker_context.fetcher:
+        _worker_context.fetcher.paths.update(paths)
+    name, output = process_pkg(config, pkg_scanner, _worker_context)
+
+    tracer = trace.get_tracer()
+    return _WorkerResult(
+        name, output, tracer.drain() if tracer else [], stats.get_stats().drain()
+    )
+
+
+def make_executor(config: AutoriderConfig, context: ScanContext | None) -> futures.Executor:
+    if config.process_pool:
+        import multiprocessing
+
+        return futures.ProcessPoolExecutor(
+            max_workers=config.jobs,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(context, config.concurrency, trace.get_tracer() is not None),
         )
-        postprocessor_cls(scan_result).run(output)
+    return futures.ThreadPoolExecutor(max_workers=config.jobs)
+
+
+@dataclass
+class _Job:
+    pkg_scanner: PackageScanner
+    depends: ScanDepends
+    fingerprint: str | None = None
+    # Realised download paths keyed by download key
+    paths: dict[str, Path] = field(default_factory=dict)
+
+
+class _Pipeline:
+    """
+    Fetch, scan & resolve packages in overlapping stages
+
+    Fetch workers realise downloads in batches of whatever packages are queued,
+    handing packages to the scan executor as soon as their artifacts are available.
+    Sonames of scanned packages are passed on to the resolver immediately.
+    Queues between stages are bounded so a fast stage can't run arbitrarily
+    far ahead of a slow one.
+
+    Packages unchanged since the run recorded in manifest skip all stages but resolution.
+    """
 
-    return pkg_scanner, output
+    config: AutoriderConfig
+    context: ScanContext | None
+    resolver: SonameResolver | None
+    manifest: Manifest | None
+    on_output: OUTPUT_CB_T | None
+    executor: futures.Executor
+    # Shared executors are left running, waiting on this run's futures instead
+    owns_executor: bool
+
+    failed: threading.Event
+    outputs: list[tuple[str, PackageOutput]]
+    errors: list[BaseException]
+
+    _jobs: queue.Queue[_Job | None]
+    _inflight: threading.BoundedSemaphore
+    _pending: set[futures.Future[tuple[str, PackageOutput] | _WorkerResult]]
+    _idle: threading.Condition
+    _lock: threading.Lock
+
+    def __init__(
+        self,
+        config: AutoriderConfig,
+        context: ScanContext | None,
+        resolver: SonameResolver | None,
+        manifest: Manifest | None,
+        on_output: OUTPUT_CB_T | None,
+        executor: futures.Executor,
+        owns_executor: bool = True,
+    ) -> None:
+        self.config = config
+        self.context = context
+        self.resolver = resolver
+        self.manifest = manifest
+        self.on_output = on_output
+        self.executor = executor
+        self.owns_executor = owns_executor
+        self.failed = threading.Event()
+        self.outputs = []
+        self.errors = []
+        self._jobs = queue.Queue(QUEUE_SIZE)
+        self._inflight = threading.BoundedSemaphore(QUEUE_SIZE)
+        self._pending = set()
+        self._idle = threading.Condition()
+        self._lock = threading.Lock()
+
+    def fail(self, exc: BaseException) -> None:
+        with self._lock:
+            self.errors.append(exc)
+            if self.failed.is_set():
+                return
+            self.failed.set()
+
+        # Stop outstanding work rather than waiting for it to finish
+        if self.owns_executor:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+        else:
+            with self._idle:
+                pending = list(self._pending)
+            for future in pending:
+                _ = future.cancel()
+        if self.context and self.context.fetcher:
+            self.context.fetcher.cancel()
+        if self.resolver:
+            self.resolver.cancel()
+
+    def _prefetch(self, batch: list[_Job]) -> None:
+        context = self.context
+        if not context or not context.fetcher:
+            return
+
+        job_downloads: list[tuple[_Job, list[Download]]] = []
+        for job in batch:
+            downloads: list[Download] = []
+            for artifact in job.pkg_scanner.artifacts(job.depends):
+                download = artifact.download(job.depends, context)
+                if download:
+                    downloads.append(download)
+            job_downloads.append((job, downloads))
+
+        fetcher = context.fetcher
+        fetcher.prefetch(dl for _, downloads in job_downloads for dl in downloads)
+        for job, downloads in job_downloads:
+            for download in downloads:
+                path = fetcher.paths.get(download.key)
+                if path:
+                    job.paths[download.key] = path
+
+    def _complete(self, job: _Job, output: PackageOutput) -> None:
+        pkg_scanner = job.pkg_scanner
+        with self._lock:
+            if self.on_output:
+                self.on_output(pkg_scanner.name, output)
+            else:
+                self.outputs.append((pkg_scanner.name, output))
+        if self.manifest and job.fingerprint:
+            self.manifest.record(pkg_scanner.name, pkg_scanner.version, job.fingerprint, output)
+        if self.resolver:
+            self.resolver.submit(output_sonames(output))
+
+    def _on_done(
+        self,
+        future: futures.Future[tuple[str, PackageOutput] | _WorkerResult],
+        job: _Job,
+    ) -> None:
+        try:
+            self._handle_done(future, job)
+        finally:
+            with self._idle:
+                self._pending.discard(future)
+                self._idle.notify_all()
+
+    def _handle_done(
+        self,
+        future: futures.Future[tuple[str, PackageOutput] | _WorkerResult],
+        job: _Job,
+    ) -> None:
+        self._inflight.release()
+        if future.cancelled():
+            return
+
+        exc = future.exception()
+        if exc:
+            self.fail(exc)
+            return
 
+        result = future.result()
+        if isinstance(result, _WorkerResult):
+            output = result.output
+            stats.get_stats().merge(result.stats)
+            tracer = trace.get_tracer()
+            if tracer:
+                tracer.merge(result.events)
+        else:
+            _, output = result
+        self._complete(job, output)
+
+    def _submit(self, job: _Job) -> None:
+        _ = self._inflight.acquire()
+        if self.failed.is_set():
+            self._inflight.release()
+            return
 
-def process_pkgs(config: AutoriderConfig, generator: GENERATOR_T):
-    ret: dict[str, PackageOutput | list[PackageOutput]] = {}
+        future: futures.Future[tuple[str, PackageOutput] | _WorkerResult]
+        try:
+            if isinstance(self.executor, futures.ProcessPoolExecutor):
+                future = self.executor.submit(
+                    _process_pkg_worker, self.config, job.pkg_scanner, job.paths
+                )
+            else:
+                future = self.executor.submit(process_pkg, self.config, job.pkg_scanner, self.context)
+        except RuntimeError:
+            # Executor was shut down by a concurrent failure
+            self._inflight.release()
+            if self.failed.is_set():
+                return
+            raise
+
+        with self._idle:
+            self._pending.add(future)
+        future.add_done_callback(lambda f: self._on_done(f, job))
+
+    def fetch_worker(self) -> None:
+        batch_size = self.context.fetcher.batch_size if self.context and self.context.fetcher else 1
+        done = False
+        while not done:
+            job = self._jobs.get()
+            if job is None:
+                return
+
+            # Batch up whatever else is already waiting to be fetched
+            batch = [job]
+            while len(batch) < batch_size:
+                try:
+                    job = self._jobs.get_nowait()
+                except queue.Empty:
+                    break
+                if job is None:
+                    done = True
+                    break
+                batch.append(job)
+
+            # Keep draining the queue after a failure so the producer never blocks
+            if self.failed.is_set():
+                continue
 
-    with futures.ThreadPoolExecutor() as executor:
-        scan_futures: list[futures.Future[tuple[PackageScanner, PackageOutput]]] = []
+            try:
+                self._prefetch(batch)
+                for job in batch:
+                    self._submit(job)
+            except Exception as exc:
+                self.fail(exc)
+
+    def run(self, pkg_scanners: Iterable[PackageScanner]) -> None:
+        workers = [threading.Thread(target=self.fetch_worker) for _ in range(FETCH_WORKERS)]
+        for worker in workers:
+            worker.start()
+
+        try:
+            for pkg_scanner in pkg_scanners:
+                if self.failed.is_set():
+                    break
+                postprocessors = get_postprocessors(self.config, pkg_scanner.name)
+                depends = get_scan_depends(postprocessors)
+                job = _Job(pkg_scanner, depends)
+
+                if self.manifest:
+                    job.fingerprint = pkg_fingerprint(
+                        pkg_scanner, postprocessors, depends, self.context
+                    )
+                    output = (
+                        self.manifest.carry_over(
+                            pkg_scanner.name, pkg_scanner.version, job.fingerprint
+                        )
+                        if job.fingerprint
+                        else None
+                    )
+                    if output is not None:
+                        logger.info("package '%s' unchanged, reusing previous output", pkg_scanner.name)
+                        stats.incr("packages-carried")
+                        self._complete(job, output)
+                        continue
+
+                self._jobs.put(job)
+        except BaseException as exc:
+            # Including KeyboardInterrupt
+            self.fail(exc)
+        finally:
+            for _ in workers:
+                self._jobs.put(None)
+            for worker in workers:
+                worker.join()
+
+        if self.owns_executor:
+            self.executor.shutdown()
+        else:
+            # Done callbacks run after futures complete, wait for those instead
+            with self._idle:
+                _ = self._idle.wait_for(lambda: not self._pending)
+
+        if self.errors:
+            raise self.errors[0]
+
+
+def process_pkgs(
+    config: AutoriderConfig,
+    generator: Iterable[PackageScanner],
+    context: ScanContext | None = None,
+    resolver: SonameResolver | None = None,
+    manifest: Manifest | None = None,
+    on_output: OUTPUT_CB_T | None = None,
+    executor: futures.Executor | None = None,
+):
+    """
+    Scan & post-process packages, submitting dependency sonames to resolver as they are found
+
+    Package fingerprints are recorded in manifest, reusing previous outputs of unchanged packages.
+    Outputs are streamed in completion order to on_output when given, instead of being collected.
+    Scans run on executor when given, which is left running for reuse.
+    """
+    def pkg_scanners():
         for pkg_scanner in generator:
             name = pkg_scanner.name
 
             # Include/exclude based on config patterns
-            if not any(fnmatch(name, pat) for pat in config.include):
-                continue
-            if any(fnmatch(name, pat) for pat in config.exclude):
+            if not any(fnmatch(name, pat) for pat in config.include) or any(
+                fnmatch(name, pat) for pat in config.exclude
+            ):
+                stats.incr("packages-filtered")
                 continue
 
-            fut = executor.submit(process_pkg, config, pkg_scanner)
-            scan_futures.append(fut)
+            yield pkg_scanner
 
-        for future in scan_futures:
-            pkg_scanner, output = future.result()
-            ret.setdefault(pkg_scanner.name, []).append(output)  # pyright: ignore[reportAttributeAccessIssue]
-
-    # Collapse structure on non-abmigious packages
-    for name, outputs in ret.items():
-        if isinstance(outputs, list) and len(outputs) == 1:
-            output = outputs[0]
-            try:
-                del output["version"]
-            except KeyError:
-                pass
-            ret[name] = output
+    owns_executor = executor is None
+    with nullcontext(executor) if executor else make_executor(config, context) as executor:
+        pipeline = _Pipeline(
+            config, context, resolver, manifest, on_output, executor, owns_executor
+        )
+        pipeline.run(pkg_scanners())
 
-    return {k: v for k, v in ret.items() if v}
+    return collapse_outputs(pipeline.outputs)
@@ -1,58 +1,198 @@
-from typing import Callable, IO
+from urllib.parse import urlparse
+from collections import deque
+from dataclasses import dataclass
+from typing import Callable, ClassVar, IO
 from pathlib import Path
 from typing import override
-import zipfile
-import tarfile
+import logging
+import io
 import os
 
+from autorider.download import HTTPRangeFile
+
+
+logger = logging.getLogger(__name__)
+
 
 PRED_T = Callable[[str], bool]
 CALLBACK_T = Callable[[str, IO[bytes]], None]
+DONE_T = Callable[[], bool]
+READER_FACTORY_T = Callable[[PRED_T, CALLBACK_T], "Reader"]
+# Called with (name, crc32, size) of matched members before decompressing them
+SKIP_T = Callable[[str, int, int], bool]
+
+
+def _never_done() -> bool:
+    return False
+
+
+def _never_prune(name: str) -> bool:  # pyright: ignore[reportUnusedParameter]
+    return False
+
+
+def _never_skip(name: str, crc: int, size: int) -> bool:  # pyright: ignore[reportUnusedParameter]
+    return False
+
+
+@dataclass
+class ReaderCounts:
+    """Members seen, matched by the predicate & their uncompressed size"""
+
+    enumerated: int = 0
+    matched: int = 0
+    bytes: int = 0
 
 
 class Reader:
+    # Number of leading directories wrapping the source tree in member names
+    ROOT_LEVEL: ClassVar[int] = 1
+
     path: Path
     pred: PRED_T
     callback: CALLBACK_T
+    # Checked after each callback, reading stops early once it returns True
+    done: DONE_T
+    # Skip directories by name
+    prune: PRED_T
+    # Maximum number of directory levels in member names, may be lowered while reading
+    max_depth: int | None
+    # Skip matched members by checksum, for archives with a checksummed index
+    skip: SKIP_T
+
+    counts: ReaderCounts
 
     def __init__(self, path: Path, pred: PRED_T, callback: CALLBACK_T) -> None:
         self.path = path
         self.pred = pred
         self.callback = callback
+        self.done = _never_done
+        self.prune = _never_prune
+        self.max_depth = None
+        self.skip = _never_skip
+        self.counts = ReaderCounts()
+
+    def excluded(self, name: str) -> bool:
+        """Whether member is excluded by depth limit or pruning"""
+        dirs = name.split("/")[:-1]
+        if self.max_depth is not None and len(dirs) > self.max_depth:
+            return True
+        return any(self.prune(dirname) for dirname in dirs)
 
     def run(self) -> None:
         raise NotImplementedError("Not implemented")
 
 
 class ZipReader(Reader):
+    def open(self) -> Path | IO[bytes]:
+        return self.path
+
     @override
     def run(self):
-        with zipfile.ZipFile(self.path) as zip:
-            for name in zip.namelist():
-                if self.pred(name):
-                    with zip.open(name) as fp:
+        import zipfile
+
+        with zipfile.ZipFile(self.open()) as zip:
+            for info in zip.infolist():
+                name = info.filename
+                self.counts.enumerated += 1
+                if not self.excluded(name) and self.pred(name):
+                    self.counts.matched += 1
+                    # The central directory gives checksums without decompressing anything
+                    if self.skip(name, info.CRC, info.file_size):
+                        continue
+                    self.counts.bytes += info.file_size
+                    with zip.open(info) as fp:
                         self.callback(name, fp)
+                    if self.done():
+                        break
+
+
+class RemoteZipReader(ZipReader):
+    """
+    Read zip members over HTTP without fetching the whole archive
+
+    Only the central directory & members matching the predicate are fetched.
+    """
+
+    url: str
+    fp: HTTPRangeFile
+
+    def __init__(self, url: str, size: int, pred: PRED_T, callback: CALLBACK_T) -> None:
+        self.url = url
+        self.fp = HTTPRangeFile(url, size)
+        super().__init__(Path(urlparse(url).path), pred, callback)
+
+    @override
+    def open(self) -> IO[bytes]:
+        # zipfile expects a buffered binary file rather than a raw stream
+        return io.BufferedReader(self.fp)
+
+    @override
+    def run(self):
+        super().run()
+        logger.info(
+            "fetched %d of %d bytes from '%s'",
+            self.fp.bytes_fetched,
+            self.fp.size,
+            self.url,
+        )
 
 
 class TarReader(Reader):
     @override
     def run(self):
-        with tarfile.open(self.path) as tar:
-            for member in tar.getmembers():
-                if self.pred(member.name):
-                    fp = tar.extractfile(member)
-                    if not fp:
-                        raise ValueError(f"Unable to open tar member '{member}'")
-                    with fp:
-                        self.callback(member.name, fp)
+        # Stream members in a single pass, avoiding seeks in compressed streams
+        import tarfile
+
+        with tarfile.open(self.path, "r|*") as tar:
+            for member in tar:
+                if not member.isfile():
+                    continue
+                self.counts.enumerated += 1
+                if self.excluded(member.name) or not self.pred(member.name):
+                    continue
+                self.counts.matched += 1
+                self.counts.bytes += member.size
+
+                fp = tar.extractfile(member)
+                if not fp:
+                    raise ValueError(f"Unable to open tar member '{member}'")
+                with fp:
+                    self.callback(member.name, fp)
+                if self.done():
+                    break
 
 
 class DirReader(Reader):
+    ROOT_LEVEL: ClassVar[int] = 0
+
     @override
     def run(self):
-        for root, _, files in os.walk(self.path):
-            for filename in files:
-                member_path = os.path.join(root, filename)
-                if self.pred(member_path):
-                    with open(member_path, "rb") as fp:
-                        self.callback(member_path, fp)
+        # Breadth first so files closer to the root are read first
+        queue: deque[tuple[str, str, int]] = deque([(str(self.path), "", 0)])
+        while queue:
+            dir_path, prefix, depth = queue.popleft()
+            # The depth limit may shrink while reading, later directories are only deeper
+            if self.max_depth is not None and depth > self.max_depth:
+                break
+
+            with os.scandir(dir_path) as it:
+                entries = sorted(it, key=lambda entry: entry.name)
+
+            for entry in entries:
+                name = prefix + entry.name
+                if entry.is_dir(follow_symlinks=False):
+                    if self.max_depth is not None and depth >= self.max_depth:
+                        continue
+                    if self.prune(entry.name):
+                        continue
+                    queue.append((entry.path, name + "/", depth + 1))
+                elif entry.is_file():
+                    self.counts.enumerated += 1
+                    if not self.pred(name):
+                        continue
+                    self.counts.matched += 1
+                    with open(entry.path, "rb") as fp:
+                        self.counts.bytes += os.fstat(fp.fileno()).st_size
+                        self.callback(name, fp)
+                    if self.done():
+                        return
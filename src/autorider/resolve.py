@@ -0,0 +1,158 @@
+from collections.abc import Iterable
+from concurrent import futures
+import threading
+import hashlib
+import logging
+import json
+
+from autorider.lib import (
+    SO_PROVIDERS,
+    nix_index_database,
+    nix_index_stamp,
+    nix_locate_args,
+    parse_nix_locate,
+)
+from autorider.runner import ToolRunner, get_runner
+from autorider import nixindex, stats, trace
+from autorider.cache import Cache
+
+
+logger = logging.getLogger(__name__)
+
+
+# Bump when lookup behaviour changes to invalidate cached providers
+LOOKUP_VERSION = 3
+
+
+class SonameResolver:
+    """
+    Resolve soname providers incrementally as sonames become known
+
+    Lookups using nix-locate start as soon as a soname is submitted.
+    When the nix-index database can be read directly all lookups are instead
+    deferred to a single pass over the database once results are requested.
+    """
+
+    ignore: list[str]
+    cache: Cache | None
+    providers: dict[str, str]
+
+    _key_prefix: str | None
+    _single_pass: bool
+    _seen: set[str]
+    _deferred: list[str]
+    _lookups: list[tuple[str, futures.Future[bytes]]]
+    _runner: ToolRunner
+    _lock: threading.Lock
+
+    def __init__(
+        self,
+        ignore: list[str],
+        cache: Cache | None = None,
+        runner: ToolRunner | None = None,
+    ) -> None:
+        self.ignore = ignore
+        self.cache = cache
+        self.providers = {}
+
+        # Cached lookups are only valid for the same database & ignore list
+        self._key_prefix = None
+        stamp = nix_index_stamp()
+        if cache and stamp:
+            ignore_hash = hashlib.sha256(json.dumps(ignore).encode()).hexdigest()[:16]
+            self._key_prefix = f"nix-locate/{LOOKUP_VERSION}/{stamp}/{ignore_hash}"
+
+        self._single_pass = nixindex.available() and nix_index_database().exists()
+        self._seen = set()
+        self._deferred = []
+        self._lookups = []
+        self._runner = runner or get_runner()
+        self._lock = threading.Lock()
+
+    def _cached(self, soname: str) -> tuple[bool, str | None]:
+        if not self.cache or not self._key_prefix:
+            return False, None
+        data = self.cache.get(f"{self._key_prefix}/{soname}")
+        if data is None:
+            return False, None
+        # Negative results are cached as null
+        provider: str | None = json.loads(data)  # pyright: ignore[reportAny]
+        return True, provider
+
+    def _store(self, soname: str, provider: str | None) -> None:
+        if provider:
+            self.providers[soname] = provider
+        if self.cache and self._key_prefix:
+            self.cache.put(f"{self._key_prefix}/{soname}", json.dumps(provider).encode())
+
+    def _submit_lookup(self, soname: str) -> None:
+        stats.incr("nix-locate-calls")
+        future = self._runner.submit(nix_locate_args(soname))
+        self._lookups.append((soname, future))
+
+    def submit(self, sonames: Iterable[str]) -> None:
+        with self._lock:
+            for soname in sonames:
+                if soname in self._seen:
+                    continue
+                self._seen.add(soname)
+
+                try:
+                    self.providers[soname] = SO_PROVIDERS[soname]
+                    stats.incr("so-providers-hits")
+                    continue
+                except KeyError:
+                    pass
+
+                hit, provider = self._cached(soname)
+                if hit:
+                    stats.incr("lookup-cache-hits")
+                    if provider:
+                        self.providers[soname] = provider
+                elif self._single_pass:
+                    self._deferred.append(soname)
+                else:
+                    self._submit_lookup(soname)
+
+    def result(self) -> dict[str, str]:
+        """Wait for all outstanding lookups & return providers"""
+        with self._lock:
+            if self._deferred:
+                # Resolve all deferred sonames in a single pass over the database
+                try:
+                    with trace.span("nixindex.locate_files", "lookup", sonames=len(self._deferred)):
+                        located = nixindex.locate_files(
+                            nix_index_database(), self._deferred, self.ignore
+                        )
+                except nixindex.DatabaseError as exc:
+                    logger.warning("falling back to nix-locate: %s", exc)
+                    self._single_pass = False
+                    for soname in self._deferred:
+                        self._submit_lookup(soname)
+                else:
+                    stats.incr("nix-index-lookups", len(self._deferred))
+                    for soname in self._deferred:
+                        self._store(soname, located.get(soname))
+                self._deferred = []
+
+            try:
+                for soname, future in self._lookups:
+                    self._store(soname, parse_nix_locate(future.result(), self.ignore))
+            except BaseException:
+                # Don't wait for the remaining lookups of a failed run
+                self._cancel()
+                raise
+            finally:
+                self._lookups = []
+
+        return self.providers
+
+    def _cancel(self) -> None:
+        for _, future in self._lookups:
+            _ = future.cancel()
+
+    def cancel(self) -> None:
+        """Cancel outstanding lookups"""
+        with self._lock:
+            self._cancel()
+            self._lookups = []
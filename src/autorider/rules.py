@@ -0,0 +1,109 @@
+from __future__ import annotations
+from collections.abc import Iterable, Set
+from dataclasses import dataclass, field
+import hashlib
+import json
+
+
+@dataclass(frozen=True)
+class Rule:
+    """
+    Infer native build requirements from the presence of a source tree file
+    """
+
+    # Exact basename (CMakeLists.txt), or a suffix glob (*.pyx, *.tar.gz)
+    match: str
+    # Nixpkgs attributes required to build sources containing a match
+    requires: tuple[str, ...]
+    # Directories below the source root a match may be nested in, unlimited if None
+    max_depth: int | None = None
+
+    def __post_init__(self) -> None:
+        if self.match.startswith("*") and not self.match.startswith("*."):
+            raise ValueError(f"Rule pattern '{self.match}' must be a basename or '*.suffix'")
+        if not self.requires:
+            raise ValueError(f"Rule '{self.match}' requires nothing")
+
+
+DEFAULT_RULES: tuple[Rule, ...] = (
+    Rule("CMakeLists.txt", ("cmake",)),
+    Rule("meson.build", ("meson", "ninja")),
+    Rule("Cargo.toml", ("cargo", "rustc")),
+    Rule("configure.ac", ("autoconf", "automake", "libtool")),
+    Rule("SConstruct", ("scons",)),
+    Rule("go.mod", ("go",)),
+    Rule("*.pyx", ("cython",)),
+    Rule("*.f90", ("gfortran",)),
+)
+
+
+@dataclass(frozen=True)
+class RuleIndex:
+    """
+    Rules compiled for matching archive members with a single dict lookup
+    """
+
+    rules: tuple[Rule, ...] = ()
+    by_basename: dict[str, tuple[Rule, ...]] = field(default_factory=dict)
+    by_suffix: dict[str, tuple[Rule, ...]] = field(default_factory=dict)
+    # Union of everything rules can require, scanning can stop once all are found
+    requires: frozenset[str] = frozenset()
+    # Deepest directory level any rule matches at, unlimited if None
+    max_depth: int | None = None
+    # Identity of the rule set, for invalidating cached scan results
+    digest: str = ""
+
+    @classmethod
+    def compile(cls, rules: Iterable[Rule]) -> RuleIndex:
+        rules = list(rules)
+
+        by_basename: dict[str, list[Rule]] = {}
+        by_suffix: dict[str, list[Rule]] = {}
+        for rule in rules:
+            if rule.match.startswith("*."):
+                by_suffix.setdefault(rule.match[1:], []).append(rule)
+            else:
+                by_basename.setdefault(rule.match, []).append(rule)
+
+        max_depth = _max_depth(rules)
+        data = json.dumps(
+            sorted(([rule.match, sorted(rule.requires), rule.max_depth] for rule in rules), key=json.dumps)
+        )
+
+        return cls(
+            rules=tuple(rules),
+            by_basename={basename: tuple(matching) for basename, matching in by_basename.items()},
+            by_suffix={suffix: tuple(matching) for suffix, matching in by_suffix.items()},
+            requires=frozenset(req for rule in rules for req in rule.requires),
+            max_depth=max_depth,
+            digest=hashlib.sha256(data.encode()).hexdigest()[:16],
+        )
+
+    def match(self, basename: str, depth: int) -> tuple[Rule, ...]:
+        """Rules matching a member basename at a directory depth below the source root"""
+        rules = self.by_basename.get(basename, ())
+        if self.by_suffix:
+            # Every dotted suffix, so both *.tar.gz & *.gz match foo.tar.gz
+            dot = basename.find(".")
+            while dot != -1:
+                rules += self.by_suffix.get(basename[dot:], ())
+                dot = basename.find(".", dot + 1)
+        return tuple(rule for rule in rules if rule.max_depth is None or depth <= rule.max_depth)
+
+    def remaining_max_depth(self, found: Set[str]) -> int | None:
+        """Deepest directory level of rules still adding to found requirements, unlimited if None"""
+        return _max_depth(
+            rule for rule in self.rules if not all(req in found for req in rule.requires)
+        )
+
+
+def _max_depth(rules: Iterable[Rule]) -> int | None:
+    depth = 0
+    for rule in rules:
+        if rule.max_depth is None:
+            return None
+        depth = max(depth, rule.max_depth)
+    return depth
+
+
+DEFAULT_INDEX = RuleIndex.compile(DEFAULT_RULES)
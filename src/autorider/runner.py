@@ -0,0 +1,176 @@
+from __future__ import annotations
+from concurrent import futures
+from typing import TYPE_CHECKING
+import subprocess
+import threading
+import posixpath
+import logging
+
+from autorider import trace
+
+# asyncio is slow to import, loaded once a tool actually runs
+if TYPE_CHECKING:
+    import asyncio
+
+
+logger = logging.getLogger(__name__)
+
+
+# Concurrent invocations per tool unless configured otherwise
+DEFAULT_LIMITS: dict[str, int] = {
+    "nix-instantiate": 4,
+    "nix-locate": 8,
+}
+
+# Concurrent invocations of tools without a configured limit
+DEFAULT_LIMIT = 4
+
+
+class ToolRunner:
+    """
+    Run external tools on an asyncio event loop with per-tool concurrency limits
+
+    The loop runs in a background thread so blocking callers can submit work
+    from any thread. Cancelling a submission kills its process.
+    """
+
+    limits: dict[str, int]
+    timeout: float | None
+
+    _loop: asyncio.AbstractEventLoop | None
+    _thread: threading.Thread | None
+    _semaphores: dict[str, asyncio.Semaphore]
+    _pending: set[futures.Future[bytes]]
+    _lock: threading.Lock
+
+    def __init__(self, limits: dict[str, int] | None = None, timeout: float | None = None) -> None:
+        self.limits = DEFAULT_LIMITS | (limits or {})
+        self.timeout = timeout
+        self._loop = None
+        self._thread = None
+        self._semaphores = {}
+        self._pending = set()
+        self._lock = threading.Lock()
+
+    def _get_loop(self) -> asyncio.AbstractEventLoop:
+        import asyncio
+
+        with self._lock:
+            if self._loop is None:
+                loop = asyncio.new_event_loop()
+                self._thread = threading.Thread(target=loop.run_forever, daemon=True)
+                self._thread.start()
+                self._loop = loop
+            return self._loop
+
+    def _semaphore(self, tool: str) -> asyncio.Semaphore:
+        # Only ever called from the loop thread
+        import asyncio
+
+        try:
+            return self._semaphores[tool]
+        except KeyError:
+            sem = self._semaphores[tool] = asyncio.Semaphore(self.limits.get(tool, DEFAULT_LIMIT))
+            return sem
+
+    async def _run(self, args: list[str], timeout: float | None) -> bytes:
+        tool = posixpath.basename(args[0])
+        with trace.async_span(tool, "tool", arg=args[-1][:200]):
+            return await self._run_limited(tool, args, timeout)
+
+    async def _run_limited(self, tool: str, args: list[str], timeout: float | None) -> bytes:
+        import asyncio
+
+        async with self._semaphore(tool):
+            logger.debug("running %s", args)
+            proc = await asyncio.create_subprocess_exec(*args, stdout=subprocess.PIPE)
+            try:
+                stdout, _ = await asyncio.wait_for(proc.communicate(), timeout)
+            except BaseException as exc:
+                # Timed out or cancelled, don't leave the process running
+                if proc.returncode is None:
+                    proc.kill()
+                    _ = await asyncio.shield(proc.wait())
+                if isinstance(exc, TimeoutError):
+                    raise subprocess.TimeoutExpired(args, timeout or 0) from None
+                raise
+
+        if proc.returncode:
+            raise subprocess.CalledProcessError(proc.returncode, args, stdout)
+        return stdout
+
+    def submit(self, args: list[str], timeout: float | None = None) -> futures.Future[bytes]:
+        """Run a tool, returning a future of its stdout"""
+        import asyncio
+
+        coro = self._run(args, timeout if timeout is not None else self.timeout)
+        future = asyncio.run_coroutine_threadsafe(coro, self._get_loop())
+        with self._lock:
+            self._pending.add(future)
+        future.add_done_callback(self._discard)
+        return future
+
+    def _discard(self, future: futures.Future[bytes]) -> None:
+        with self._lock:
+            self._pending.discard(future)
+
+    def run(self, args: list[str], timeout: float | None = None) -> bytes:
+        """Run a tool & wait for its stdout"""
+        future = self.submit(args, timeout)
+        try:
+            return future.result()
+        except BaseException:
+            _ = future.cancel()
+            raise
+
+    def cancel(self) -> None:
+        """Cancel all outstanding invocations"""
+        with self._lock:
+            pending = list(self._pending)
+        for future in pending:
+            _ = future.cancel()
+
+    async def _drain(self) -> None:
+        import asyncio
+
+        tasks = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+        for task in tasks:
+            _ = task.cancel()
+        _ = await asyncio.gather(*tasks, return_exceptions=True)
+
+    def close(self) -> None:
+        """Cancel outstanding invocations, waiting for their processes to be killed"""
+        self.cancel()
+        with self._lock:
+            loop, thread = self._loop, self._thread
+            self._loop = None
+            self._thread = None
+        if loop and thread:
+            import asyncio
+
+            asyncio.run_coroutine_threadsafe(self._drain(), loop).result()
+            _ = loop.call_soon_threadsafe(loop.stop)
+            thread.join()
+            loop.close()
+
+
+_runner: ToolRunner | None = None
+_runner_lock = threading.Lock()
+
+
+def get_runner() -> ToolRunner:
+    global _runner
+    with _runner_lock:
+        if _runner is None:
+            _runner = ToolRunner()
+        return _runner
+
+
+def configure_runner(limits: dict[str, int] | None = None, timeout: float | None = None) -> ToolRunner:
+    """Replace the process wide runner"""
+    global _runner
+    with _runner_lock:
+        if _runner is not None:
+            _runner.close()
+        _runner = ToolRunner(limits, timeout)
+        return _runner
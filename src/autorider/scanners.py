@@ -1,24 +1,116 @@
 from __future__ import annotations
-from dataclasses import dataclass
-from typing import override, IO
+from collections.abc import Callable
+from concurrent import futures
+from dataclasses import dataclass, field
+from typing import override, ClassVar, IO
+from functools import partial
+from collections import OrderedDict
 from pathlib import Path
+from enum import Flag
+import threading
+import logging
 import os.path
+import json
 
-from elftools.elf.elffile import ELFFile
-from elftools.elf.dynamic import DynamicSection
-
+from autorider.elf import DynamicInfo, ELFError, read_dynamic, read_dynamic_elftools
 from autorider.pep517 import FALLBACK_SYSTEMS, read_build_systems
-from autorider.readers import Reader, ZipReader, TarReader, DirReader
+from autorider.readers import (
+    READER_FACTORY_T,
+    Reader,
+    RemoteZipReader,
+    ZipReader,
+    TarReader,
+    DirReader,
+)
+from autorider.download import Download, Fetcher, HTTPDownload, HTTPRangeError
+from autorider.cache import Cache
+from autorider.rules import DEFAULT_INDEX, RuleIndex
+from autorider import stats, trace
+
+
+logger = logging.getLogger(__name__)
+
+
+class ScanDepends(Flag):
+    NONE = 0
+    # PEP-517 build-system from top-level pyproject.toml
+    SDIST_BUILD_SYSTEMS = 1
+    # Native build tooling inferred from source tree files
+    SDIST_BUILD_REQUIRES = 2
+    # Shared object dependencies from manylinux wheel
+    WHEEL = 4
+
+    SDIST = SDIST_BUILD_SYSTEMS | SDIST_BUILD_REQUIRES
+    ALL = SDIST | WHEEL
+
+
+@dataclass
+class SdistResult:
+    build_systems: list[str]
+    build_requires: set[str]
+
+    def to_json(self) -> bytes:
+        return json.dumps(
+            {
+                "build_systems": self.build_systems,
+                "build_requires": sorted(self.build_requires),
+            }
+        ).encode()
+
+    @classmethod
+    def from_json(cls, data: bytes) -> SdistResult:
+        obj = json.loads(data)  # pyright: ignore[reportAny]
+        return cls(obj["build_systems"], set(obj["build_requires"]))  # pyright: ignore[reportAny]
+
+
+@dataclass
+class WheelResult:
+    native_depends: set[str]
+    native_provides: set[str]
+
+    def to_json(self) -> bytes:
+        return json.dumps(
+            {
+                "native_depends": sorted(self.native_depends),
+                "native_provides": sorted(self.native_provides),
+            }
+        ).encode()
+
+    @classmethod
+    def from_json(cls, data: bytes) -> WheelResult:
+        obj = json.loads(data)  # pyright: ignore[reportAny]
+        return cls(set(obj["native_depends"]), set(obj["native_provides"]))  # pyright: ignore[reportAny]
 
 
 class Scanner:
+    # Bump when scanning behaviour changes to invalidate cached results
+    VERSION: ClassVar[int]
+    # Scan dependencies served by this scanner
+    DEPENDS: ClassVar[ScanDepends]
+
     reader: Reader
     name: str
+    depends: ScanDepends
 
-    def __init__(self, path: Path) -> None:
+    def __init__(
+        self,
+        path: Path,
+        depends: ScanDepends = ScanDepends.ALL,
+        reader_factory: READER_FACTORY_T | None = None,
+    ) -> None:
         self.name = path.name
+        self.depends = depends & self.DEPENDS
 
-        # Instantiate reader
+        if reader_factory:
+            self.reader = reader_factory(self.reader_pred, self.reader_cb)
+        else:
+            self.reader = self._make_reader(path)
+        self.reader.done = self.reader_done
+        self.reader.prune = self.reader_prune
+        self.reader.skip = self.reader_skip
+        self.reader.max_depth = self.reader_max_depth()
+
+    def _make_reader(self, path: Path) -> Reader:
         name = path.name
         if name.endswith(".zip") or name.endswith(".whl"):
             cls = ZipReader
@@ -28,7 +120,7 @@ class Scanner:
             cls = DirReader
         else:
             raise ValueError(f"Could not instantiate reader for '{path}'")
-        self.reader = cls(path, self.reader_pred, self.reader_cb)
+        return cls(path, self.reader_pred, self.reader_cb)
 
     def reader_pred(self, name: str) -> bool:  # pyright: ignore[reportUnusedParameter]
         raise NotImplementedError()
@@ -36,74 +128,564 @@ class Scanner:
     def reader_cb(self, name: str, fp: IO[bytes]) -> None:  # pyright: ignore[reportUnusedParameter]
         raise NotImplementedError()
 
+    def reader_done(self) -> bool:
+        """Whether the scan is complete and reading may stop early"""
+        return False
+
+    def reader_prune(self, name: str) -> bool:  # pyright: ignore[reportUnusedParameter]
+        """Whether directories with name should be skipped"""
+        return False
+
+    def reader_max_depth(self) -> int | None:
+        """Maximum directory depth of members of interest"""
+        return None
+
+    def reader_skip(self, name: str, crc: int, size: int) -> bool:  # pyright: ignore[reportUnusedParameter]
+        """Whether a matched member can be skipped based on its checksum"""
+        return False
+
     def run(self):
-        self.reader.run()
+        reader = self.reader
+        with trace.span(f"{type(reader).__name__}.run", "read", artifact=self.name):
+            reader.run()
+
+        stats.incr("members-enumerated", reader.counts.enumerated)
+        stats.incr("members-matched", reader.counts.matched)
+        stats.incr("member-bytes", reader.counts.bytes)
+        if isinstance(reader, RemoteZipReader):
+            stats.incr("artifact-bytes", reader.fp.bytes_fetched)
+        elif reader.path.is_file():
+            stats.incr("artifact-bytes", reader.path.stat().st_size)
+
+    def result(self) -> SdistResult | WheelResult:
+        raise NotImplementedError()
+
+    @classmethod
+    def result_from_json(cls, data: bytes) -> SdistResult | WheelResult:  # pyright: ignore[reportUnusedParameter]
+        """Load a cached result"""
+        raise NotImplementedError()
 
 
 class SdistScanner(Scanner):
+    VERSION: ClassVar[int] = 3
+    DEPENDS: ClassVar[ScanDepends] = ScanDepends.SDIST
+
+    # Directories never containing build inputs, common in source checkouts
+    PRUNE_DIRS: ClassVar[set[str]] = set(
+        (
+            ".git",
+            ".hg",
+            ".svn",
+            ".direnv",
+            ".mypy_cache",
+            ".nox",
+            ".pytest_cache",
+            ".ruff_cache",
+            ".tox",
+            ".venv",
+            "__pycache__",
+            "node_modules",
+        )
+    )
+
     build_systems: list[str]
     build_requires: set[str]
+    rules: RuleIndex
 
-    def __init__(self, path: Path) -> None:
+    _found_pyproject: bool
+
+    def __init__(
+        self,
+        path: Path,
+        depends: ScanDepends = ScanDepends.ALL,
+        reader_factory: READER_FACTORY_T | None = None,
+        rules: RuleIndex = DEFAULT_INDEX,
+    ) -> None:
         self.build_systems = FALLBACK_SYSTEMS
         self.build_requires = set()
-        super().__init__(path)
+        self.rules = rules
+        self._found_pyproject = False
+        super().__init__(path, depends, reader_factory)
+
+    def _depth(self, name: str) -> int:
+        return name.count("/") - self.reader.ROOT_LEVEL
 
     @override
     def reader_pred(self, name: str) -> bool:
         basename = os.path.basename(name)
 
-        levels = name.count("/")
-        if levels == 1 and basename == "pyproject.toml":
+        if (
+            self.depends & ScanDepends.SDIST_BUILD_SYSTEMS
+            and basename == "pyproject.toml"
+            and self._depth(name) == 0
+        ):
             return True
 
-        if basename == "CMakeLists.txt":
-            return True
+        if self.depends & ScanDepends.SDIST_BUILD_REQUIRES:
+            # Members only adding already found requirements needn't be read
+            return any(
+                not self.build_requires.issuperset(rule.requires)
+                for rule in self.rules.match(basename, self._depth(name))
+            )
 
         return False
 
     @override
     def reader_cb(self, name: str, fp: IO[bytes]) -> None:
         basename = os.path.basename(name)
+        depth = self._depth(name)
 
-        if basename == "pyproject.toml":
+        if basename == "pyproject.toml" and depth == 0:
             self.build_systems = read_build_systems(fp)
-        elif basename == "CMakeLists.txt":
-            self.build_requires.add("cmake")
+            self._found_pyproject = True
+
+        if self.depends & ScanDepends.SDIST_BUILD_REQUIRES:
+            rules = self.rules.match(basename, depth)
+            for rule in rules:
+                self.build_requires.update(rule.requires)
+            # Rules already satisfied no longer need deeper members, reading stops
+            # early once the remaining rules' depth is exceeded
+            if rules:
+                self.reader.max_depth = self.reader_max_depth()
+
+    @override
+    def reader_prune(self, name: str) -> bool:
+        return name in self.PRUNE_DIRS or name.endswith(".egg-info")
+
+    @override
+    def reader_max_depth(self) -> int | None:
+        # Only the top-level pyproject.toml is of interest
+        if not self.depends & ScanDepends.SDIST_BUILD_REQUIRES:
+            return self.reader.ROOT_LEVEL
+        max_depth = self.rules.remaining_max_depth(self.build_requires)
+        if max_depth is None:
+            return None
+        return self.reader.ROOT_LEVEL + max_depth
+
+    @override
+    def reader_done(self) -> bool:
+        if self.depends & ScanDepends.SDIST_BUILD_SYSTEMS and not self._found_pyproject:
+            return False
+        if (
+            self.depends & ScanDepends.SDIST_BUILD_REQUIRES
+            and not self.build_requires.issuperset(self.rules.requires)
+        ):
+            return False
+        return True
+
+    @classmethod
+    @override
+    def result_from_json(cls, data: bytes) -> SdistResult:
+        return SdistResult.from_json(data)
+
+    @override
+    def result(self) -> SdistResult:
+        return SdistResult(self.build_systems, self.build_requires)
+
+
+MEMO_KEY_T = tuple[int, int, str]
+
+
+class ElfMemo:
+    """
+    Parsed dynamic sections keyed by (crc32, size, basename) of zip members
+
+    Wheels often vendor identical libraries, which can then be skipped without
+    decompressing them. Entries are optionally persisted to a cache.
+    """
+
+    # Bump when parsing changes to invalidate persisted entries
+    VERSION: ClassVar[int] = 1
+
+    max_entries: int
+
+    _entries: OrderedDict[MEMO_KEY_T, DynamicInfo]
+    _lock: threading.Lock
+
+    def __init__(self, max_entries: int = 8192) -> None:
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _cache_key(self, key: MEMO_KEY_T) -> str:
+        crc, size, name = key
+        return f"elf/{self.VERSION}/{crc:08x}-{size}-{name}"
+
+    def get(self, key: MEMO_KEY_T, cache: Cache | None = None) -> DynamicInfo | None:
+        with self._lock:
+            try:
+                self._entries.move_to_end(key)
+                return self._entries[key]
+            except KeyError:
+                pass
+
+        if cache:
+            data = cache.get(self._cache_key(key))
+            if data is not None:
+                obj = json.loads(data)  # pyright: ignore[reportAny]
+                info = DynamicInfo(obj["needed"], obj["soname"], obj["runpath"])  # pyright: ignore[reportAny]
+                self.put(key, info)
+                return info
+
+        return None
+
+    def put(self, key: MEMO_KEY_T, info: DynamicInfo) -> None:
+        with self._lock:
+            self._entries[key] = info
+            while len(self._entries) > self.max_entries:
+                _ = self._entries.popitem(last=False)
+
+    def persist(self, entries: dict[MEMO_KEY_T, DynamicInfo], cache: Cache) -> None:
+        """Write entries parsed from one artifact to cache in a single transaction"""
+        cache.put_many(
+            (
+                self._cache_key(key),
+                json.dumps({"needed": info.needed, "soname": info.soname, "runpath": info.runpath}).encode(),
+            )
+            for key, info in entries.items()
+        )
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+# Shared by all wheel scans in a process
+ELF_MEMO = ElfMemo()
 
 
 class WheelScanner(Scanner):
+    VERSION: ClassVar[int] = 2
+    DEPENDS: ClassVar[ScanDepends] = ScanDepends.WHEEL
+
     native_depends: set[str]
     native_provides: set[str]
+    memo: ElfMemo | None
+    cache: Cache | None
+
+    _memo_keys: dict[str, MEMO_KEY_T]
+    # Parsed this scan, persisted once reading finishes
+    _parsed: dict[MEMO_KEY_T, DynamicInfo]
 
-    def __init__(self, path: Path) -> None:
+    def __init__(
+        self,
+        path: Path,
+        depends: ScanDepends = ScanDepends.ALL,
+        reader_factory: READER_FACTORY_T | None = None,
+        memo: ElfMemo | None = ELF_MEMO,
+        cache: Cache | None = None,
+    ) -> None:
         self.native_depends = set()
         self.native_provides = set()
-        super().__init__(path)
+        self.memo = memo
+        self.cache = cache
+        self._memo_keys = {}
+        self._parsed = {}
+        super().__init__(path, depends, reader_factory)
+
+    def _add(self, name: str, info: DynamicInfo) -> None:
+        self.native_provides.add(os.path.basename(name))
+        self.native_depends.update(info.needed)
+        if info.soname:
+            self.native_provides.add(info.soname)
 
     @override
     def reader_pred(self, name: str) -> bool:
         return name.endswith(".so") or ".so." in name
 
+    @override
+    def reader_skip(self, name: str, crc: int, size: int) -> bool:
+        if not self.memo:
+            return False
+
+        key = (crc, size, os.path.basename(name))
+        info = self.memo.get(key, self.cache)
+        if info is None:
+            self._memo_keys[name] = key
+            return False
+
+        stats.incr("elf-memo-hits")
+        self._add(name, info)
+        return True
+
     @override
     def reader_cb(self, name: str, fp: IO[bytes]) -> None:
-        self.native_provides.add(os.path.basename(name))
+        with trace.span("parse ELF", "elf", artifact=self.name, member=name):
+            stats.incr("elf-parsed")
+            try:
+                info = read_dynamic(fp)
+            except ELFError:
+                stats.incr("elf-fallbacks")
+                _ = fp.seek(0)
+                info = read_dynamic_elftools(fp)
+
+        self._add(name, info)
+
+        key = self._memo_keys.pop(name, None)
+        if self.memo and key:
+            self.memo.put(key, info)
+            self._parsed[key] = info
+
+    @override
+    def run(self):
+        super().run()
+        if self.memo and self.cache and self._parsed:
+            self.memo.persist(self._parsed, self.cache)
+
+    @classmethod
+    @override
+    def result_from_json(cls, data: bytes) -> WheelResult:
+        return WheelResult.from_json(data)
+
+    @override
+    def result(self) -> WheelResult:
+        return WheelResult(self.native_depends, self.native_provides)
+
+
+SCAN_RESULT_T = SdistResult | WheelResult
+
+
+class ScanMemo:
+    """
+    Results of artifacts scanned by this process, keyed by artifact identity
+
+    Concurrent scans of the same artifact are coalesced into one, with later
+    requesters waiting on the first. Also shared between the workspaces of a
+    batch run, which mostly lock the same artifacts.
+    """
+
+    _results: dict[str, SCAN_RESULT_T]
+    _inflight: dict[str, futures.Future[SCAN_RESULT_T]]
+    _lock: threading.Lock
+
+    def __init__(self) -> None:
+        self._results = {}
+        self._inflight = {}
+        self._lock = threading.Lock()
+
+    @override
+    def __getstate__(self) -> dict[str, object]:
+        # Worker processes start out empty
+        return {}
+
+    def __setstate__(self, state: dict[str, object]) -> None:
+        self._results = {}
+        self._inflight = {}
+        self._lock = threading.Lock()
+
+    def __contains__(self, key: str) -> bool:
+        with self._lock:
+            return key in self._results
+
+    def scan(self, key: str, fn: Callable[[], SCAN_RESULT_T]) -> SCAN_RESULT_T:
+        """Result of key, calling fn unless it's already known or in flight"""
+        with self._lock:
+            try:
+                result = self._results[key]
+            except KeyError:
+                pass
+            else:
+                stats.incr("scan-memo-hits")
+                return result
+
+            inflight = self._inflight.get(key)
+            owner = inflight is None
+            if inflight is None:
+                inflight = self._inflight[key] = futures.Future()
+
+        if not owner:
+            stats.incr("scan-memo-hits")
+            return inflight.result()
+
+        try:
+            result = fn()
+        except BaseException as exc:
+            with self._lock:
+                del self._inflight[key]
+            inflight.set_exception(exc)
+            raise
 
-        elf = ELFFile(fp)
-        for section in elf.iter_sections():  # pyright: ignore[reportUnknownMemberType]
-            if not isinstance(section, DynamicSection):
-                continue
-            for tag in section.iter_tags():  # pyright: ignore[reportUnknownMemberType]
-                if tag.entry.d_tag == "DT_NEEDED":  # pyright: ignore[reportUnknownMemberType]
-                    needed: str = tag.needed  # pyright: ignore[reportUnknownMemberType,reportAttributeAccessIssue,reportUnknownVariableType]
-                    self.native_depends.add(needed)  # pyright: ignore[reportUnknownArgumentType]
+        with self._lock:
+            self._results[key] = result
+            del self._inflight[key]
+        inflight.set_result(result)
+        return result
+
+
+@dataclass
+class ScanContext:
+    cache: Cache | None = None
+    fetcher: Fetcher | None = None
+    # Read remote wheels using HTTP range requests rather than fetching them
+    range_requests: bool = False
+    # Build requirement rules for sdist scans
+    rules: RuleIndex = DEFAULT_INDEX
+    # Results scanned earlier in this process, also used without a cache
+    memo: ScanMemo | None = field(default_factory=ScanMemo)
+
+
+@dataclass(frozen=True)
+class Artifact:
+    scanner: type[SdistScanner] | type[WheelScanner]
+    # Content address (such as a lock file hash) used for caching
+    key: str | None
+    source: Download | Path
+
+    def _scan_key(self, depends: ScanDepends, context: ScanContext | None, identity: str) -> str:
+        depends = depends & self.scanner.DEPENDS
+        key = f"scan/{self.scanner.__name__}/{self.scanner.VERSION}/{depends.value}"
+        if depends & ScanDepends.SDIST_BUILD_REQUIRES:
+            # Results depend on the configured rules
+            key += f"/{(context.rules if context else DEFAULT_INDEX).digest}"
+        return f"{key}/{identity}"
+
+    def cache_key(self, depends: ScanDepends, context: ScanContext | None = None) -> str | None:
+        if not self.key:
+            return None
+        return self._scan_key(depends, context, self.key)
+
+    def memo_key(self, depends: ScanDepends, context: ScanContext | None = None) -> str:
+        """Identity of a scan within this process, also for artifacts without a content address"""
+        if self.key:
+            return self._scan_key(depends, context, self.key)
+        if isinstance(self.source, Download):
+            return self._scan_key(depends, context, self.source.key)
+        return self._scan_key(depends, context, f"path:{self.source.resolve()}")
+
+    def remote_reader(self, context: ScanContext) -> READER_FACTORY_T | None:
+        """Reader factory for scanning without fetching, if supported"""
+        if (
+            context.range_requests
+            and self.scanner is WheelScanner
+            and isinstance(self.source, HTTPDownload)
+            and self.source.size
+        ):
+            return partial(RemoteZipReader, self.source.url, self.source.size)
+        return None
+
+    def download(self, depends: ScanDepends, context: ScanContext) -> Download | None:
+        """Download required to scan artifact, if any"""
+        if not isinstance(self.source, Download) or self.remote_reader(context):
+            return None
+
+        if context.memo and self.memo_key(depends, context) in context.memo:
+            return None
+        cache_key = self.cache_key(depends, context)
+        if context.cache and cache_key and context.cache.get(cache_key) is not None:
+            return None
+
+        return self.source
+
+
+def _make_scanner(
+    artifact: Artifact,
+    path: Path,
+    depends: ScanDepends,
+    context: ScanContext,
+    reader_factory: READER_FACTORY_T | None = None,
+) -> Scanner:
+    if artifact.scanner is WheelScanner:
+        # Parsed libraries are memoised across artifacts & persisted alongside scan results
+        return WheelScanner(path, depends, reader_factory, cache=context.cache)
+    return SdistScanner(path, depends, reader_factory, rules=context.rules)
+
+
+def scan_artifact(
+    artifact: Artifact,
+    depends: ScanDepends = ScanDepends.ALL,
+    context: ScanContext | None = None,
+) -> SdistResult | WheelResult:
+    """Scan an artifact, skipping both fetch & scan if the result is cached"""
+    if context is None:
+        context = ScanContext()
+
+    source = artifact.source
+    with trace.span(
+        f"scan {artifact.scanner.__name__}",
+        "scan",
+        artifact=source.key if isinstance(source, Download) else str(source),
+        size=source.size if isinstance(source, HTTPDownload) else None,
+    ):
+        return _scan_artifact(artifact, depends, context)
+
+
+def _scan_artifact(
+    artifact: Artifact,
+    depends: ScanDepends,
+    context: ScanContext,
+) -> SdistResult | WheelResult:
+    scan = partial(_scan_cached, artifact, depends, context)
+    if context.memo:
+        # Identical artifacts locked by several packages are only scanned once
+        return context.memo.scan(artifact.memo_key(depends, context), scan)
+    return scan()
+
+
+def _scan_cached(
+    artifact: Artifact,
+    depends: ScanDepends,
+    context: ScanContext,
+) -> SdistResult | WheelResult:
+    cache = context.cache
+    cache_key = artifact.cache_key(depends, context)
+
+    if cache and cache_key:
+        data = cache.get(cache_key)
+        if data is not None:
+            stats.incr("scan-cache-hits")
+            return artifact.scanner.result_from_json(data)
+        stats.incr("scan-cache-misses")
+
+    scanner: Scanner | None = None
+    remote_reader = artifact.remote_reader(context)
+    if remote_reader and isinstance(artifact.source, HTTPDownload):
+        scanner = _make_scanner(artifact, Path(artifact.source.name), depends, context, remote_reader)
+        try:
+            scanner.run()
+        except (HTTPRangeError, OSError) as exc:
+            logger.warning("range requests failed, fetching '%s': %s", artifact.source.url, exc)
+            scanner = None
+
+    if scanner is None:
+        if isinstance(artifact.source, Path):
+            path = artifact.source
+        elif context.fetcher:
+            path = context.fetcher.get(artifact.source)
+        else:
+            path = artifact.source.get()
+
+        scanner = _make_scanner(artifact, path, depends, context)
+        scanner.run()
+
+    result = scanner.result()
+
+    if cache and cache_key:
+        cache.put(cache_key, result.to_json())
+
+    return result
 
 
 @dataclass
 class ScanResult:
     name: str  # Artifact filename
-    sdist: None | SdistScanner = None
-    wheel: None | WheelScanner = None
+    sdist: None | SdistResult = None
+    wheel: None | WheelResult = None
+
+
+def scan_artifacts(
+    name: str,
+    artifacts: list[Artifact],
+    depends: ScanDepends = ScanDepends.ALL,
+    context: ScanContext | None = None,
+) -> ScanResult:
+    scan_result = ScanResult(name)
+    for artifact in artifacts:
+        result = scan_artifact(artifact, depends, context)
+        if isinstance(result, SdistResult):
+            scan_result.sdist = result
+        else:
+            scan_result.wheel = result
+    return scan_result
 
 
 class PackageScanner:
@@ -114,5 +696,12 @@ class PackageScanner:
         self.name = name
         self.version = version
 
-    def scan(self) -> ScanResult:
+    def artifacts(self, depends: ScanDepends = ScanDepends.ALL) -> list[Artifact]:  # pyright: ignore[reportUnusedParameter]
         raise NotImplementedError()
+
+    def scan(
+        self,
+        depends: ScanDepends = ScanDepends.ALL,
+        context: ScanContext | None = None,
+    ) -> ScanResult:
+        return scan_artifacts(self.name, self.artifacts(depends), depends, context)
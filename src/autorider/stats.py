@@ -0,0 +1,113 @@
+from __future__ import annotations
+from collections import Counter
+from dataclasses import dataclass, field
+import threading
+import heapq
+
+
+# Counters reported by the summary, in display order
+COUNTERS: dict[str, str] = {
+    "packages-scanned": "packages scanned",
+    "packages-carried": "packages reused from previous output",
+    "packages-filtered": "packages skipped by include/exclude",
+    "artifacts-fetched": "artifacts fetched",
+    "artifacts-in-store": "artifacts already in the nix store",
+    "artifact-bytes": "artifact bytes read",
+    "scan-memo-hits": "artifacts already scanned this run",
+    "scan-cache-hits": "scan cache hits",
+    "scan-cache-misses": "scan cache misses",
+    "members-enumerated": "archive members enumerated",
+    "members-matched": "archive members matched",
+    "member-bytes": "archive member bytes read",
+    "elf-parsed": "ELF files parsed",
+    "elf-fallbacks": "ELF files parsed with pyelftools",
+    "elf-memo-hits": "ELF files skipped by checksum memo",
+    "so-providers-hits": "sonames resolved by SO_PROVIDERS",
+    "lookup-cache-hits": "sonames resolved from cache",
+    "nix-index-lookups": "sonames looked up in nix-index database",
+    "nix-locate-calls": "nix-locate invocations",
+}
+
+
+@dataclass
+class StatsSnapshot:
+    counters: dict[str, int] = field(default_factory=dict)
+    # (seconds, package) wall time of each scanned package
+    packages: list[tuple[float, str]] = field(default_factory=list)
+
+
+class Stats:
+    """
+    Process wide run counters
+    """
+
+    counters: Counter[str]
+    packages: list[tuple[float, str]]
+
+    _lock: threading.Lock
+
+    def __init__(self) -> None:
+        self.counters = Counter()
+        self.packages = []
+        self._lock = threading.Lock()
+
+    def incr(self, name: str, n: int = 1) -> None:
+        with self._lock:
+            self.counters[name] += n
+
+    def record_package(self, name: str, version: str | None, seconds: float) -> None:
+        with self._lock:
+            self.packages.append((seconds, f"{name}=={version}" if version else name))
+
+    def drain(self) -> StatsSnapshot:
+        """Take collected stats, for merging into another process"""
+        with self._lock:
+            snapshot = StatsSnapshot(dict(self.counters), self.packages)
+            self.counters = Counter()
+            self.packages = []
+        return snapshot
+
+    def merge(self, snapshot: StatsSnapshot) -> None:
+        with self._lock:
+            self.counters.update(snapshot.counters)
+            self.packages.extend(snapshot.packages)
+
+    def slowest(self, top: int) -> list[tuple[float, str]]:
+        with self._lock:
+            return heapq.nlargest(top, self.packages)
+
+    def to_json(self, top: int = 10) -> dict[str, object]:
+        with self._lock:
+            counters = {name: self.counters.get(name, 0) for name in COUNTERS}
+        return {
+            "counters": counters,
+            "slowest-packages": [
+                {"package": package, "seconds": round(seconds, 3)}
+                for seconds, package in self.slowest(top)
+            ],
+        }
+
+    def format(self, top: int = 10) -> str:
+        lines = ["Run statistics:"]
+        with self._lock:
+            for name, description in COUNTERS.items():
+                lines.append(f"  {description + ':':<42} {self.counters.get(name, 0)}")
+
+        slowest = self.slowest(top)
+        if slowest:
+            lines.append(f"Slowest {len(slowest)} packages:")
+            for seconds, package in slowest:
+                lines.append(f"  {seconds:8.3f}s  {package}")
+
+        return "\n".join(lines)
+
+
+_stats = Stats()
+
+
+def get_stats() -> Stats:
+    return _stats
+
+
+def incr(name: str, n: int = 1) -> None:
+    _stats.incr(name, n)
@@ -0,0 +1,124 @@
+from __future__ import annotations
+from collections.abc import Generator
+from contextlib import contextmanager
+from pathlib import Path
+import threading
+import itertools
+import time
+import json
+import os
+
+
+# Chrome trace event, see the Trace Event Format specification
+TraceEvent = dict[str, object]
+
+
+def _now_us() -> float:
+    # Monotonic clock is shared between processes, keeping worker timelines aligned
+    return time.monotonic_ns() / 1000
+
+
+class Tracer:
+    """
+    Collect spans as Chrome trace events, viewable in Perfetto or chrome://tracing
+    """
+
+    events: list[TraceEvent]
+
+    _thread_names: dict[tuple[int, int], str]
+    _ids: itertools.count[int]
+    _lock: threading.Lock
+
+    def __init__(self) -> None:
+        self.events = []
+        self._thread_names = {}
+        self._ids = itertools.count()
+        self._lock = threading.Lock()
+
+    def add(self, event: TraceEvent) -> None:
+        pid = os.getpid()
+        thread = threading.current_thread()
+        event["pid"] = pid
+        event["tid"] = thread.ident
+        with self._lock:
+            self.events.append(event)
+            _ = self._thread_names.setdefault((pid, thread.ident or 0), thread.name)
+
+    def next_id(self) -> int:
+        return next(self._ids)
+
+    def drain(self) -> list[TraceEvent]:
+        """Take collected events, including thread metadata, for merging into another tracer"""
+        with self._lock:
+            events = self.events + self._metadata()
+            self.events = []
+            self._thread_names = {}
+        return events
+
+    def merge(self, events: list[TraceEvent]) -> None:
+        with self._lock:
+            self.events.extend(events)
+
+    def _metadata(self) -> list[TraceEvent]:
+        return [
+            {"name": "thread_name", "ph": "M", "pid": pid, "tid": tid, "args": {"name": name}}
+            for (pid, tid), name in self._thread_names.items()
+        ]
+
+    def dump(self, path: Path) -> None:
+        with self._lock:
+            events = self.events + self._metadata()
+        with open(path, "w") as fp:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, fp)
+
+
+_tracer: Tracer | None = None
+
+
+def enable() -> Tracer:
+    global _tracer
+    if _tracer is None:
+        _tracer = Tracer()
+    return _tracer
+
+
+def disable() -> None:
+    global _tracer
+    _tracer = None
+
+
+def get_tracer() -> Tracer | None:
+    return _tracer
+
+
+@contextmanager
+def span(name: str, cat: str, **args: object) -> Generator[None]:
+    """Record the enclosed block as a complete event on the current thread"""
+    tracer = _tracer
+    if tracer is None:
+        yield
+        return
+
+    start = _now_us()
+    try:
+        yield
+    finally:
+        tracer.add(
+            {"name": name, "cat": cat, "ph": "X", "ts": start, "dur": _now_us() - start, "args": args}
+        )
+
+
+@contextmanager
+def async_span(name: str, cat: str, **args: object) -> Generator[None]:
+    """Record the enclosed block as an async event, for spans overlapping on one thread"""
+    tracer = _tracer
+    if tracer is None:
+        yield
+        return
+
+    event_id = tracer.next_id()
+    tracer.add({"name": name, "cat": cat, "ph": "b", "id": event_id, "ts": _now_us(), "args": args})
+    try:
+        yield
+    finally:
+        tracer.add({"name": name, "cat": cat, "ph": "e", "id": event_id, "ts": _now_us()})
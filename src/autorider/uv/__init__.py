@@ -2,8 +2,10 @@ from typing import override
 from pathlib import Path
 import logging
 
-from autorider.scanners import PackageScanner
+from autorider.cache import Cache
+from autorider.scanners import Artifact, PackageScanner, ScanDepends
 from autorider.uv import lock1
+from autorider import trace
 from autorider.manager import GENERATOR_T, PackageManager
 
 
@@ -18,21 +20,26 @@ class UvPackageScanner(PackageScanner):
         super().__init__(package["name"], package.get("version"))
 
     @override
-    def scan(self):
-        return lock1.scan_pkg(self.package)
+    def artifacts(self, depends: ScanDepends = ScanDepends.ALL) -> list[Artifact]:
+        return lock1.pkg_artifacts(self.package, depends)
 
 
 class Uv2nix(PackageManager):
     workspace_root: Path
+    # Parsed lock files are indexed by content hash
+    cache: Cache | None
 
-    def __init__(self, workspace_root: Path) -> None:
+    def __init__(self, workspace_root: Path, cache: Cache | None = None) -> None:
         self.workspace_root = workspace_root
+        self.cache = cache
         super().__init__()
 
     @override
     def generate(self) -> GENERATOR_T:
-        with open(self.workspace_root.joinpath("uv.lock"), "rb") as fp:
-            lock = lock1.load(fp)
+        lock_path = self.workspace_root.joinpath("uv.lock")
+        with trace.span("parse uv.lock", "lock", path=str(lock_path)):
+            packages = lock1.load_packages(lock_path, self.cache)
 
-        for pkg in lock.get("package", []):
-            yield UvPackageScanner(pkg)
+        for pkgs in packages.values():
+            for pkg in pkgs:
+                yield UvPackageScanner(pkg)
@@ -3,11 +3,31 @@ from pathlib import Path
 import os.path
 from typing import TypedDict, NotRequired
 from typing import cast, IO
+import hashlib
+import logging
+import marshal
 import tomllib
+import sys
 
-from autorider.download import GitDownload, HTTPDownload
+from autorider.cache import Cache
+from autorider.download import Download, GitDownload, HTTPDownload
 from autorider.lib import select_wheel
-from autorider.scanners import ScanResult, SdistScanner, WheelScanner
+from autorider.scanners import (
+    Artifact,
+    ScanContext,
+    ScanDepends,
+    ScanResult,
+    SdistScanner,
+    WheelScanner,
+    scan_artifacts,
+)
+
+
+logger = logging.getLogger(__name__)
+
+
+# Bump when the package index layout or wheel selection changes
+INDEX_VERSION = 2
 
 
 class UvLock(TypedDict):
@@ -42,6 +62,10 @@ class Package(TypedDict):
     source: NotRequired[PackageSource]
 
 
+# Packages by name, a lock may contain several versions of one package
+PACKAGE_INDEX_T = dict[str, list[Package]]
+
+
 def load(fp: IO[bytes]) -> UvLock:
     return cast(UvLock, tomllib.load(fp))  # pyright: ignore[reportInvalidCast]
 
@@ -50,6 +74,44 @@ def loads(s: str) -> UvLock:
     return cast(UvLock, tomllib.loads(s))  # pyright: ignore[reportInvalidCast]
 
 
+def index_packages(lock: UvLock) -> PACKAGE_INDEX_T:
+    """
+    Packages of a lock by name, with wheels narrowed down to the selected one
+
+    Multi-platform locks have many wheels per package, of which only one is scanned.
+    """
+    packages: PACKAGE_INDEX_T = {}
+    for pkg in lock.get("package", []):
+        pkg = pkg.copy()
+        wheels = pkg.get("wheels")
+        if wheels and all(_wheel_name(wheel) for wheel in wheels):
+            selected = _select_wheel(wheels)
+            pkg["wheels"] = [selected] if selected else []
+        packages.setdefault(pkg["name"], []).append(pkg)
+    return packages
+
+
+def load_packages(path: Path, cache: Cache | None = None) -> PACKAGE_INDEX_T:
+    """Load indexed packages of a lock file, reusing a cached index of identical contents"""
+    data = path.read_bytes()
+    # marshal's format may change between interpreters sharing a cache
+    interpreter = f"{sys.implementation.cache_tag}-{marshal.version}"
+    key = f"uvlock/{INDEX_VERSION}/{interpreter}/{hashlib.sha256(data).hexdigest()}"
+
+    if cache:
+        cached = cache.get(key)
+        if cached is not None:
+            try:
+                return cast(PACKAGE_INDEX_T, marshal.loads(cached))
+            except (EOFError, ValueError, TypeError) as exc:
+                logger.warning("discarding unreadable lock index '%s': %s", key, exc)
+
+    packages = index_packages(loads(data.decode()))
+    if cache:
+        cache.put(key, marshal.dumps(packages))
+    return packages
+
+
 def get_path(source: PackageSource) -> Path:
     if "path" not in source:
         raise ValueError("Expected path in source")
@@ -64,59 +126,68 @@ def get_path(source: PackageSource) -> Path:
     return path.absolute()
 
 
-def scan_pkg(pkg: Package):
+def _wheel_name(wheel: PackageWheel) -> str | None:
+    wheel_path = wheel.get("url", wheel.get("path"))
+    return os.path.basename(wheel_path) if wheel_path else None
+
+
+def _select_wheel(wheels: list[PackageWheel]) -> PackageWheel | None:
+    wheels_by_name: dict[str, PackageWheel] = {}
+    for wheel in wheels:
+        wheel_name = _wheel_name(wheel)
+        if not wheel_name:
+            raise ValueError(f"Could not get wheel name for '{wheel}'")
+        wheels_by_name[wheel_name] = wheel
+
+    selected = select_wheel(list(wheels_by_name))
+    return wheels_by_name[selected] if selected else None
+
+
+def pkg_artifacts(pkg: Package, depends: ScanDepends = ScanDepends.ALL) -> list[Artifact]:
     source = pkg.get("source", {})
+    artifacts: list[Artifact] = []
 
-    wheel_scanner: WheelScanner | None = None
-    if "wheels" in pkg:
-        wheels = pkg["wheels"]
-
-        wheels_by_name: dict[str, PackageWheel] = {}
-        for wheel in wheels:
-            wheel_path = wheel.get("url", wheel.get("path"))
-            if not wheel_path:
-                raise ValueError(f"Could not get wheel name for '{wheel}'")
-            wheel_name = os.path.basename(wheel_path)
-            wheels_by_name[wheel_name] = wheel
-
-        selected = select_wheel(list(wheels_by_name))
-        if selected:
-            wheel = wheels_by_name[selected]
+    if depends & WheelScanner.DEPENDS and "wheels" in pkg:
+        wheel = _select_wheel(pkg["wheels"])
+        if wheel:
             if "url" in wheel:
-                url = wheel["url"]
-                dl = HTTPDownload(url, wheel.get("hash"))
-                archive = dl.get()
+                wheel_source = HTTPDownload(
+                    wheel["url"], wheel.get("hash"), wheel.get("size")
+                )
             elif "path" in source:
-                archive = get_path(source)
+                wheel_source = get_path(source)
             else:
                 raise ValueError(f"wheel {wheel} unhandled")
 
-            wheel_scanner = WheelScanner(archive)
-            wheel_scanner.run()
-
-    sdist_scanner: SdistScanner | None = None
-    if "sdist" in pkg:
-        sdist = pkg["sdist"]
-        archive: Path
-
-        if "url" in sdist:
-            dl = HTTPDownload(sdist["url"], sdist.get("hash"))
-            archive = dl.get()
-        elif "path" in source:  # local path
-            archive = get_path(source)
-        else:
-            raise ValueError(f"sdist {sdist} unhandled")
-
-        sdist_scanner = SdistScanner(archive)
-    elif "git" in source:
-        dl = GitDownload(source["git"])
-        sdist_scanner = SdistScanner(dl.get())
-
-    if sdist_scanner:
-        sdist_scanner.run()
-
-    return ScanResult(
-        pkg["name"],
-        sdist=sdist_scanner,
-        wheel=wheel_scanner,
-    )
+            artifacts.append(Artifact(WheelScanner, wheel.get("hash"), wheel_source))
+
+    if depends & SdistScanner.DEPENDS:
+        if "sdist" in pkg:
+            sdist = pkg["sdist"]
+            sdist_source: Download | Path
+
+            if "url" in sdist:
+                sdist_source = HTTPDownload(
+                    sdist["url"], sdist.get("hash"), sdist.get("size")
+                )
+            elif "path" in source:  # local path
+                sdist_source = get_path(source)
+            else:
+                raise ValueError(f"sdist {sdist} unhandled")
+
+            artifacts.append(Artifact(SdistScanner, sdist.get("hash"), sdist_source))
+        elif "git" in source:
+            # Git URLs pinned to a revision are content addressed
+            git_url = source["git"]
+            git_key = f"git:{git_url}" if "#" in git_url else None
+            artifacts.append(Artifact(SdistScanner, git_key, GitDownload(git_url)))
+
+    return artifacts
+
+
+def scan_pkg(
+    pkg: Package,
+    depends: ScanDepends = ScanDepends.ALL,
+    context: ScanContext | None = None,
+) -> ScanResult:
+    return scan_artifacts(pkg["name"], pkg_artifacts(pkg, depends), depends, context)
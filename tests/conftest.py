@@ -0,0 +1,70 @@
+from collections.abc import Callable
+from pathlib import Path
+import textwrap
+import sys
+
+import pytest
+
+
+# Writes an executable fake tool from a script template, returning its path
+MAKE_TOOL_T = Callable[..., Path]
+
+# Writes a uv workspace into a directory, returning its root
+MAKE_WORKSPACE_T = Callable[[Path], Path]
+
+# Local sdist locked by test workspaces
+ATTRS_SDIST = Path(__file__).parent.parent.joinpath("fixtures", "attrs-23.1.0.tar.gz")
+
+ATTRS_LOCK = """
+version = 1
+requires-python = ">=3.12"
+
+[[package]]
+name = "attrs"
+version = "23.1.0"
+source = {{ path = "{path}" }}
+sdist = {{ hash = "sha256:6279836d581513a26f1bf235f9acd333bc9115683f14f7e8fae46c98fc50e015" }}
+"""
+
+
+@pytest.fixture
+def make_tool(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> MAKE_TOOL_T:
+    """
+    Factory for fake external tools
+
+    Templates are formatted with the test interpreter as {python} & any keyword
+    arguments, scripts are placed in a directory prepended to PATH.
+    """
+    bin_dir = tmp_path.joinpath("bin")
+
+    def make_tool(name: str, template: str, **params: object) -> Path:
+        bin_dir.mkdir(exist_ok=True)
+        script = bin_dir.joinpath(name)
+        _ = script.write_text(textwrap.dedent(template).format(python=sys.executable, **params).lstrip())
+        script.chmod(0o755)
+        monkeypatch.setenv("PATH", str(bin_dir), prepend=":")
+        return script
+
+    return make_tool
+
+
+@pytest.fixture
+def attrs_sdist() -> Path:
+    return ATTRS_SDIST
+
+
+@pytest.fixture
+def make_workspace(attrs_sdist: Path) -> MAKE_WORKSPACE_T:
+    """
+    Factory for workspaces locking the attrs sdist by absolute path
+
+    Workspaces output build systems, so scanning them runs without network access.
+    """
+
+    def make_workspace(root: Path) -> Path:
+        root.mkdir(parents=True, exist_ok=True)
+        _ = root.joinpath("pyproject.toml").write_text("[tool.autorider.outputs]\nbuild-systems = true\n")
+        _ = root.joinpath("uv.lock").write_text(ATTRS_LOCK.format(path=attrs_sdist))
+        return root
+
+    return make_workspace
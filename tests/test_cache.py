@@ -0,0 +1,80 @@
+from pathlib import Path
+
+from autorider.cache import Cache
+from autorider.scanners import ScanContext, SdistResult
+from autorider.uv import lock1
+
+
+def test_get_put(tmp_path: Path):
+    cache = Cache.from_dir(tmp_path)
+    assert cache.get("missing") is None
+    cache.put("key", b"value")
+    assert cache.get("key") == b"value"
+
+
+def test_lru_eviction(tmp_path: Path):
+    cache = Cache.from_dir(tmp_path)
+    cache.put("a", b"x" * 100)
+    cache.put("b", b"x" * 100)
+    cache.put("c", b"x" * 100)
+
+    # Touch a so b becomes the least recently used entry
+    assert cache.get("a") is not None
+
+    assert cache.gc(max_size=250) == 1
+    assert cache.get("b") is None
+    assert cache.get("a") is not None
+    assert cache.get("c") is not None
+
+
+def test_scan_cache_hit(tmp_path: Path):
+    fixture = lock1.loads("""
+    version = 1
+    requires-python = ">=3.12"
+
+    [[package]]
+    name = "attrs"
+    version = "23.1.0"
+    source = { path = "./fixtures/attrs-23.1.0.tar.gz" }
+    sdist = { hash = "sha256:6279836d581513a26f1bf235f9acd333bc9115683f14f7e8fae46c98fc50e015" }
+    """)
+    pkg = fixture.get("package", [])[0]
+    cache = Cache.from_dir(tmp_path)
+
+    scan_result = lock1.scan_pkg(pkg, context=ScanContext(cache=cache))
+    assert scan_result.sdist is not None
+
+    # Point the package at a non-existent path, a cache hit must not touch it
+    pkg["source"] = {"path": "./fixtures/does-not-exist.tar.gz"}
+    cached_result = lock1.scan_pkg(pkg, context=ScanContext(cache=cache))
+    assert cached_result.sdist == SdistResult(
+        ["hatchling", "hatch-vcs", "hatch-fancy-pypi-readme"], set()
+    )
+
+
+
+def test_atime_batched(tmp_path: Path):
+    cache = Cache.from_dir(tmp_path)
+    cache.put("a", b"x" * 100)
+    cache.put("b", b"x" * 100)
+
+    # Access times are written in batches, and count towards eviction once written
+    assert cache.get("a") is not None
+    cache.flush()
+    assert cache.gc(max_size=150) == 1
+    assert cache.get("a") is not None
+    assert cache.get("b") is None
+
+
+def test_atime_memory_hits(tmp_path: Path):
+    cache = Cache.from_dir(tmp_path, memory_size=1024)
+    cache.put("a", b"x" * 100)
+    cache.put("b", b"x" * 100)
+
+    # Served from memory, yet still a use as far as eviction is concerned
+    assert cache.get("a") is not None
+    assert cache.gc(max_size=150) == 1
+
+    reopened = Cache.from_dir(tmp_path)
+    assert reopened.get("a") is not None
+    assert reopened.get("b") is None
@@ -0,0 +1,55 @@
+from collections.abc import Callable
+from pathlib import Path
+import json
+
+import pytest
+
+from autorider import stats
+from autorider.cli import main
+
+
+def test_batch(tmp_path: Path, make_workspace: Callable[[Path], Path]):
+    roots = [make_workspace(tmp_path.joinpath(name)) for name in ("a", "b")]
+
+    _ = stats.get_stats().drain()
+    main(
+        [
+            "--no-daemon",
+            "--no-cache",
+            "--root", str(roots[0]),
+            "--root", str(roots[1]),
+            "--stats-json", str(tmp_path.joinpath("stats.json")),
+            "uv2nix",
+        ]
+    )
+
+    # Each root gets its own output
+    for root in roots:
+        output = json.loads(root.joinpath("autorider.json").read_text())  # pyright: ignore[reportAny]
+        assert output["packages"]["attrs"]["build-systems"] == [
+            "hatchling",
+            "hatch-vcs",
+            "hatch-fancy-pypi-readme",
+        ]
+
+    # The artifact shared by both locks is scanned once
+    counters = json.loads(tmp_path.joinpath("stats.json").read_text())["counters"]  # pyright: ignore[reportAny]
+    assert counters["packages-scanned"] == 2
+    assert counters["scan-memo-hits"] == 1
+
+
+def test_batch_absolute_output(tmp_path: Path, capsys: pytest.CaptureFixture[str]):
+    argv = ["--no-daemon", "--root", "a", "--root", "b", "--output", str(tmp_path.joinpath("out.json"))]
+
+    # Outputs of every root would overwrite each other
+    with pytest.raises(SystemExit) as exc_info:
+        main([*argv, "uv2nix"])
+    assert exc_info.value.code == 2
+    assert "relative --output" in capsys.readouterr().err
+
+
+def test_jobs_invalid(capsys: pytest.CaptureFixture[str]):
+    with pytest.raises(SystemExit) as exc_info:
+        main(["--no-daemon", "--jobs", "0", "uv2nix"])
+    assert exc_info.value.code == 2
+    assert "at least 1" in capsys.readouterr().err
@@ -0,0 +1,87 @@
+from collections.abc import Callable
+from pathlib import Path
+import subprocess
+import signal
+import json
+import time
+import re
+import sys
+import os
+
+import pytest
+
+from autorider.daemon import FORWARDED_ENV, Daemon, run_remote
+
+
+def test_serve(tmp_path: Path, make_workspace: Callable[[Path], Path]):
+    _ = make_workspace(tmp_path)
+    socket_path = tmp_path.joinpath("autorider.sock")
+    argv = ["--socket", str(socket_path), "--cache-dir", str(tmp_path.joinpath("cache")), "--stats"]
+
+    # No daemon listening yet
+    assert run_remote(socket_path, [*argv, "uv2nix"], str(tmp_path)) is None
+
+    proc = subprocess.Popen(
+        [sys.executable, "-c", "from autorider.cli import main; main()", *argv, "serve"],
+        stdout=subprocess.DEVNULL,
+    )
+    try:
+        for _ in range(100):
+            if socket_path.exists():
+                break
+            time.sleep(0.05)
+
+        for scan_cache_hits in (0, 1):
+            response = run_remote(socket_path, [*argv, "uv2nix"], str(tmp_path))
+            assert response is not None and response["exit"] == 0, response
+            m = re.search(r"scan cache hits:\s+(\d+)", response["stderr"])
+            assert m and int(m.group(1)) == scan_cache_hits
+
+            output = json.loads(tmp_path.joinpath("autorider.json").read_text())  # pyright: ignore[reportAny]
+            assert output["packages"]["attrs"]["build-systems"] == [
+                "hatchling",
+                "hatch-vcs",
+                "hatch-fancy-pypi-readme",
+            ]
+
+        # Failures are reported to the client
+        response = run_remote(socket_path, [*argv, "--bogus", "uv2nix"], str(tmp_path))
+        assert response is not None and response["exit"] == 2
+    finally:
+        proc.send_signal(signal.SIGINT)
+        _ = proc.wait(10)
+
+    assert not socket_path.exists()
+
+
+def test_handle_env(tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setenv("NIX_STORE_DIR", "/daemon/store")
+    monkeypatch.setenv("NIX_INDEX_DATABASE", "/daemon/index")
+
+    seen: dict[str, str | None] = {}
+
+    def main(argv: list[str], daemon: Daemon) -> None:  # pyright: ignore[reportUnusedParameter]
+        seen.update((name, os.environ.get(name)) for name in FORWARDED_ENV)
+
+    env: dict[str, str | None] = {
+        "NIX_INDEX_DATABASE": None,
+        "NIX_STORE_DIR": "/client/store",
+        "PATH": "/client/bin",
+        "XDG_CACHE_HOME": "/client/cache",
+    }
+    daemon = Daemon(main)
+    response = daemon.handle({"argv": [], "cwd": str(tmp_path), "env": {**env, "HOME": "/client"}})
+    assert response["exit"] == 0
+
+    # Runs see the client's environment, other variables aren't forwarded
+    assert seen == env
+    assert os.environ["NIX_STORE_DIR"] == "/daemon/store"
+    assert os.environ["NIX_INDEX_DATABASE"] == "/daemon/index"
+    assert os.environ["HOME"] != "/client"
+
+
+def test_run_remote_unreachable(tmp_path: Path):
+    # Connecting fails with errors other than a missing or refusing socket, e.g. permissions
+    not_a_dir = tmp_path.joinpath("runtime")
+    _ = not_a_dir.write_text("")
+    assert run_remote(not_a_dir.joinpath("autorider.sock"), ["uv2nix"], str(tmp_path)) is None
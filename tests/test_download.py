@@ -0,0 +1,142 @@
+from collections.abc import Callable
+from concurrent import futures
+from pathlib import Path
+
+import pytest
+
+from autorider.download import Fetcher, GitDownload, HTTPDownload, nix_base32
+
+
+FAKE_NIX_INSTANTIATE = """
+#!{python}
+import json
+import sys
+
+with open({log!r}, "a") as log:
+    log.write("call\\n")
+
+args = json.loads(sys.argv[sys.argv.index("args") + 1])
+paths = []
+for arg in args:
+    name = arg["args"]["url"].rstrip("/").rsplit("/", 1)[-1]
+    paths.append("/nix/store/" + arg["type"] + "-" + name)
+json.dump(paths, sys.stdout)
+"""
+
+
+@pytest.fixture
+def fake_nix(tmp_path: Path, make_tool: Callable[..., Path]) -> Path:
+    log = tmp_path.joinpath("calls.log")
+    _ = make_tool("nix-instantiate", FAKE_NIX_INSTANTIATE, log=str(log))
+    return log
+
+
+def test_batch_prefetch(fake_nix: Path):
+    downloads = [
+        HTTPDownload("https://example.com/a-1.0.tar.gz", "sha256:00"),
+        HTTPDownload("https://example.com/b-1.0.tar.gz", "sha256:11"),
+        GitDownload("https://example.com/c.git?subdirectory=sub#abcdef"),
+    ]
+
+    fetcher = Fetcher(batch_size=2)
+    fetcher.prefetch(downloads)
+    assert len(fake_nix.read_text().splitlines()) == 2
+
+    assert fetcher.get(downloads[0]) == Path("/nix/store/url-a-1.0.tar.gz")
+    assert fetcher.get(downloads[1]) == Path("/nix/store/url-b-1.0.tar.gz")
+    assert fetcher.get(downloads[2]) == Path("/nix/store/git-c.git/sub")
+
+    # Prefetched downloads must not spawn another evaluator
+    assert len(fake_nix.read_text().splitlines()) == 2
+
+
+def test_get_unprefetched(fake_nix: Path):
+    fetcher = Fetcher()
+    dl = HTTPDownload("https://example.com/d-1.0.tar.gz")
+    assert fetcher.get(dl) == Path("/nix/store/url-d-1.0.tar.gz")
+    assert fetcher.get(dl) == Path("/nix/store/url-d-1.0.tar.gz")
+    assert len(fake_nix.read_text().splitlines()) == 1
+
+
+def test_get_single_flight(fake_nix: Path):
+    fetcher = Fetcher()
+    dl = HTTPDownload("https://example.com/e-1.0.tar.gz", "sha256:22")
+
+    with futures.ThreadPoolExecutor(8) as executor:
+        paths = list(executor.map(fetcher.get, [dl] * 8))
+
+    # Concurrent requests share one fetch
+    assert paths == [Path("/nix/store/url-e-1.0.tar.gz")] * 8
+    assert len(fake_nix.read_text().splitlines()) == 1
+
+
+HELLO_SHA256 = "31e066137a962676e89f69d1b65382de95a7ef7d914b8cb956f41ea72e0f516b"
+
+
+def test_store_path():
+    assert nix_base32(bytes.fromhex(HELLO_SHA256)) == "0ssi1wpaf7plaswqqjwigppsg5fyh99vdlb9kzl7c9lng89ndq1i"
+
+    dl = HTTPDownload("https://ftp.gnu.org/gnu/hello/hello-2.10.tar.gz", f"sha256:{HELLO_SHA256}")
+    assert dl.store_path(Path("/nix/store")) == Path(
+        "/nix/store/3x7dwzq014bblazs7kq20p9hyzz0qh8g-hello-2.10.tar.gz"
+    )
+
+    # Not computable without a hash, or with a name the store doesn't allow
+    assert HTTPDownload("https://example.com/a-1.0.tar.gz").store_path(Path("/nix/store")) is None
+    assert (
+        HTTPDownload("https://example.com/~a.tar.gz", f"sha256:{HELLO_SHA256}").store_path(Path("/nix/store"))
+        is None
+    )
+
+
+FAKE_NIX_STORE = """
+#!{python}
+import sys
+
+with open({log!r}, "a") as log:
+    log.write("call\\n")
+
+# Files left behind by interrupted writes aren't registered as valid
+for path in sys.argv[3:]:
+    with open(path, "rb") as fp:
+        if fp.read().startswith(b"partial"):
+            print(path)
+"""
+
+
+@pytest.fixture
+def fake_nix_store(tmp_path: Path, make_tool: Callable[..., Path]) -> Path:
+    log = tmp_path.joinpath("nix-store.log")
+    _ = make_tool("nix-store", FAKE_NIX_STORE, log=str(log))
+    return log
+
+
+def test_prefetch_in_store(fake_nix: Path, fake_nix_store: Path, tmp_path: Path):
+    store_dir = tmp_path.joinpath("store")
+    store_dir.mkdir()
+
+    present = HTTPDownload("https://example.com/a-1.0.tar.gz", f"sha256:{'a' * 64}", size=3)
+    truncated = HTTPDownload("https://example.com/b-1.0.tar.gz", f"sha256:{'b' * 64}", size=3)
+    invalid = HTTPDownload("https://example.com/c-1.0.tar.gz", f"sha256:{'c' * 64}", size=7)
+    missing = HTTPDownload("https://example.com/d-1.0.tar.gz", f"sha256:{'d' * 64}")
+
+    for dl, data in ((present, b"abc"), (truncated, b"a"), (invalid, b"partial")):
+        path = dl.store_path(store_dir)
+        assert path
+        _ = path.write_bytes(data)
+
+    fetcher = Fetcher(store_dir=store_dir)
+    fetcher.prefetch([present, truncated, invalid, missing])
+    assert len(fake_nix.read_text().splitlines()) == 1
+    # Validity of every candidate is checked at once
+    assert len(fake_nix_store.read_text().splitlines()) == 1
+
+    # Only artifacts missing from the store or not valid are evaluated
+    assert fetcher.get(present) == present.store_path(store_dir)
+    assert fetcher.get(truncated) == Path("/nix/store/url-b-1.0.tar.gz")
+    assert fetcher.get(invalid) == Path("/nix/store/url-c-1.0.tar.gz")
+    assert fetcher.get(missing) == Path("/nix/store/url-d-1.0.tar.gz")
+    assert len(fake_nix.read_text().splitlines()) == 1
+
+    assert Fetcher(store_dir=store_dir).get(present) == present.store_path(store_dir)
+    assert len(fake_nix.read_text().splitlines()) == 1
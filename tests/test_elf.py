@@ -0,0 +1,40 @@
+from pathlib import Path
+import glob
+import io
+
+import pytest
+
+from autorider import elf
+from benchmarks.synthetic import build_elf
+
+
+@pytest.mark.parametrize("elf_class", [elf.ELFCLASS32, elf.ELFCLASS64])
+@pytest.mark.parametrize("endian", ["<", ">"])
+def test_read_dynamic(elf_class: int, endian: str):
+    info = elf.read_dynamic(
+        io.BytesIO(build_elf(runpath="$ORIGIN:/opt", elf_class=elf_class, endian=endian))
+    )
+    assert info.needed == ["libfoo.so.1", "libbar.so.2"]
+    assert info.soname == "libself.so.3"
+    assert info.runpath == ["$ORIGIN", "/opt"]
+
+
+def test_not_elf():
+    with pytest.raises(elf.ELFError):
+        _ = elf.read_dynamic(io.BytesIO(b"INPUT(-lfoo)\n"))
+
+
+SYSTEM_LIBS = [
+    path
+    for path in sorted(glob.glob("/usr/lib/*/lib*.so.*") + glob.glob("/usr/lib64/lib*.so.*"))[:50]
+    if not Path(path).is_symlink()
+]
+
+
+@pytest.mark.skipif(not SYSTEM_LIBS, reason="no system libraries to compare against")
+def test_matches_elftools():
+    for path in SYSTEM_LIBS:
+        with open(path, "rb") as fp:
+            if fp.read(4) != elf.ELF_MAGIC:
+                continue
+            assert elf.read_dynamic(fp) == elf.read_dynamic_elftools(fp), path
@@ -0,0 +1,38 @@
+from typing import cast
+import subprocess
+import json
+import sys
+
+import pytest
+
+
+# Heavy modules only loaded once their subsystem is used
+HEAVY_MODULES = [
+    "asyncio",
+    "elftools",
+    "multiprocessing",
+    "pydantic",
+    "tarfile",
+    "urllib.request",
+    "zipfile",
+]
+
+
+def loaded_modules(module: str) -> list[str]:
+    """Heavy modules loaded by importing module in a fresh interpreter"""
+    code = (
+        f"import sys, json, {module}; "
+        f"print(json.dumps([m for m in {HEAVY_MODULES!r} if m in sys.modules]))"
+    )
+    return cast(list[str], json.loads(subprocess.check_output([sys.executable, "-c", code])))
+
+
+def test_cli_imports():
+    # Argument parsing, cache & convert commands need none of the scanning machinery
+    assert loaded_modules("autorider.cli") == []
+
+
+@pytest.mark.parametrize("module", ["autorider.scanners", "autorider.uv"])
+def test_scanner_imports(module: str):
+    # Archives & ELF files are only opened once an artifact isn't cached
+    assert loaded_modules(module) == []
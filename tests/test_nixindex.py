@@ -0,0 +1,130 @@
+from pathlib import Path
+from typing import cast
+import struct
+import json
+
+import pytest
+
+from autorider import nixindex
+from autorider.lib import parse_nix_locate
+
+
+zstandard = pytest.importorskip("zstandard")  # pyright: ignore[reportAny]
+
+
+def encode_diff(diff: int) -> bytes:
+    if -127 <= diff <= 127:
+        return struct.pack("b", diff)
+    return b"\x80" + struct.pack(">h", diff)
+
+
+def write_database(path: Path, packages: list[tuple[dict[str, object], list[tuple[bytes, bytes]]]]):
+    """Generate a database in the nix-index frcode format"""
+    encoded = bytearray()
+    prev = b""
+    prev_shared = 0
+
+    def write_entry(meta: bytes, entry_path: bytes):
+        nonlocal prev, prev_shared
+        shared = 0
+        while shared < min(len(prev), len(entry_path)) and prev[shared] == entry_path[shared]:
+            shared += 1
+        encoded.extend(meta + b"\x00" + encode_diff(shared - prev_shared) + entry_path[shared:] + b"\n")
+        prev = entry_path
+        prev_shared = shared
+
+    for store_path, files in packages:
+        for meta, file_path in files:
+            write_entry(meta, file_path)
+        write_entry(b"p", json.dumps(store_path).encode())
+
+    with open(path, "wb") as fp:
+        _ = fp.write(nixindex.FILE_MAGIC)
+        _ = fp.write(struct.pack("<Q", nixindex.FORMAT_VERSION))
+        _ = fp.write(zstandard.ZstdCompressor().compress(bytes(encoded)))  # pyright: ignore[reportAny]
+
+
+def store_path(attr: str, toplevel: bool = True) -> dict[str, object]:
+    return {
+        "store_dir": "/nix/store",
+        "hash": "00000000000000000000000000000000",
+        "name": attr,
+        "origin": {"attr": attr, "output": "out", "toplevel": toplevel, "system": None},
+    }
+
+
+@pytest.mark.parametrize("chunk_size", [nixindex.CHUNK_SIZE, 3])
+def test_locate_files(tmp_path: Path, monkeypatch: pytest.MonkeyPatch, chunk_size: int):
+    # Small chunks exercise entries split across reads
+    monkeypatch.setattr(nixindex, "CHUNK_SIZE", chunk_size)
+
+    database = tmp_path.joinpath("files")
+    long_dir = b"/share/" + b"x" * 300
+    write_database(
+        database,
+        [
+            # Like nix-locate without --top-level, dependencies of top-level packages match too
+            (store_path("nested", toplevel=False), [(b"10r", b"/lib/libqux.so.4")]),
+            (store_path("ignored"), [(b"10x", b"/lib/libbaz.so.3")]),
+            (
+                store_path("foo"),
+                [
+                    (b"/lib/libfoo.so.1.2.3s", b"/lib/libfoo.so.1"),
+                    (b"10r", b"/lib/libfoo.so.1.2.3"),
+                    (b"10r", long_dir + b"/data"),
+                    (b"10r", b"/lib/libqux.so.4"),
+                ],
+            ),
+            (store_path("bar"), [(b"10d", b"/lib"), (b"10r", b"/lib/libbar.so.2")]),
+            (store_path("baz"), [(b"10r", b"/lib/libbaz.so.3")]),
+        ],
+    )
+
+    assert nixindex.locate_files(
+        database,
+        ["libfoo.so.1", "libfoo.so.1.2", "libbar.so.2", "libbaz.so.3", "libqux.so.4", "libmissing.so.1"],
+        ignore=["ignored"],
+    ) == {
+        "libqux.so.4": "(nested.out)",
+        "libfoo.so.1": "foo.out",
+        "libfoo.so.1.2": "foo.out",
+        "libbar.so.2": "bar.out",
+        "libbaz.so.3": "baz.out",
+    }
+
+
+def test_locate_files_nix_locate_output(tmp_path: Path):
+    packages = [
+        (store_path("nested", toplevel=False), [(b"10r", b"/lib/libqux.so.4")]),
+        (store_path("ignored"), [(b"10r", b"/lib/libqux.so.4")]),
+        (store_path("foo"), [(b"10r", b"/lib/libqux.so.4")]),
+    ]
+    database = tmp_path.joinpath("files")
+    write_database(database, packages)
+
+    # The lines nix-locate --minimal prints for the file, in database order
+    stdout = "".join(
+        nixindex.format_attr(cast(dict[str, object], path["origin"])) + "\n" for path, _ in packages
+    ).encode()
+    assert stdout.startswith(b"(nested.out)\n")
+
+    for ignore in ([], ["(nested"], ["(nested", "ignored"]):
+        assert nixindex.locate_files(database, ["libqux.so.4"], ignore).get(
+            "libqux.so.4"
+        ) == parse_nix_locate(stdout, ignore)
+
+
+def test_corrupt_database(tmp_path: Path):
+    database = tmp_path.joinpath("files")
+    _ = database.write_bytes(
+        nixindex.FILE_MAGIC + struct.pack("<Q", nixindex.FORMAT_VERSION) + b"\x28\xb5\x2f\xfd" + b"\xff" * 64
+    )
+    with pytest.raises(nixindex.DatabaseError):
+        _ = nixindex.locate_files(database, ["libfoo.so.1"])
+
+
+def test_invalid_database(tmp_path: Path):
+    database = tmp_path.joinpath("files")
+    _ = database.write_bytes(b"not a database")
+    with pytest.raises(nixindex.DatabaseError):
+        _ = nixindex.locate_files(database, ["libfoo.so.1"])
@@ -0,0 +1,65 @@
+from pathlib import Path
+import json
+import io
+
+import pytest
+
+from autorider.output import JsonlWriter, load_jsonl, load_output
+
+
+def test_jsonl_roundtrip(tmp_path: Path):
+    fp = io.StringIO()
+    writer = JsonlWriter(fp)
+    writer.write_package("a", {"version": "1.0", "build-systems": ["setuptools"]})
+    writer.write_package("b", {})
+    writer.write_package("c", {"version": "1.0", "wheel-depends-so": ["libfoo.so.1"]})
+    writer.write_package("c", {"version": "2.0"})
+    writer.write_so_providers({"libfoo.so.1": "foo"})
+
+    lines = fp.getvalue().splitlines()
+    assert len(lines) == 4  # Empty outputs are omitted
+
+    expected = {
+        "packages": {
+            "a": {"build-systems": ["setuptools"]},
+            "c": [
+                {"version": "1.0", "wheel-depends-so": ["libfoo.so.1"]},
+                {"version": "2.0"},
+            ],
+        },
+        "so-providers": {"libfoo.so.1": "foo"},
+    }
+    assert load_jsonl(lines) == expected
+
+    # Both formats can be loaded from disk
+    jsonl_path = tmp_path.joinpath("autorider.jsonl")
+    _ = jsonl_path.write_text(fp.getvalue())
+    assert load_output(jsonl_path) == expected
+
+    json_path = tmp_path.joinpath("autorider.json")
+    _ = json_path.write_text(json.dumps(expected, indent=2))
+    assert load_output(json_path) == expected
+
+    # A truncated stream loads what was written so far
+    _ = jsonl_path.write_text("\n".join(lines[:1]) + "\n")
+    assert load_output(jsonl_path) == {"packages": {"a": {"build-systems": ["setuptools"]}}}
+
+
+def test_load_jsonl_order():
+    fp = io.StringIO()
+    writer = JsonlWriter(fp)
+    writer.write_package("b", {"version": "1.10"})
+    writer.write_package("a", {"version": "1.0", "build-systems": ["setuptools"]})
+    writer.write_package("b", {"version": "1.9"})
+
+    # Records in completion order are sorted by name & version
+    packages = load_jsonl(fp.getvalue().splitlines()).get("packages", {})
+    assert list(packages) == ["a", "b"]
+    assert packages["b"] == [{"version": "1.9"}, {"version": "1.10"}]
+
+
+def test_load_output_invalid(tmp_path: Path):
+    path = tmp_path.joinpath("autorider.json")
+    _ = path.write_text(json.dumps({"packages": {"a": "setuptools"}}))
+    with pytest.raises(ValueError):
+        _ = load_output(path)
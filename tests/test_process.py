@@ -0,0 +1,265 @@
+from collections.abc import Callable
+from pathlib import Path
+from typing import override
+import random
+import json
+import time
+import os
+
+import pytest
+
+from autorider.cache import Cache
+from autorider.config import AutoriderConfig
+from autorider.process import lookup_sonames, process_pkgs
+from autorider.resolve import SonameResolver
+from autorider.incremental import Manifest
+from autorider.scanners import (
+    Artifact,
+    PackageScanner,
+    ScanContext,
+    ScanDepends,
+    ScanResult,
+    SdistScanner,
+    WheelResult,
+    WheelScanner,
+)
+from autorider.uv import UvPackageScanner, lock1
+from autorider import stats
+
+
+FAKE_NIX_LOCATE = """
+#!{python}
+import sys
+
+with open({log!r}, "a") as log:
+    log.write(sys.argv[-1] + "\\n")
+
+if sys.argv[-1] == "libfoo.so.1":
+    print("foo.out")
+"""
+
+
+@pytest.fixture
+def fake_nix_locate(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch, make_tool: Callable[..., Path]
+) -> Path:
+    log = tmp_path.joinpath("calls.log")
+    _ = make_tool("nix-locate", FAKE_NIX_LOCATE, log=str(log))
+
+    database_dir = tmp_path.joinpath("nix-index")
+    database_dir.mkdir()
+    _ = database_dir.joinpath("files").write_bytes(b"")
+    monkeypatch.setenv("NIX_INDEX_DATABASE", str(database_dir))
+
+    return log
+
+
+def test_lookup_sonames_cached(tmp_path: Path, fake_nix_locate: Path):
+    cache = Cache.from_dir(tmp_path.joinpath("cache"))
+    sonames = ["libfoo.so.1", "libmissing.so.1", "libc.so.6"]
+
+    expected = {"libfoo.so.1": "foo.out", "libc.so.6": "stdenv.cc.libc"}
+    assert lookup_sonames(sonames, [], cache) == expected
+    assert sorted(fake_nix_locate.read_text().splitlines()) == ["libfoo.so.1", "libmissing.so.1"]
+
+    # Both positive and negative results are served from cache
+    assert lookup_sonames(sonames, [], cache) == expected
+    assert len(fake_nix_locate.read_text().splitlines()) == 2
+
+    # A different ignore list is a different lookup
+    assert lookup_sonames(sonames, ["bar"], cache) == expected
+    assert len(fake_nix_locate.read_text().splitlines()) == 4
+
+    # Regenerating the database invalidates cached lookups
+    database = Path(os.environ["NIX_INDEX_DATABASE"]).joinpath("files")
+    _ = database.write_bytes(b"regenerated")
+    assert lookup_sonames(sonames, [], cache) == expected
+    assert len(fake_nix_locate.read_text().splitlines()) == 6
+
+
+@pytest.mark.parametrize("process_pool", [False, True])
+def test_process_pkgs(tmp_path: Path, process_pool: bool):
+    lock = lock1.loads("""
+    version = 1
+    requires-python = ">=3.12"
+
+    [[package]]
+    name = "attrs"
+    version = "23.1.0"
+    source = { path = "./fixtures/attrs-23.1.0.tar.gz" }
+    sdist = { hash = "sha256:6279836d581513a26f1bf235f9acd333bc9115683f14f7e8fae46c98fc50e015" }
+    """)
+    config = AutoriderConfig.model_validate(
+        {"outputs": {"build-systems": True}, "jobs": 2, "process-pool": process_pool}
+    )
+    context = ScanContext(cache=Cache.from_dir(tmp_path))
+
+    scanners = (UvPackageScanner(pkg) for pkg in lock.get("package", []))
+    assert process_pkgs(config, scanners, context) == {
+        "attrs": {"build-systems": ["hatchling", "hatch-vcs", "hatch-fancy-pypi-readme"]},
+    }
+
+
+class FakePackageScanner(PackageScanner):
+    """Package scanner returning canned results after a random delay"""
+
+    native_depends: set[str]
+    scanned: bool
+
+    def __init__(self, name: str, native_depends: set[str], version: str = "1.0") -> None:
+        super().__init__(name, version)
+        self.native_depends = native_depends
+        self.scanned = False
+
+    @override
+    def artifacts(self, depends: ScanDepends = ScanDepends.ALL) -> list[Artifact]:
+        return [Artifact(WheelScanner, f"{self.name}-{self.version}", Path("/nonexistent"))]
+
+    @override
+    def scan(
+        self,
+        depends: ScanDepends = ScanDepends.ALL,
+        context: ScanContext | None = None,
+    ) -> ScanResult:
+        if self.name == "broken":
+            raise RuntimeError("scan failed")
+        time.sleep(random.random() / 100)
+        self.scanned = True
+        return ScanResult(self.name, wheel=WheelResult(self.native_depends, set()))
+
+
+def test_process_pkgs_pipeline(fake_nix_locate: Path):
+    config = AutoriderConfig.model_validate({"outputs": {"wheel-depends-so": True}, "jobs": 4})
+    scanners = [
+        FakePackageScanner(f"pkg{i}", {"libfoo.so.1"} if i % 2 else {"libbar.so.2"})
+        for i in range(100)
+    ]
+
+    resolver = SonameResolver([])
+    results = process_pkgs(config, iter(scanners), ScanContext(), resolver)
+
+    # Output ordering is independent of completion order
+    assert list(results) == sorted(scanner.name for scanner in scanners)
+    assert results["pkg1"] == {"wheel-depends-so": ["libfoo.so.1"]}
+
+    # Sonames were submitted while scanning & are looked up once each
+    assert resolver.result() == {"libfoo.so.1": "foo.out"}
+    assert sorted(fake_nix_locate.read_text().splitlines()) == ["libbar.so.2", "libfoo.so.1"]
+
+
+def test_process_pkgs_pipeline_error():
+    config = AutoriderConfig.model_validate({"outputs": {"wheel-depends-so": True}})
+    scanners = [FakePackageScanner(name, set()) for name in ("a", "broken", "c")]
+
+    with pytest.raises(RuntimeError, match="scan failed"):
+        _ = process_pkgs(config, iter(scanners), ScanContext())
+
+
+def test_process_pkgs_incremental(tmp_path: Path):
+    output_path = tmp_path.joinpath("autorider.json")
+    config = AutoriderConfig.model_validate({"outputs": {"wheel-depends-so": True}})
+
+    def run(config: AutoriderConfig, scanners: list[FakePackageScanner], manifest: Manifest):
+        results = process_pkgs(config, iter(scanners), ScanContext(), manifest=manifest)
+        _ = output_path.write_text(json.dumps({"packages": results}))
+        manifest.dump(output_path)
+        return results
+
+    scanners = [
+        FakePackageScanner("a", {"liba.so.1"}),
+        FakePackageScanner("b", {"libb.so.1"}),
+        FakePackageScanner("c", set()),
+        FakePackageScanner("d", {"libd.so.1"}, "1.0"),
+        FakePackageScanner("d", {"libd.so.2"}, "2.0"),
+    ]
+    first = run(config, scanners, Manifest())
+    assert all(scanner.scanned for scanner in scanners)
+
+    # Bump b & change the output config of c
+    config = AutoriderConfig.model_validate(
+        {"outputs": {"wheel-depends-so": True}, "packages": {"c": {"sdist-depends-so": True}}}
+    )
+    scanners = [
+        FakePackageScanner("a", {"liba.so.1"}),
+        FakePackageScanner("b", {"libb.so.2"}, "1.1"),
+        FakePackageScanner("c", set()),
+        FakePackageScanner("d", {"libd.so.1"}, "1.0"),
+        FakePackageScanner("d", {"libd.so.2"}, "2.0"),
+    ]
+    second = run(config, scanners, Manifest.load(output_path))
+    assert [scanner.name for scanner in scanners if scanner.scanned] == ["b", "c"]
+    assert second == first | {"b": {"wheel-depends-so": ["libb.so.2"]}, "c": {"sdist-depends-so": []}}
+
+    # Without a manifest everything is rescanned
+    output_path.with_suffix(".manifest.json").unlink()
+    scanners = [FakePackageScanner("a", {"liba.so.1"})]
+    _ = run(config, scanners, Manifest.load(output_path))
+    assert scanners[0].scanned
+
+
+def test_process_pkgs_incremental_missing_output(tmp_path: Path):
+    output_path = tmp_path.joinpath("autorider.json")
+    config = AutoriderConfig.model_validate(
+        {"outputs": {"wheel-depends-so": True}, "packages": {"b": {"wheel-depends-so": False}}}
+    )
+
+    def run(scanners: list[FakePackageScanner], manifest: Manifest) -> None:
+        results = process_pkgs(config, iter(scanners), ScanContext(), manifest=manifest)
+        _ = output_path.write_text(json.dumps({"packages": results}))
+        manifest.dump(output_path)
+
+    run([FakePackageScanner("a", {"liba.so.1"}), FakePackageScanner("b", set())], Manifest())
+
+    # Output of a lost, e.g. by a crashed run truncating a streamed output
+    _ = output_path.write_text(json.dumps({"packages": {}}))
+    scanners = [FakePackageScanner("a", {"liba.so.1"}), FakePackageScanner("b", set())]
+    run(scanners, Manifest.load(output_path))
+
+    # The empty output of b is known to be omitted rather than lost
+    assert [scanner.name for scanner in scanners if scanner.scanned] == ["a"]
+
+
+def test_process_pkgs_streaming():
+    config = AutoriderConfig.model_validate({"outputs": {"wheel-depends-so": True}, "jobs": 4})
+    scanners = [FakePackageScanner(f"pkg{i}", {f"lib{i}.so.1"}) for i in range(50)]
+
+    # Outputs are streamed as they complete rather than retained
+    streamed: list[str] = []
+    assert process_pkgs(
+        config, iter(scanners), ScanContext(), on_output=lambda name, _: streamed.append(name)
+    ) == {}
+    assert sorted(streamed) == sorted(scanner.name for scanner in scanners)
+
+    # Collected outputs are sorted regardless of completion order
+    assert list(process_pkgs(config, iter(reversed(scanners)), ScanContext())) == sorted(
+        scanner.name for scanner in scanners
+    )
+
+
+class SharedSdistScanner(PackageScanner):
+    """Package locking the same sdist as others, without a content address"""
+
+    sdist: Path
+
+    def __init__(self, name: str, sdist: Path) -> None:
+        self.sdist = sdist
+        super().__init__(name)
+
+    @override
+    def artifacts(self, depends: ScanDepends = ScanDepends.ALL) -> list[Artifact]:
+        return [Artifact(SdistScanner, None, self.sdist)]
+
+
+def test_process_pkgs_single_flight(attrs_sdist: Path):
+    config = AutoriderConfig.model_validate({"outputs": {"build-systems": True}, "jobs": 8})
+    scanners = [SharedSdistScanner(f"pkg{i}", attrs_sdist) for i in range(16)]
+
+    _ = stats.get_stats().drain()
+    results = process_pkgs(config, iter(scanners), ScanContext())
+    assert all(
+        output == {"build-systems": ["hatchling", "hatch-vcs", "hatch-fancy-pypi-readme"]}
+        for output in results.values()
+    )
+
+    # Scanned once, with the other packages waiting on or reusing that scan
+    assert stats.get_stats().drain().counters["scan-memo-hits"] == 15
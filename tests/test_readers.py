@@ -0,0 +1,248 @@
+from collections.abc import Callable, Generator
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from contextlib import contextmanager
+from functools import partial
+from typing import IO, override
+from pathlib import Path
+import threading
+import hashlib
+import zipfile
+import random
+import re
+
+import pytest
+
+from autorider.cache import Cache
+from autorider.download import Fetcher, HTTPDownload, HTTPRangeError
+from autorider.readers import DirReader, RemoteZipReader, TarReader, ZipReader
+from autorider.scanners import (
+    Artifact,
+    ElfMemo,
+    ScanContext,
+    SdistResult,
+    SdistScanner,
+    WheelResult,
+    WheelScanner,
+    scan_artifact,
+)
+from benchmarks.synthetic import build_elf
+
+
+class RangeRequestHandler(SimpleHTTPRequestHandler):
+    """Minimal static file handler supporting single byte ranges"""
+
+    @override
+    def do_GET(self):
+        path = Path(self.translate_path(self.path))
+        data = path.read_bytes()
+
+        m = re.fullmatch(r"bytes=(\d+)-(\d+)", self.headers.get("Range", ""))
+        if not m:
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            _ = self.wfile.write(data)
+            return
+
+        start, end = int(m.group(1)), min(int(m.group(2)), len(data) - 1)
+        self.send_response(206)
+        self.send_header("Content-Range", f"bytes {start}-{end}/{len(data)}")
+        self.send_header("Content-Length", str(end - start + 1))
+        self.end_headers()
+        _ = self.wfile.write(data[start : end + 1])
+
+    @override
+    def log_message(self, format: str, *args: object) -> None:
+        pass
+
+
+class ForbiddenRangeHandler(RangeRequestHandler):
+    """Mirror refusing range requests outright"""
+
+    @override
+    def do_GET(self):
+        if "Range" in self.headers:
+            self.send_error(403)
+            return
+        super().do_GET()
+
+
+@contextmanager
+def serve(root: Path, handler: type[SimpleHTTPRequestHandler]) -> Generator[str, None, None]:
+    server = ThreadingHTTPServer(("127.0.0.1", 0), partial(handler, directory=str(root)))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield f"http://127.0.0.1:{server.server_address[1]}"
+    finally:
+        server.shutdown()
+
+
+@pytest.fixture
+def http_root(tmp_path: Path) -> Generator[tuple[Path, str], None, None]:
+    with serve(tmp_path, RangeRequestHandler) as url:
+        yield tmp_path, url
+
+
+def make_wheel(path: Path) -> None:
+    rng = random.Random(0)
+    with zipfile.ZipFile(path, "w", compression=zipfile.ZIP_DEFLATED) as zf:
+        # Large incompressible member which must not be fetched
+        zf.writestr("pkg/data.bin", rng.randbytes(8 * 1024 * 1024))
+        zf.writestr("pkg/_native.so", build_elf())
+        zf.writestr("pkg/__init__.py", b"")
+
+
+def read_members(reader_cls: type[ZipReader], *args: object) -> dict[str, bytes]:
+    members: dict[str, bytes] = {}
+
+    def callback(name: str, fp: IO[bytes]) -> None:
+        members[name] = fp.read()
+
+    def pred(name: str) -> bool:
+        return name.endswith(".so")
+
+    reader = reader_cls(*args, pred, callback)  # pyright: ignore[reportCallIssue]
+    reader.run()
+    return members
+
+
+def test_remote_zip_reader(http_root: tuple[Path, str]):
+    root, url = http_root
+    wheel = root.joinpath("pkg-1.0-cp312-cp312-manylinux_2_17_x86_64.whl")
+    make_wheel(wheel)
+    size = wheel.stat().st_size
+
+    reader = RemoteZipReader(f"{url}/{wheel.name}", size, lambda name: name.endswith(".so"), lambda name, fp: None)
+    reader.run()
+    assert reader.fp.bytes_fetched < size / 4
+
+    assert read_members(RemoteZipReader, f"{url}/{wheel.name}", size) == read_members(ZipReader, wheel)
+
+
+def test_remote_zip_size_mismatch(http_root: tuple[Path, str]):
+    root, url = http_root
+    wheel = root.joinpath("pkg-1.0-cp312-cp312-manylinux_2_17_x86_64.whl")
+    make_wheel(wheel)
+
+    with pytest.raises(HTTPRangeError):
+        _ = read_members(RemoteZipReader, f"{url}/{wheel.name}", wheel.stat().st_size + 1)
+
+
+def test_scan_wheel_range_requests(http_root: tuple[Path, str]):
+    root, url = http_root
+    wheel = root.joinpath("pkg-1.0-cp312-cp312-manylinux_2_17_x86_64.whl")
+    make_wheel(wheel)
+
+    artifact = Artifact(
+        WheelScanner, None, HTTPDownload(f"{url}/{wheel.name}", None, wheel.stat().st_size)
+    )
+    assert scan_artifact(artifact, context=ScanContext(range_requests=True)) == WheelResult(
+        {"libfoo.so.1", "libbar.so.2"},
+        {"_native.so", "libself.so.3"},
+    )
+
+
+def test_scan_wheel_range_requests_refused(tmp_path: Path, make_tool: Callable[..., Path]):
+    root = tmp_path.joinpath("www")
+    root.mkdir()
+    wheel = root.joinpath("pkg-1.0-cp312-cp312-manylinux_2_17_x86_64.whl")
+    make_wheel(wheel)
+
+    with serve(root, ForbiddenRangeHandler) as url:
+        download = HTTPDownload(
+            f"{url}/{wheel.name}",
+            f"sha256:{hashlib.sha256(wheel.read_bytes()).hexdigest()}",
+            wheel.stat().st_size,
+        )
+        # Full fetch of the fallback is served from a fake store, where every path is valid
+        _ = make_tool("nix-store", "#!{python}\n")
+        store_dir = tmp_path.joinpath("store")
+        store_dir.mkdir()
+        store_path = download.store_path(store_dir)
+        assert store_path
+        _ = store_path.write_bytes(wheel.read_bytes())
+
+        artifact = Artifact(WheelScanner, None, download)
+        context = ScanContext(range_requests=True, fetcher=Fetcher(store_dir=store_dir))
+        assert scan_artifact(artifact, context=context) == WheelResult(
+            {"libfoo.so.1", "libbar.so.2"},
+            {"_native.so", "libself.so.3"},
+        )
+
+
+def test_tar_reader_done():
+    seen: list[str] = []
+
+    def callback(name: str, _fp: IO[bytes]) -> None:
+        seen.append(name)
+
+    reader = TarReader(Path("fixtures/attrs-23.1.0.tar.gz"), lambda name: name.endswith(".py"), callback)
+    reader.run()
+    assert len(seen) > 1
+
+    # Reading stops as soon as the consumer signals it's done
+    seen.clear()
+    reader.done = lambda: len(seen) == 1
+    reader.run()
+    assert len(seen) == 1
+
+
+def test_dir_reader(tmp_path: Path):
+    for name in (".git/CMakeLists.txt", "pyproject.toml", "src/CMakeLists.txt", "a/b/c/CMakeLists.txt"):
+        path = tmp_path.joinpath(name)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        _ = path.write_text("")
+
+    seen: list[str] = []
+    reader = DirReader(tmp_path, lambda name: True, lambda name, fp: seen.append(name))
+    reader.prune = lambda name: name == ".git"
+    reader.run()
+    # Names are root-relative & closer files come first
+    assert seen == ["pyproject.toml", "src/CMakeLists.txt", "a/b/c/CMakeLists.txt"]
+
+    seen.clear()
+    reader.max_depth = 1
+    reader.run()
+    assert seen == ["pyproject.toml", "src/CMakeLists.txt"]
+
+
+def test_sdist_scanner_dir(tmp_path: Path):
+    _ = tmp_path.joinpath("pyproject.toml").write_text('[build-system]\nrequires = ["flit_core"]\n')
+    tmp_path.joinpath("node_modules", "dep").mkdir(parents=True)
+    _ = tmp_path.joinpath("node_modules", "dep", "CMakeLists.txt").write_text("")
+
+    scanner = SdistScanner(tmp_path)
+    scanner.run()
+    assert scanner.result() == SdistResult(["flit_core"], set())
+
+
+def test_wheel_scanner_elf_memo(tmp_path: Path):
+    so = build_elf()
+    for name in ("a", "b"):
+        with zipfile.ZipFile(tmp_path.joinpath(f"{name}.whl"), "w") as zf:
+            zf.writestr(f"{name}/_native.so", so)
+
+    cache = Cache(tmp_path.joinpath("cache.sqlite"))
+    parsed: list[str] = []
+
+    def scan(wheel: str, memo: ElfMemo, cache: Cache | None = None) -> WheelResult:
+        scanner = WheelScanner(tmp_path.joinpath(wheel), memo=memo, cache=cache)
+        reader_cb = scanner.reader.callback
+
+        def callback(name: str, fp: IO[bytes]) -> None:
+            parsed.append(name)
+            reader_cb(name, fp)
+
+        scanner.reader.callback = callback
+        scanner.run()
+        return scanner.result()
+
+    expected = WheelResult({"libfoo.so.1", "libbar.so.2"}, {"_native.so", "libself.so.3"})
+    memo = ElfMemo()
+    assert scan("a.whl", memo, cache) == expected
+    # Identical member of another wheel is skipped
+    assert scan("b.whl", memo) == expected
+    # Persisted entries are picked up by a fresh process
+    assert scan("b.whl", ElfMemo(), cache) == expected
+    assert parsed == ["a/_native.so"]
@@ -0,0 +1,100 @@
+from pathlib import Path
+
+import pytest
+
+from autorider.config import AutoriderConfig
+from autorider.rules import DEFAULT_INDEX, Rule, RuleIndex
+from autorider.scanners import Artifact, ScanContext, ScanDepends, SdistResult, SdistScanner
+
+
+def test_rule_index_match():
+    index = RuleIndex.compile(
+        [
+            Rule("CMakeLists.txt", ("cmake",)),
+            Rule("*.cu", ("cudaPackages.cuda_nvcc",)),
+            Rule("Makefile", ("gnumake",), max_depth=0),
+        ]
+    )
+    assert index.match("CMakeLists.txt", 3) == (Rule("CMakeLists.txt", ("cmake",)),)
+    assert [rule.match for rule in index.match("kernel.cu", 1)] == ["*.cu"]
+    assert index.match("Makefile", 0)
+    assert not index.match("Makefile", 1)
+    assert not index.match("README", 0)
+    assert index.requires == {"cmake", "cudaPackages.cuda_nvcc", "gnumake"}
+
+
+def test_rule_index_match_suffixes():
+    index = RuleIndex.compile(
+        [
+            Rule("CMakeLists.txt", ("cmake",)),
+            Rule("*.txt", ("texinfo",)),
+            Rule("*.tar.gz", ("gnutar",)),
+            Rule("*.gz", ("gzip",)),
+        ]
+    )
+
+    # Basename & suffix rules apply together
+    assert {rule.match for rule in index.match("CMakeLists.txt", 0)} == {"CMakeLists.txt", "*.txt"}
+
+    # Every dotted suffix is matched
+    assert {rule.match for rule in index.match("vendor.tar.gz", 0)} == {"*.tar.gz", "*.gz"}
+    assert [rule.match for rule in index.match("data.gz", 0)] == ["*.gz"]
+    assert not index.match("tar.gzip", 0)
+
+
+def test_rule_invalid():
+    with pytest.raises(ValueError):
+        _ = Rule("*cu", ("nvcc",))
+
+
+def test_sdist_scanner_rules(tmp_path: Path):
+    for name in ("meson.build", "src/_speedups.pyx", "rust/Cargo.toml", "README.md"):
+        path = tmp_path.joinpath(name)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        _ = path.write_text("")
+
+    scanner = SdistScanner(tmp_path)
+    scanner.run()
+    assert scanner.result() == SdistResult(
+        ["setuptools"], {"meson", "ninja", "cython", "cargo", "rustc"}
+    )
+
+
+def test_config_rules(tmp_path: Path):
+    _ = tmp_path.joinpath("kernel.cu").write_text("")
+
+    config = AutoriderConfig.model_validate(
+        {"sdist-rules": [{"match": "*.cu", "requires": ["cudaPackages.cuda_nvcc"]}]}
+    )
+    rules = config.rule_index()
+    assert rules.digest != DEFAULT_INDEX.digest
+
+    scanner = SdistScanner(tmp_path, ScanDepends.SDIST_BUILD_REQUIRES, rules=rules)
+    scanner.run()
+    assert scanner.result().build_requires == {"cudaPackages.cuda_nvcc"}
+
+    # Cached results are keyed by the rule set
+    artifact = Artifact(SdistScanner, "sha256:abc", tmp_path)
+    assert artifact.cache_key(ScanDepends.SDIST) != artifact.cache_key(
+        ScanDepends.SDIST, ScanContext(rules=rules)
+    )
+    assert artifact.cache_key(ScanDepends.SDIST_BUILD_SYSTEMS) == artifact.cache_key(
+        ScanDepends.SDIST_BUILD_SYSTEMS, ScanContext(rules=rules)
+    )
+
+
+def test_sdist_scanner_rules_depth_early_stop(tmp_path: Path):
+    for name in ("CMakeLists.txt", "a/x.py", "a/b/y.py", "a/b/c/z.py"):
+        path = tmp_path.joinpath(name)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        _ = path.write_text("")
+
+    rules = RuleIndex.compile([Rule("CMakeLists.txt", ("cmake",)), Rule("*.pyx", ("cython",), max_depth=1)])
+    assert rules.max_depth is None
+
+    scanner = SdistScanner(tmp_path, ScanDepends.SDIST_BUILD_REQUIRES, rules=rules)
+    scanner.run()
+    assert scanner.result().build_requires == {"cmake"}
+
+    # Once only the depth limited rule is left, deeper directories aren't read
+    assert scanner.reader.counts.enumerated == 2
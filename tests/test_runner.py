@@ -0,0 +1,88 @@
+from collections.abc import Callable
+from concurrent import futures
+from pathlib import Path
+import subprocess
+import time
+
+import pytest
+
+from autorider.runner import ToolRunner
+
+
+FAKE_TOOL = """
+#!{python}
+import os
+import sys
+import time
+
+# Track the peak number of concurrently running invocations
+running = {running!r}
+with open(running, "a") as fp:
+    fp.write("+\\n")
+with open(running) as fp:
+    lines = fp.read().splitlines()
+with open({peak!r}, "a") as fp:
+    fp.write(f"{{lines.count('+') - lines.count('-')}}\\n")
+
+time.sleep(float(sys.argv[1]))
+
+with open(running, "a") as fp:
+    fp.write("-\\n")
+
+if sys.argv[2] != "0":
+    sys.exit(int(sys.argv[2]))
+print("done")
+"""
+
+
+@pytest.fixture
+def fake_tool(tmp_path: Path, make_tool: Callable[..., Path]) -> tuple[Path, Path]:
+    peak = tmp_path.joinpath("peak.log")
+    script = make_tool("fake-tool", FAKE_TOOL, running=str(tmp_path.joinpath("running.log")), peak=str(peak))
+    return script, peak
+
+
+def test_runner_limit(fake_tool: tuple[Path, Path]):
+    script, peak = fake_tool
+    runner = ToolRunner({"fake-tool": 2})
+
+    results = [runner.submit([str(script), "0.2", "0"]) for _ in range(6)]
+    assert [future.result() for future in results] == [b"done\n"] * 6
+    assert max(int(line) for line in peak.read_text().splitlines()) <= 2
+    runner.close()
+
+
+def test_runner_error(fake_tool: tuple[Path, Path]):
+    script, _ = fake_tool
+    runner = ToolRunner()
+
+    with pytest.raises(subprocess.CalledProcessError):
+        _ = runner.run([str(script), "0", "3"])
+    runner.close()
+
+
+def test_runner_timeout(fake_tool: tuple[Path, Path]):
+    script, _ = fake_tool
+    runner = ToolRunner(timeout=0.2)
+
+    start = time.monotonic()
+    with pytest.raises(subprocess.TimeoutExpired):
+        _ = runner.run([str(script), "30", "0"])
+    assert time.monotonic() - start < 10
+    runner.close()
+
+
+def test_runner_cancel(fake_tool: tuple[Path, Path]):
+    script, _ = fake_tool
+    runner = ToolRunner({"fake-tool": 1})
+
+    # One running & many queued invocations are all stopped promptly
+    start = time.monotonic()
+    results = [runner.submit([str(script), "30", "0"]) for _ in range(4)]
+    time.sleep(0.2)
+    runner.cancel()
+    for future in results:
+        with pytest.raises(futures.CancelledError):
+            _ = future.result()
+    runner.close()
+    assert time.monotonic() - start < 10
@@ -0,0 +1,60 @@
+from typing import cast
+
+import pytest
+
+from autorider import stats
+from autorider.config import AutoriderConfig
+from autorider.process import lookup_sonames, process_pkgs
+from autorider.scanners import ScanContext
+from autorider.uv import UvPackageScanner, lock1
+
+
+LOCK = """
+version = 1
+requires-python = ">=3.12"
+
+[[package]]
+name = "attrs"
+version = "23.1.0"
+source = { path = "./fixtures/attrs-23.1.0.tar.gz" }
+sdist = { hash = "sha256:6279836d581513a26f1bf235f9acd333bc9115683f14f7e8fae46c98fc50e015" }
+
+[[package]]
+name = "excluded"
+version = "1.0.0"
+source = { path = "./fixtures/attrs-23.1.0.tar.gz" }
+sdist = { hash = "sha256:6279836d581513a26f1bf235f9acd333bc9115683f14f7e8fae46c98fc50e015" }
+"""
+
+
+@pytest.mark.parametrize("process_pool", [False, True])
+def test_process_pkgs_stats(process_pool: bool):
+    _ = stats.get_stats().drain()
+
+    config = AutoriderConfig.model_validate(
+        {"outputs": {"build-systems": True}, "exclude": ["excluded"], "process-pool": process_pool}
+    )
+    scanners = (UvPackageScanner(pkg) for pkg in lock1.loads(LOCK).get("package", []))
+    _ = process_pkgs(config, scanners, ScanContext())
+
+    # Counters from worker processes are merged into the parent
+    run_stats = stats.get_stats().to_json(top=5)
+    counters = run_stats["counters"]
+    assert isinstance(counters, dict)
+    assert counters["packages-scanned"] == 1
+    assert counters["packages-filtered"] == 1
+    assert counters["members-matched"] == 1  # Only pyproject.toml is read
+    assert counters["members-enumerated"] >= counters["members-matched"]
+    assert counters["artifact-bytes"] > 0
+    slowest = cast(list[dict[str, object]], run_stats["slowest-packages"])
+    assert [entry["package"] for entry in slowest] == ["attrs==23.1.0"]
+
+
+def test_lookup_sonames_stats():
+    _ = stats.get_stats().drain()
+    assert lookup_sonames(["libc.so.6", "libm.so.6"], []) == {
+        "libc.so.6": "stdenv.cc.libc",
+        "libm.so.6": "stdenv.cc.libc",
+    }
+    counters = stats.get_stats().drain().counters
+    assert counters == {"so-providers-hits": 2}
@@ -0,0 +1,59 @@
+from collections.abc import Iterator
+from pathlib import Path
+from typing import cast
+import json
+import os
+
+import pytest
+
+from autorider import trace
+from autorider.config import AutoriderConfig
+from autorider.process import process_pkgs
+from autorider.scanners import ScanContext
+from autorider.uv import UvPackageScanner, lock1
+
+
+LOCK = """
+version = 1
+requires-python = ">=3.12"
+
+[[package]]
+name = "attrs"
+version = "23.1.0"
+source = { path = "./fixtures/attrs-23.1.0.tar.gz" }
+sdist = { hash = "sha256:6279836d581513a26f1bf235f9acd333bc9115683f14f7e8fae46c98fc50e015" }
+"""
+
+
+@pytest.fixture
+def tracer() -> Iterator[trace.Tracer]:
+    yield trace.enable()
+    trace.disable()
+
+
+def test_span_disabled():
+    with trace.span("noop", "test"):
+        pass
+    assert trace.get_tracer() is None
+
+
+@pytest.mark.parametrize("process_pool", [False, True])
+def test_trace_process_pkgs(tmp_path: Path, tracer: trace.Tracer, process_pool: bool):
+    config = AutoriderConfig.model_validate(
+        {"outputs": {"build-systems": True}, "process-pool": process_pool}
+    )
+    scanners = (UvPackageScanner(pkg) for pkg in lock1.loads(LOCK).get("package", []))
+    _ = process_pkgs(config, scanners, ScanContext())
+
+    path = tmp_path.joinpath("trace.json")
+    tracer.dump(path)
+    events = cast(list[trace.TraceEvent], json.loads(path.read_text())["traceEvents"])
+
+    spans = {event["name"]: event for event in events if event["ph"] == "X"}
+    assert {"package", "scan SdistScanner", "TarReader.run", "BuildSystemPostProcessor"} <= set(spans)
+    assert spans["package"]["args"] == {"package": "attrs", "version": "23.1.0"}
+
+    # Spans from worker processes are merged with their own pid & thread names
+    assert (spans["package"]["pid"] != os.getpid()) == process_pool
+    thread_names = {(e["pid"], e["tid"]) for e in events if e["name"] == "thread_name"}
+    assert (spans["package"]["pid"], spans["package"]["tid"]) in thread_names
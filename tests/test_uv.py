@@ -1,4 +1,10 @@
-from autorider.scanners import ScanResult
+from pathlib import Path
+import sys
+
+import pytest
+
+from autorider.cache import Cache
+from autorider.scanners import ScanDepends, ScanResult
 from autorider.uv import lock1
 
 
@@ -56,7 +62,8 @@ def test_git():
     source = { git = "https://github.com/pypa/hatch.git?subdirectory=backend&rev=hatchling-v1.27.0#cbf6598e5cbce3ba9097023c5bf783001ebbcbcb" }
     """)
     assert scan_result.wheel is None
-    assert scan_result.sdist is not None and scan_result.sdist.build_systems == ["setuptools"]
+    # Hatchling bootstraps itself through backend-path
+    assert scan_result.sdist is not None and scan_result.sdist.build_systems == []
 
 
 def test_wheel():
@@ -114,3 +121,71 @@ def test_manylinux_wheel():
         "_zmq.cpython-312-x86_64-linux-gnu.so",
         "libsodium-53576c4c.so.26.2.0",
     }
+
+
+def test_scan_depends():
+    lock = lock1.loads("""
+    version = 1
+    requires-python = ">=3.12"
+
+    [[package]]
+    name = "attrs"
+    version = "23.1.0"
+    source = { path = "./fixtures/attrs-23.1.0.tar.gz" }
+    sdist = { hash = "sha256:6279836d581513a26f1bf235f9acd333bc9115683f14f7e8fae46c98fc50e015" }
+    wheels = [
+        { url = "https://example.invalid/attrs-23.1.0-cp312-cp312-manylinux_2_17_x86_64.whl", hash = "sha256:1f28b4522cdc2fb4256ac1a020c78acf9cba2c6b461ccd2c126f3aa8e8335d04", size = 61160 },
+    ]
+    """)
+    pkg = lock.get("package", [])[0]
+
+    # Nothing enabled means nothing is fetched
+    scan_result = lock1.scan_pkg(pkg, ScanDepends.NONE)
+    assert scan_result.wheel is None
+    assert scan_result.sdist is None
+
+    # The wheel is never fetched when only sdist outputs are enabled
+    scan_result = lock1.scan_pkg(pkg, ScanDepends.SDIST_BUILD_SYSTEMS)
+    assert scan_result.wheel is None
+    assert scan_result.sdist is not None and scan_result.sdist.build_systems == [
+        "hatchling",
+        "hatch-vcs",
+        "hatch-fancy-pypi-readme",
+    ]
+
+
+def test_load_packages_cached(tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    lock = tmp_path.joinpath("uv.lock")
+    _ = lock.write_text("""
+    version = 1
+    requires-python = ">=3.12"
+
+    [[package]]
+    name = "native"
+    version = "1.0"
+    source = { registry = "https://pypi.org/simple" }
+    wheels = [
+        { url = "https://example.invalid/native-1.0-cp312-cp312-macosx_11_0_arm64.whl", hash = "sha256:aa" },
+        { url = "https://example.invalid/native-1.0-cp312-cp312-manylinux_2_17_x86_64.whl", hash = "sha256:bb" },
+        { url = "https://example.invalid/native-1.0-cp312-cp312-win_amd64.whl", hash = "sha256:cc" },
+    ]
+    """)
+    cache = Cache(tmp_path.joinpath("cache.sqlite"))
+
+    packages = lock1.load_packages(lock, cache)
+    # Only the selected wheel is kept
+    assert [wheel["hash"] for wheel in packages["native"][0].get("wheels", [])] == ["sha256:bb"]
+
+    def no_parse(_s: str) -> lock1.UvLock:
+        raise AssertionError("lock parsed again")
+
+    monkeypatch.setattr(lock1, "loads", no_parse)
+    assert lock1.load_packages(lock, cache) == packages
+
+    # Indexes marshalled by another interpreter aren't loaded
+    monkeypatch.setattr(sys.implementation, "cache_tag", "cpython-399")
+    with pytest.raises(AssertionError, match="parsed again"):
+        _ = lock1.load_packages(lock, cache)
+
+    artifacts = lock1.pkg_artifacts(packages["native"][0], ScanDepends.WHEEL)
+    assert [artifact.key for artifact in artifacts] == ["sha256:bb"]